@@ -6,6 +6,7 @@ import numpy as np
 import math
 import scipy.ndimage
 from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
 import csv
 
 
@@ -67,6 +68,141 @@ def affineremap(filepath, transform, shape, alifilepath=None,
             os.path.join(outdir, os.path.basename(alifilepath) + ".png"))
 
 
+def tiledaffineremap(filepath, transform, shape, alifilepath=None,
+                     outdir="alipy_out", makepng=False, hdu=0, tilesize=1024,
+                     nthreads=None, verbose=True):
+    """
+    Same as affineremap, but for large images : the image is spline-filtered
+    once, and the output is interpolated tile by tile in a thread pool
+    (the scipy kernels release the GIL). Each tile is written straight into
+    a pre-allocated, memory-mapped output FITS, so that the aligned image is
+    never held in memory.
+
+    The computation is done in float32 when float32 is enough for the input
+    data (float32, 8 and 16 bit integers), in float64 otherwise.
+
+    :param filepath: FITS file to align
+    :type filepath: string
+
+    :param transform: as returned e.g. by alipy.ident()
+    :type transform: SimpleTransform object
+
+    :param shape: Output shape (width, height)
+    :type shape: tuple
+
+    :param alifilepath: where to save the aligned image. If None, I will put
+                        it in the outdir directory.
+    :type alifilepath: string
+
+    :param makepng: If True I make a png of the aligned image as well.
+    :type makepng: boolean
+
+    :param hdu: The hdu of the fits file that you want me to use. 0 is primary.
+                If multihdu, 1 is usually science.
+
+    :param tilesize: Side of the output tiles, in pixels.
+    :type tilesize: int
+
+    :param nthreads: Number of threads. None means one per CPU.
+    :type nthreads: int
+    """
+    inv = transform.inverse()
+    (matrix, offset) = inv.matrixform()
+
+    # The transform works on (x, y), the FITS arrays are (y, x) : we swap
+    # the axes of the transform instead of transposing the images.
+    matrix = matrix[::-1, ::-1]
+    offset = offset[::-1]
+
+    if verbose:
+        print("Reading %s ..." % (os.path.basename(filepath)))
+
+    with fits.open(filepath) as hdulist:
+        hdr = hdulist[hdu].header.copy()
+        data = hdulist[hdu].data
+        dtype = np.result_type(data.dtype, np.float32)
+        filtered = scipy.ndimage.spline_filter(data, order=3, output=dtype,
+                                               mode="constant")
+        del data
+
+    basename = os.path.splitext(os.path.basename(filepath))[0]
+
+    if alifilepath is None:
+        alifilepath = os.path.join(outdir, basename + "_affineremap.fits")
+    else:
+        outdir = os.path.split(alifilepath)[0]
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    (width, height) = shape
+    tiles = [(y0, min(y0 + tilesize, height), x0, min(x0 + tilesize, width))
+             for y0 in range(0, height, tilesize)
+             for x0 in range(0, width, tilesize)]
+
+    if verbose:
+        print("Remapping in %i tiles, %s ..." % (len(tiles), dtype.name))
+
+    outhdulist = createfits(alifilepath, shape, dtype, hdr=hdr,
+                            verbose=verbose)
+    outdata = outhdulist[0].data
+
+    def remaptile(tile):
+        (y0, y1, x0, x1) = tile
+        outdata[y0:y1, x0:x1] = scipy.ndimage.affine_transform(
+            filtered, matrix, offset=offset + np.dot(matrix, (y0, x0)),
+            output_shape=(y1 - y0, x1 - x0), output=dtype, prefilter=False)
+
+    try:
+        with ThreadPoolExecutor(nthreads) as executor:
+            # list() to raise the exceptions of the threads, if any.
+            list(executor.map(remaptile, tiles))
+    finally:
+        outhdulist.close()
+
+    if verbose:
+        print("Wrote %s" % alifilepath)
+
+    if makepng:
+        myimage = f2n.fromfits(alifilepath, verbose=False)
+        myimage.setzscale("auto", "auto")
+        myimage.makepilimage("log", negative=False)
+        myimage.writetitle(os.path.basename(alifilepath))
+        myimage.tonet(
+            os.path.join(outdir, os.path.basename(alifilepath) + ".png"))
+
+
+def createfits(outfilename, shape, dtype, hdr=None, verbose=True):
+    """
+    Creates a FITS file for a 2D image of the given shape (width, height) and
+    dtype, filled with zeros, without building the image in memory.
+    Returns the file opened in update mode, its data is a writable memmap.
+
+    If you specify a header it will be used for the image (its scaling and
+    size keywords are replaced).
+    """
+    if os.path.isfile(outfilename):
+        os.remove(outfilename)
+
+    # A dummy 1x1 image gives us a header with the BITPIX of dtype, and
+    # without the BZERO and BSCALE of the input image.
+    header = fits.PrimaryHDU(np.zeros((1, 1), dtype=dtype), hdr).header
+    header["NAXIS1"] = shape[0]
+    header["NAXIS2"] = shape[1]
+    header.tofile(outfilename)
+
+    datasize = shape[0] * shape[1] * np.dtype(dtype).itemsize
+    datasize = int(math.ceil(datasize / 2880.0)) * 2880
+    with open(outfilename, "rb+") as outfile:
+        outfile.seek(0, os.SEEK_END)
+        outfile.truncate(outfile.tell() + datasize)
+
+    if verbose:
+        print("FITS created (%i, %i) %s ..." % (shape[0], shape[1],
+                                                np.dtype(dtype).name))
+
+    return fits.open(outfilename, mode="update", memmap=True)
+
+
 def shape(filepath, hdu=0, verbose=True):
     """
     Returns the 2D shape (width, height) of a FITS image.
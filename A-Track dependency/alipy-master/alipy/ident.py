@@ -4,6 +4,7 @@ from alipy import star
 import sys
 import os
 import numpy as np
+from multiprocessing import Pool, cpu_count
 
 
 class Identification:
@@ -227,8 +228,84 @@ class Identification:
                 os.path.join("alipy_visu", self.ukn.name + "_match.png"))
 
 
+# The reference ImgCat of the worker processes, see _init_worker.
+_ref = None
+
+
+def _init_worker(ref):
+    global _ref
+    _ref = ref
+
+
+def _identify(ref, ukn, hdu, visu, skipsaturated, r, n, sexkeepcat,
+              sexrerun, verbose):
+    """
+    Builds the catalog of one unknown image and identifies it on ref.
+    """
+    if verbose:
+        print(10 * "#", "Processing %s" % (ukn))
+
+    ukn = imgcat.ImgCat(ukn, hdu=hdu)
+    ukn.makecat(rerun=sexrerun, keepcat=sexkeepcat, verbose=verbose)
+    ukn.makestarlist(skipsaturated=skipsaturated, n=n, verbose=verbose)
+    if visu:
+        ukn.showstars(verbose=verbose)
+
+    idn = Identification(ref, ukn)
+    idn.findtrans(verbose=verbose, r=r)
+    idn.calcfluxratio(verbose=verbose)
+
+    if visu:
+        ukn.showquads(verbose=verbose)
+        idn.showmatch(verbose=verbose)
+
+    return idn
+
+
+def _identify_worker(args):
+    """
+    Runs _identify in a worker process. The reference is not sent back,
+    run puts the shared one in place again.
+    """
+    idn = _identify(_ref, *args)
+    idn.ref = None
+    return idn
+
+
+def _makeref(refpath, hdu, visu, skipsaturated, r, n, sexkeepcat, sexrerun,
+             verbose, cachedir):
+    """
+    Builds the reference ImgCat with its star list and first quads, or loads
+    it from the cache.
+    """
+    cachepath = None
+    if cachedir is not None:
+        cachepath = os.path.join(cachedir, imgcat.cachename(
+            refpath, hdu=hdu, skipsaturated=skipsaturated, n=n, r=r))
+        ref = imgcat.loadcache(cachepath, filepath=refpath)
+        if ref is not None:
+            if verbose:
+                print("Reference loaded from %s" % (cachepath))
+            if visu:
+                ref.showstars(verbose=verbose)
+            return ref
+
+    ref = imgcat.ImgCat(refpath, hdu=hdu)
+    ref.makecat(rerun=sexrerun, keepcat=sexkeepcat, verbose=verbose)
+    ref.makestarlist(skipsaturated=skipsaturated, n=n, verbose=verbose)
+    if visu:
+        ref.showstars(verbose=verbose)
+    ref.makemorequads(verbose=verbose)
+
+    if cachepath is not None:
+        imgcat.savecache(ref, cachepath)
+
+    return ref
+
+
 def run(ref, ukns, hdu=0, visu=True, skipsaturated=False,
-        r=5.0, n=500, sexkeepcat=False, sexrerun=True, verbose=True):
+        r=5.0, n=500, sexkeepcat=False, sexrerun=True, verbose=True,
+        ncpu=1, cachedir=None):
     """
     Top-level function to identify transorms between images.
 
@@ -268,6 +345,17 @@ def run(ref, ukns, hdu=0, visu=True, skipsaturated=False,
                      instead of running SExtractor again on the images.
     :type sexrerun: boolean
 
+    :param ncpu: Number of processes identifying the unknown images. The
+                 reference catalog and quads are built once and shared.
+                 None uses all the CPUs.
+    :type ncpu: int
+
+    :param cachedir: If given, the star list and quads of the reference are
+                     cached in this directory, keyed by the content of the
+                     reference file and by hdu, skipsaturated, n and r, and
+                     reused by the next runs instead of running SExtractor.
+    :type cachedir: string
+
     .. todo:: Make this guy accept existing asciidata catalogs, instead of
               only FITS images.
 
@@ -276,34 +364,23 @@ def run(ref, ukns, hdu=0, visu=True, skipsaturated=False,
 
     if verbose:
         print(10 * "#", " Preparing reference ...")
-    ref = imgcat.ImgCat(ref, hdu=hdu)
-    ref.makecat(rerun=sexrerun, keepcat=sexkeepcat, verbose=verbose)
-    ref.makestarlist(skipsaturated=skipsaturated, n=n, verbose=verbose)
-    if visu:
-        ref.showstars(verbose=verbose)
-    ref.makemorequads(verbose=verbose)
-
-    identifications = []
-
-    for ukn in ukns:
-
-        if verbose:
-            print(10 * "#", "Processing %s" % (ukn))
-
-        ukn = imgcat.ImgCat(ukn, hdu=hdu)
-        ukn.makecat(rerun=sexrerun, keepcat=sexkeepcat, verbose=verbose)
-        ukn.makestarlist(skipsaturated=skipsaturated, n=n, verbose=verbose)
-        if visu:
-            ukn.showstars(verbose=verbose)
-
-        idn = Identification(ref, ukn)
-        idn.findtrans(verbose=verbose, r=r)
-        idn.calcfluxratio(verbose=verbose)
-        identifications.append(idn)
-
-        if visu:
-            ukn.showquads(verbose=verbose)
-            idn.showmatch(verbose=verbose)
+    ref = _makeref(ref, hdu, visu, skipsaturated, r, n, sexkeepcat, sexrerun,
+                   verbose, cachedir)
+
+    args = [(ukn, hdu, visu, skipsaturated, r, n, sexkeepcat, sexrerun,
+             verbose) for ukn in ukns]
+
+    if ncpu is None:
+        ncpu = cpu_count()
+
+    if ncpu > 1 and len(ukns) > 1:
+        with Pool(min(ncpu, len(ukns)), initializer=_init_worker,
+                  initargs=(ref,)) as pool:
+            identifications = pool.map(_identify_worker, args, 1)
+        for idn in identifications:
+            idn.ref = ref
+    else:
+        identifications = [_identify(ref, *arg) for arg in args]
 
     if visu:
         ref.showquads(verbose=verbose)
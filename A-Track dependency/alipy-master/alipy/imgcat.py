@@ -2,8 +2,14 @@ from alipy import star
 from alipy import pysex
 from alipy import quad
 import os
+import hashlib
+import pickle
+import tempfile
 import numpy as np
 
+# Bump this when the star lists or quads change, to invalidate the caches.
+CACHEVERSION = 1
+
 
 class ImgCat:
     """
@@ -207,6 +213,70 @@ class ImgCat:
             plt.savefig(os.path.join("alipy_visu", self.name + "_quads.png"))
 
 
+def filehash(filepath, blocksize=2 ** 20):
+    """
+    Returns the SHA-256 hex digest of the content of a file.
+    """
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cachename(filepath, hdu=0, skipsaturated=False, n=500, r=5.0):
+    """
+    Name of the cache file of a reference ImgCat : the content hash of the
+    FITS file, and the parameters the star list and quads depend on.
+    """
+    params = "v%i hdu%i sat%i n%i r%r" % (CACHEVERSION, hdu,
+                                          int(skipsaturated), n, float(r))
+    key = hashlib.sha256((filehash(filepath) + params).encode()).hexdigest()
+    return key + ".pkl"
+
+
+def savecache(imgcat, cachepath):
+    """
+    Pickles an ImgCat (star list, quads and limits, without the SExtractor
+    catalog) to cachepath.
+    """
+    cachedir = os.path.dirname(cachepath) or "."
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir, exist_ok=True)
+
+    (cat, imgcat.cat) = (imgcat.cat, None)
+    try:
+        # Written aside and renamed, so that concurrent runs never read
+        # a partial file.
+        (fd, tmppath) = tempfile.mkstemp(dir=cachedir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(imgcat, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmppath, 0o644)
+        os.replace(tmppath, cachepath)
+    finally:
+        imgcat.cat = cat
+
+
+def loadcache(cachepath, filepath=None):
+    """
+    Returns the ImgCat pickled by savecache, or None if there is no usable
+    cache file.
+    """
+    if not os.path.isfile(cachepath):
+        return None
+    try:
+        with open(cachepath, "rb") as f:
+            cached = pickle.load(f)
+    except Exception as e:
+        print("Cannot read %s : %s" % (cachepath, e))
+        return None
+    if not isinstance(cached, ImgCat):
+        return None
+    if filepath is not None:
+        cached.filepath = filepath
+    return cached
+
+
 def ccworder(a):
     """
     Sorting a coordinate array CCW to plot polygons ...
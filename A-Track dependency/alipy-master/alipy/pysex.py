@@ -20,34 +20,39 @@ Usage:
 """
 
 import os
+import shlex
 import shutil
+import subprocess
+import tempfile
 import astropy.table
 from astropy.io import fits
 import logging
 logger = logging.getLogger(__name__)
 
 
-def _check_files(conf_file, conf_args, verbose=True):
+def _check_files(conf_file, conf_args, verbose=True, workdir='.'):
     if conf_file is None:
-        os.system("source-extractor -d > .pysex.sex")
-        conf_file = '.pysex.sex'
+        conf_file = os.path.join(workdir, '.pysex.sex')
+        with open(conf_file, 'w') as f:
+            subprocess.run(['source-extractor', '-d'], stdout=f,
+                           stderr=subprocess.DEVNULL)
     if "FILTER_NAME" not in conf_args or \
        not os.path.isfile(conf_args['FILTER_NAME']):
         if verbose:
             print('No filter file found, using default filter')
-        f = open('.pysex.conv', 'w')
+        f = open(os.path.join(workdir, '.pysex.conv'), 'w')
         print("""CONV NORM
 # 3x3 ``all-ground'' convolution mask with FWHM = 2 pixels.
 1 2 1
 2 4 2
 1 2 1""", file=f)
         f.close()
-        conf_args['FILTER_NAME'] = '.pysex.conv'
+        conf_args['FILTER_NAME'] = os.path.join(workdir, '.pysex.conv')
     if 'STARNNW_NAME' not in conf_args or \
        not os.path.isfile(conf_args['STARNNW_NAME']):
         if verbose:
             print('No NNW file found, using default NNW config')
-        f = open('.pysex.nnw', 'w')
+        f = open(os.path.join(workdir, '.pysex.nnw'), 'w')
         print("""NNW
 # Neural Network Weights for the SExtractor star/galaxy classifier (V1.3)
 # inputs:     9 for profile parameters + 1 for seeing.
@@ -77,18 +82,18 @@ def _check_files(conf_file, conf_args, verbose=True):
  0.00000e+00
  1.00000e+00""", file=f)
         f.close()
-        conf_args['STARNNW_NAME'] = '.pysex.nnw'
+        conf_args['STARNNW_NAME'] = os.path.join(workdir, '.pysex.nnw')
 
     return conf_file, conf_args
 
 
-def _setup(conf_file, params):
+def _setup(conf_file, params, workdir='.'):
     try:
-        shutil.copy(conf_file, '.pysex.sex')
+        shutil.copy(conf_file, os.path.join(workdir, '.pysex.sex'))
     except:
         pass  # already created in _check_files
 
-    f = open('.pysex.param', 'w')
+    f = open(os.path.join(workdir, '.pysex.param'), 'w')
     print('\n'.join(params), file=f)
     f.close()
 
@@ -98,9 +103,10 @@ def _setup_img(image, name):
         fits.writeto(name, image)
 
 
-def _get_cmd(img, img_ref, conf_args):
+def _get_cmd(img, img_ref, conf_args, workdir='.'):
     ref = img_ref if img_ref is not None else ''
-    cmd = ' '.join(['source-extractor', ref, img, '-c .pysex.sex '])
+    cmd = ' '.join(['source-extractor', ref, img,
+                    '-c %s ' % os.path.join(workdir, '.pysex.sex')])
     args = [''.join(['-', key, ' ', str(conf_args[key])]) for key in conf_args]
     cmd += ' '.join(args)
     return cmd
@@ -114,17 +120,18 @@ def _read_cat(path='.pysex.cat'):
         return sextable
 
 
-def _cleanup():
-    files = [f for f in os.listdir('.') if '.pysex.' in f]
+def _cleanup(workdir='.'):
+    files = [f for f in os.listdir(workdir) if '.pysex.' in f]
     for f in files:
-        os.remove(f)
+        os.remove(os.path.join(workdir, f))
 
 # def run(image='', imageref='', params=[], conf_file=DEFAULT_CONF,
 # conf_args={}):
 
 
 def run(image='', imageref='', params=[], conf_file=None,
-        conf_args={}, keepcat=True, rerun=False, catdir=None):
+        conf_args={}, keepcat=True, rerun=False, catdir=None, workdir=None,
+        timeout=None):
     """
     Run sextractor on the given image with the given parameters.
 
@@ -138,6 +145,9 @@ def run(image='', imageref='', params=[], conf_file=None,
     keepcat : should I keep the sex cats ?
     rerun : should I rerun sex even when a cat is already present ?
     catdir : where to put the cats (default : next to the images)
+    workdir : where to put the temporary .pysex.* files (default : a new
+              temporary directory, so that several runs can go in parallel)
+    timeout : seconds after which sextractor is killed (default : no limit)
 
     Returns an asciidata catalog containing the sextractor output
 
@@ -157,7 +167,7 @@ def run(image='', imageref='', params=[], conf_file=None,
     if keepcat:
         if catdir:
             if not os.path.isdir(catdir):
-                os.makedirs(catdir)
+                os.makedirs(catdir, exist_ok=True)
                 # raise RuntimeError("Directory \"%s\" for pysex cats does not
                 # exist. Make it !" % (catdir))
 
@@ -173,37 +183,66 @@ def run(image='', imageref='', params=[], conf_file=None,
             return cat
 
     # Otherwise we run sex :
-    conf_args['CATALOG_NAME'] = '.pysex.cat'
-    conf_args['PARAMETERS_NAME'] = '.pysex.param'
+    if workdir is None:
+        tmpdir = workdir = tempfile.mkdtemp(prefix='pysex')
+    else:
+        tmpdir = None
+    try:
+        return _run(image, imageref, params, conf_file, conf_args, keepcat,
+                    catpath, workdir, timeout)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _run(image, imageref, params, conf_file, conf_args, keepcat, catpath,
+         workdir, timeout=None):
+    conf_args = dict(conf_args)  # the caller's dict may be shared
+    catname = os.path.join(workdir, '.pysex.cat')
+    conf_args['CATALOG_NAME'] = catname
+    conf_args['PARAMETERS_NAME'] = os.path.join(workdir, '.pysex.param')
     if 'VERBOSE_TYPE' in conf_args and conf_args['VERBOSE_TYPE'] == 'QUIET':
         verbose = False
     else:
         verbose = True
-    _cleanup()
+    _cleanup(workdir)
     if not type(image) == type(''):
-        im_name = '.pysex.fits'
+        im_name = os.path.join(workdir, '.pysex.fits')
         fits.writeto(im_name, image.transpose())
     else:
         im_name = image
     if not type(imageref) == type(''):
-        imref_name = '.pysex.ref.fits'
+        imref_name = os.path.join(workdir, '.pysex.ref.fits')
         fits.writeto(imref_name, imageref.transpose())
     else:
         imref_name = imageref
-    conf_file, conf_args = _check_files(conf_file, conf_args, verbose)
-    _setup(conf_file, params)
-    cmd = _get_cmd(im_name, imref_name, conf_args)
-    res = os.system(cmd)
-    if res:
+    conf_file, conf_args = _check_files(conf_file, conf_args, verbose,
+                                        workdir)
+    _setup(conf_file, params, workdir)
+    cmd = _get_cmd(im_name, imref_name, conf_args, workdir)
+    # No shell, but the same quoting rules for the arguments.
+    try:
+        res = subprocess.run(shlex.split(cmd), stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, timeout=timeout)
+        error = res.stderr if res.returncode else None
+    except subprocess.TimeoutExpired:
+        error = "killed after %s s" % timeout
+    except OSError as e:
+        error = str(e)
+    if error is not None:
         print("Error during sextractor execution!")
-        _cleanup()
+        print(error.strip()[-500:])
+        _cleanup(workdir)
         return
+    if verbose:
+        print(res.stderr, end='')
 
     # Keeping the cat at a permanent location :
     if keepcat and type(image) == type(''):
-        shutil.copy('.pysex.cat', catpath)
+        shutil.copy(catname, catpath)
 
     # Returning the cat :
-    cat = _read_cat()
-    _cleanup()
+    cat = _read_cat(catname)
+    _cleanup(workdir)
     return cat
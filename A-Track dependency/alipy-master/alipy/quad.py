@@ -21,16 +21,24 @@ class Quad:
     It is made out of 4 stars, and it is shift / scale / rotation invariant
     """
 
-    def __init__(self, fourstars):
+    def __init__(self, fourstars, quadhash=None):
         """
         fourstars is a list of four stars
 
         We make the following attributes :
         self.hash
         self.stars (in the order A, B, C, D)
+
+        If the quadhash is given (as computed by quadhashes), the fourstars
+        must already be in the order A, B, C, D and nothing is computed.
         """
         assert len(fourstars) == 4
 
+        if quadhash is not None:
+            self.hash = tuple(quadhash)
+            self.stars = list(fourstars)
+            return
+
         tests = [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
         other = [(2, 3), (1, 3), (1, 2), (0, 3), (0, 2), (0, 1)]
         dists = np.array([fourstars[i].distance(fourstars[j])
@@ -109,6 +117,99 @@ def mindist(fourstars):
     return np.min(dists)
 
 
+def combinations(n):
+    """
+    All the 4-combinations of range(n), as an array with one combination
+    per row, in the order of itertools.combinations.
+    """
+    combis = np.array(list(itertools.combinations(range(n), 4)), dtype=int)
+    return combis.reshape(-1, 4)
+
+
+def quadhashes(xy):
+    """
+    Computes in batch what Quad.__init__ computes for one quad.
+
+    :param xy: Coordinates of the stars of the quads, shape (m, 4, 2)
+    :type xy: numpy array
+
+    Returns (hashes, order, mindists) : the hashes (m, 4), the indexes of the
+    stars A, B, C, D in each quad (m, 4) and the minimal distance between
+    the stars of each quad (m).
+    """
+    tests = np.array([(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)])
+    other = np.array([(2, 3), (1, 3), (1, 2), (0, 3), (0, 2), (0, 1)])
+
+    diffs = xy[:, tests[:, 0], :] - xy[:, tests[:, 1], :]
+    dists = np.sqrt(np.sum(diffs ** 2, axis=2))
+    mindists = np.min(dists, axis=1)
+
+    maxindex = np.argmax(dists, axis=1)
+    order = np.column_stack([tests[maxindex], other[maxindex]])
+    rows = np.arange(len(xy))[:, np.newaxis]
+    (A, B, C, D) = np.moveaxis(xy[rows, order], 1, 0)
+
+    # The transform [[a -b], [b a]] + [c d] that brings A and B to 00 11
+    x = B[:, 0] - A[:, 0]
+    y = B[:, 1] - A[:, 1]
+    b = (x - y) / (x * x + y * y)
+    a = (1.0 / x) * (1.0 + b * y)
+    c = b * A[:, 1] - a * A[:, 0]
+    d = - (b * A[:, 0] + a * A[:, 1])
+
+    xC = a * C[:, 0] - b * C[:, 1] + c
+    yC = b * C[:, 0] + a * C[:, 1] + d
+    xD = a * D[:, 0] - b * D[:, 1] + c
+    yD = b * D[:, 0] + a * D[:, 1] + d
+
+    # Break symmetries, as in Quad.__init__ :
+    testa = xC > xD
+    testb = xC + xD > 1
+
+    hashes = np.column_stack([xC, yC, xD, yD])
+    switchcd = testa & ~testb
+    hashes[switchcd] = np.column_stack([xD, yD, xC, yC])[switchcd]
+    order[switchcd] = order[switchcd][:, [0, 1, 3, 2]]
+    switchall = testb & ~testa
+    hashes[switchall] = np.column_stack(
+        [1.0 - xD, 1.0 - yD, 1.0 - xC, 1.0 - yC])[switchall]
+    order[switchall] = order[switchall][:, [1, 0, 3, 2]]
+    switchab = testa & testb
+    hashes[switchab] = np.column_stack(
+        [1.0 - xC, 1.0 - yC, 1.0 - xD, 1.0 - yD])[switchab]
+    order[switchab] = order[switchab][:, [1, 0, 2, 3]]
+
+    return (hashes, order, mindists)
+
+
+def makequads(starlist, combis, d=50.0):
+    """
+    Makes the quads of the given combinations of stars, keeping those whose
+    stars are all more than d apart.
+
+    :param combis: indexes of the four stars of each quad in starlist,
+                   shape (m, 4)
+    :type combis: numpy array
+    """
+    combis = np.asarray(combis, dtype=int).reshape(-1, 4)
+    if len(combis) == 0:
+        return []
+
+    xy = star.listtoarray(starlist)[combis]
+    (hashes, order, mindists) = quadhashes(xy)
+
+    keep = mindists > d
+    assert np.all(mindists[keep] > 1.0)
+    assert np.all(hashes[keep, 0] <= hashes[keep, 2])
+    assert np.all(hashes[keep, 0] + hashes[keep, 2] <= 1)
+
+    rows = np.arange(len(combis))[:, np.newaxis]
+    starindexes = combis[rows, order]
+    return [Quad([starlist[i] for i in fourstars], quadhash=quadhash)
+            for (fourstars, quadhash) in zip(starindexes[keep],
+                                             hashes[keep])]
+
+
 def makequads1(starlist, n=7, s=0, d=50.0, verbose=True):
     """
     First trivial quad maker.
@@ -124,12 +225,10 @@ def makequads1(starlist, n=7, s=0, d=50.0, verbose=True):
     :type d: float
 
     """
-    quadlist = []
     sortedstars = star.sortstarlistbyflux(starlist)
 
-    for fourstars in itertools.combinations(sortedstars[s:s + n], 4):
-        if mindist(fourstars) > d:
-            quadlist.append(Quad(fourstars))
+    combis = combinations(len(sortedstars[s:s + n])) + s
+    quadlist = makequads(sortedstars, combis, d=d)
 
     if verbose:
         print(("Made %4i quads from %4i "
@@ -153,22 +252,42 @@ def makequads2(starlist, f=5.0, n=6, s=0, d=50.0, verbose=True):
     :type s: int
 
     """
-    quadlist = []
     sortedstars = star.sortstarlistbyflux(starlist)
     (xmin, xmax, ymin, ymax) = star.area(sortedstars)
 
     r = 2.0 * max(xmax - xmin, ymax - ymin) / f
 
-    for xc in np.linspace(xmin, xmax, f + 2)[1:-1]:
-        for yc in np.linspace(ymin, ymax, f + 2)[1:-1]:
-            cstar = star.Star(x=xc, y=yc)
-            das = cstar.distanceandsort(sortedstars)
-            # closest = [s["star"] for s in das[0:4]]
-            brightestwithinr = star.sortstarlistbyflux(
-                [element["star"] for element in das if element["dist"] <= r])[s:s + n]
-            for fourstars in itertools.combinations(brightestwithinr, 4):
-                if mindist(fourstars) > d:
-                    quadlist.append(Quad(fourstars))
+    if len(sortedstars) < 4:
+        return []
+
+    xy = star.listtoarray(sortedstars)
+    flux = star.listtoarray(sortedstars, full=True)[:, 2]
+    centers = [(xc, yc) for xc in np.linspace(xmin, xmax, f + 2)[1:-1]
+               for yc in np.linspace(ymin, ymax, f + 2)[1:-1]]
+
+    # The stars around each center, from a KD-tree. The radius is a bit
+    # larger, the exact cut is done on the distances below.
+    tree = scipy.spatial.cKDTree(xy)
+    neighbours = tree.query_ball_point(centers, r * (1.0 + 1e-9))
+
+    combis = []
+    for (center, indexes) in zip(centers, neighbours):
+        indexes = np.sort(np.asarray(indexes, dtype=int))
+        dists = np.sqrt(np.sum((xy[indexes] - center) ** 2, axis=1))
+        # Sorted by distance, then by flux (highest first), in the same
+        # order as sortstarlistbyflux(distanceandsort(...)).
+        order = np.argsort(dists, kind="stable")
+        indexes = indexes[order][dists[order] <= r]
+        indexes = indexes[np.argsort(flux[indexes], kind="stable")[::-1]]
+        brightestwithinr = indexes[s:s + n]
+        if len(brightestwithinr) >= 4:
+            combis.append(brightestwithinr[combinations(
+                len(brightestwithinr))])
+
+    if combis:
+        quadlist = makequads(sortedstars, np.vstack(combis), d=d)
+    else:
+        quadlist = []
 
     if verbose:
         print(("Made %4i quads from %4i stars "
@@ -222,11 +341,12 @@ def proposecands(uknquadlist, refquadlist, n=5, verbose=True):
     uknhashs = np.array([q.hash for q in uknquadlist])
     refhashs = np.array([q.hash for q in refquadlist])
 
-    # Brute force...
-    dists = scipy.spatial.distance.cdist(refhashs, uknhashs)
-    uknmindistindexes = np.argmin(dists, axis=0)
+    # Nearest ref hash of each ukn hash, from a KD-tree in the 4D hash space
+    # (no ref x ukn distance matrix).
+    reftree = scipy.spatial.cKDTree(refhashs)
+    uknmindist, uknmindistindexes = reftree.query(uknhashs, k=1)
                                   # For each ukn, the index of the closest ref
-    uknmindist = np.min(dists, axis=0)  # The corresponding distances
+                                  # and the corresponding distance
     uknbestindexes = np.argsort(uknmindist)
 
     candlist = []
@@ -100,6 +100,13 @@ class Star:
         """
         import operator  # for the sorting
 
+        if isinstance(otherstarlist, StarList):
+            dists = np.hypot(otherstarlist.x - self.x,
+                             otherstarlist.y - self.y)
+            order = np.argsort(dists, kind="stable")
+            return [{'star': otherstarlist[i], 'dist': dists[i],
+                     'origpos': i} for i in order]
+
         returnlist = []
         for i, star in enumerate(otherstarlist):
             dist = self.distance(star)
@@ -109,6 +116,155 @@ class Star:
 
         return returnlist
 
+class StarList:
+    """
+    A list of sources stored as columns (numpy arrays) instead of Star
+    objects : x, y, flux, fwhm, elon, flags and names, plus optional
+    extra columns in the props dict.
+
+    It behaves like a list of Star objects (len, iteration and integer
+    indexing give Star objects, built on the fly), so that it can be given
+    to all the functions of this module. Slicing, or indexing with an array
+    of indexes or booleans, gives a new StarList.
+    """
+
+    def __init__(self, x=(), y=(), names=None, flux=None, fwhm=None,
+                 elon=None, flags=None, props=None):
+        """
+        Columns that are not given get the default values of Star.
+        """
+        self.x = np.array(x, dtype=np.float64).reshape(-1)
+        self.y = np.array(y, dtype=np.float64).reshape(-1)
+        n = len(self.x)
+        assert len(self.y) == n
+
+        def column(values, default, dtype):
+            if values is None:
+                return np.full(n, default, dtype=dtype)
+            values = np.array(values, dtype=dtype).reshape(-1)
+            assert len(values) == n
+            return values
+
+        if names is None:
+            names = ["untitled"] * n
+        self.names = column([str(name) for name in names], "", str)
+        self.flux = column(flux, -1.0, np.float64)
+        self.fwhm = column(fwhm, -1.0, np.float64)
+        self.elon = column(elon, -1.0, np.float64)
+        self.flags = column(flags, 0, np.int64)
+        self.props = dict([[key, np.asarray(values)]
+                           for (key, values) in (props or {}).items()])
+
+    @classmethod
+    def fromstars(cls, starlist):
+        """
+        Builds a StarList from a list of Star objects. Only the FLAGS of
+        the props are kept.
+        """
+        return cls(x=[star.x for star in starlist],
+                   y=[star.y for star in starlist],
+                   names=[star.name for star in starlist],
+                   flux=[star.flux for star in starlist],
+                   fwhm=[star.fwhm for star in starlist],
+                   elon=[star.elon for star in starlist],
+                   flags=[star.props.get("FLAGS", 0) for star in starlist])
+
+    def tostars(self):
+        """
+        Returns a list of Star objects.
+        """
+        return [self[i] for i in range(len(self))]
+
+    def __len__(self):
+        return len(self.x)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        """
+        An integer gives a Star, a slice or an array of indexes or booleans
+        gives a StarList.
+        """
+        if isinstance(key, (int, np.integer)):
+            props = dict([[field, values[key]]
+                          for (field, values) in self.props.items()])
+            props["FLAGS"] = self.flags[key]
+            return Star(x=self.x[key], y=self.y[key], name=self.names[key],
+                        flux=self.flux[key], props=props,
+                        fwhm=self.fwhm[key], elon=self.elon[key])
+
+        return StarList(x=self.x[key], y=self.y[key],
+                        names=self.names[key], flux=self.flux[key],
+                        fwhm=self.fwhm[key], elon=self.elon[key],
+                        flags=self.flags[key],
+                        props=dict([[field, values[key]] for (field, values)
+                                    in self.props.items()]))
+
+    def __str__(self):
+        return "\n".join([str(star) for star in self])
+
+    def copy(self):
+        return self[:]
+
+    def coords(self, full=False):
+        """
+        Same as listtoarray : a 2D array, first index is star, second index
+        is x or y (and flux, fwhm, elon if full).
+        """
+        if full:
+            return np.column_stack([self.x, self.y, self.flux,
+                                    self.fwhm, self.elon])
+        else:
+            return np.column_stack([self.x, self.y])
+
+    def filter(self, mask):
+        """
+        Returns the stars for which mask is True.
+        """
+        return self[np.asarray(mask, dtype=bool)]
+
+    def sortby(self, measure, reverse=False):
+        """
+        Returns the stars sorted according to measure (one of flux, fwhm,
+        elon), lowest first. Same order as sortstarlistby.
+        """
+        order = np.argsort(getattr(self, measure), kind="stable")
+        if reverse:
+            order = order[::-1]
+        return self[order]
+
+    def sortbyflux(self):
+        """
+        Returns the stars sorted by flux, highest first. Same order as
+        sortstarlistbyflux.
+        """
+        return self.sortby("flux", reverse=True)
+
+    def transform(self, trans):
+        """
+        Returns the stars with the SimpleTransform trans applied.
+        """
+        transstars = self.copy()
+        (transstars.x, transstars.y) = trans.apply((self.x, self.y))
+        return transstars
+
+    def distances(self, x, y):
+        """
+        Returns the distances of the stars to the point (x, y).
+        """
+        return np.hypot(self.x - x, self.y - y)
+
+    def distanceandsort(self, x, y):
+        """
+        Returns (dists, order) : the distances to the point (x, y), and the
+        indexes of the stars sorted by distance, the closest first.
+        """
+        dists = self.distances(x, y)
+        return (dists, np.argsort(dists, kind="stable"))
+
+
 # And now some functions to manipulate list of such stars ###
 
 
@@ -129,6 +285,8 @@ def listtoarray(starlist, full=False):
     :type full: boolean
 
     """
+    if isinstance(starlist, StarList):
+        return starlist.coords(full=full)
     return np.array([star.coords(full=full) for star in starlist])
 
 
@@ -232,8 +390,7 @@ def readsexcat(sexcat, hdu=0, verbose=True,
                 the catalog. 0 will select the only available extension.
                 If multihdu, 1 is usually science.
 
-    We read a sextractor catalog with astropy.table and return a list
-    of stars.
+    We read a sextractor catalog with astropy.table and return a StarList.
     Minimal fields that must be present in the catalog :
 
         * NUMBER
@@ -302,37 +459,31 @@ def readsexcat(sexcat, hdu=0, verbose=True,
                "You have to specify which hdu to use !"))
         sys.exit(1)
 
-    propfields.append("FLAGS")
-    propfields = list(set(propfields))
+    propfields = list(set(propfields) | set(["FLAGS"]))
 
     if len(mycat) == 0:
         if verbose:
             print("No stars in the catalog :-(")
+        keep = np.zeros(0, dtype=bool)
     else:
-        for i, num in enumerate(mycat['NUMBER']):
-            if mycat['FLAGS'][i] > maxflag:
-                continue
-            if hdu != 0 and mycat['EXT_NUMBER'][i] != hdu:
-                continue
-            flux = mycat['FLUX_AUTO'][i]
-            if posflux and (flux < 0.0):
-                continue
-            fwhm = mycat['FWHM_IMAGE'][i]
-            if float(fwhm) <= minfwhm:
-                continue
-
-            props = dict([[propfield, mycat[propfield][i]]
-                         for propfield in propfields])
-
-            newstar = Star(
-                x=mycat['X_IMAGE'][i],
-                y=mycat['Y_IMAGE'][i],
-                name=str(num),
-                flux=flux,
-                props=props,
-                fwhm=mycat['FWHM_IMAGE'][i],
-                elon=mycat['ELONGATION'][i])
-            returnlist.append(newstar)
+        flux = np.asarray(mycat['FLUX_AUTO'], dtype=np.float64)
+        keep = np.asarray(mycat['FLAGS']) <= maxflag
+        if hdu != 0:
+            keep &= np.asarray(mycat['EXT_NUMBER']) == hdu
+        if posflux:
+            keep &= flux >= 0.0
+        keep &= np.asarray(mycat['FWHM_IMAGE'], dtype=np.float64) > minfwhm
+
+    returnlist = StarList(
+        x=np.asarray(mycat['X_IMAGE'])[keep],
+        y=np.asarray(mycat['Y_IMAGE'])[keep],
+        names=np.asarray(mycat['NUMBER'])[keep],
+        flux=np.asarray(mycat['FLUX_AUTO'])[keep],
+        fwhm=np.asarray(mycat['FWHM_IMAGE'])[keep],
+        elon=np.asarray(mycat['ELONGATION'])[keep],
+        flags=np.asarray(mycat['FLAGS'])[keep],
+        props=dict([[propfield, np.asarray(mycat[propfield])[keep]]
+                    for propfield in propfields if propfield != "FLAGS"]))
 
     if verbose:
         print("I've selected %i sources" % (len(returnlist)))
@@ -355,6 +506,8 @@ def sortstarlistbyflux(starlist):
     """
     We sort starlist according to flux : highest flux first !
     """
+    if isinstance(starlist, StarList):
+        return starlist.sortbyflux()
     sortedstarlist = sorted(starlist, key=operator.itemgetter('flux'))
     sortedstarlist.reverse()
     return sortedstarlist
@@ -365,6 +518,8 @@ def sortstarlistby(starlist, measure):
     We sort starlist according to measure : lowest first !
     Where measure is one of flux, fwhm, elon
     """
+    if isinstance(starlist, StarList):
+        return starlist.sortby(measure)
     sortedstarlist = sorted(starlist, key=operator.itemgetter(measure))
     return sortedstarlist
 
@@ -439,6 +594,8 @@ class SimpleTransform:
         return transstar
 
     def applystarlist(self, starlist):
+        if isinstance(starlist, StarList):
+            return starlist.transform(self)
         return [self.applystar(star) for star in starlist]
 
 
@@ -466,11 +623,14 @@ def fitstars(uknstars, refstars, verbose=True):
 
     ref = np.hstack(listtoarray(refstars))  # a 1D vector of lenth 2n
 
-    uknlist = []
-    for star in uknstars:
-        uknlist.append([star.x, -star.y, 1, 0])
-        uknlist.append([star.y, star.x, 0, 1])
-    ukn = np.vstack(np.array(uknlist))  # a matrix
+    (x, y) = listtoarray(uknstars).T
+    ukn = np.zeros((2 * len(x), 4))  # a matrix, rows [x, -y, 1, 0]
+    ukn[0::2, 0] = x                  # and [y, x, 0, 1] for each star
+    ukn[0::2, 1] = -y
+    ukn[0::2, 2] = 1
+    ukn[1::2, 0] = y
+    ukn[1::2, 1] = x
+    ukn[1::2, 3] = 1
 
     if len(uknstars) == 2:
         trans = scipy.linalg.solve(ukn, ref)
@@ -552,9 +712,10 @@ def identify(uknstars, refstars,
         ukn = listtoarray(uknstars)
     ref = listtoarray(refstars)
 
-    dists = scipy.spatial.distance.cdist(
-        ukn, ref)  # Big table of distances between ukn and ref
-    mindists = np.min(dists, axis=1)  # For each ukn, the minimal distance
+    # The two nearest refs of each ukn, from a KD-tree (a missing second
+    # neighbour comes back with an infinite distance)
+    dists, refindexes = scipy.spatial.cKDTree(ref).query(ukn, k=2)
+    mindists = dists[:, 0]  # For each ukn, the minimal distance
     minok = mindists <= r  # booleans for each ukn
     minokindexes = np.argwhere(
         minok).flatten()  # indexes of uknstars with matches
@@ -566,19 +727,19 @@ def identify(uknstars, refstars,
                                             np.mean(mindists[minok]),
                                             np.median(mindists[minok]),
                                             np.std(mindists[minok])))
-    matchuknstars = []
-    matchrefstars = []
-
-    for i in minokindexes:  # we look for the second nearest ...
-        sortedrefs = np.argsort(dists[i, :])
-        firstdist = dists[i, sortedrefs[0]]
-        seconddist = dists[i, sortedrefs[1]]
-        if seconddist > 2.0 * firstdist:  # Then the situation is clear,
-                                          # we keep it.
-            matchuknstars.append(uknstars[i])
-            matchrefstars.append(refstars[sortedrefs[0]])
-        else:
-            pass  # Then there is a companion, we skip it.
+    # We look at the second nearest : if it is more than twice as far, the
+    # situation is clear and we keep it. Otherwise there is a companion, we
+    # skip it.
+    keep = minokindexes[dists[minokindexes, 1] > 2.0 * dists[minokindexes, 0]]
+
+    if isinstance(uknstars, StarList):
+        matchuknstars = uknstars[keep]
+    else:
+        matchuknstars = [uknstars[i] for i in keep]
+    if isinstance(refstars, StarList):
+        matchrefstars = refstars[refindexes[keep, 0]]
+    else:
+        matchrefstars = [refstars[i] for i in refindexes[keep, 0]]
 
     if verbose:
         print("Filtered for companions, keeping %i/%i matches" %
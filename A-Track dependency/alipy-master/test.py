@@ -0,0 +1,193 @@
+#!/usr/bin/env py.test
+from __future__ import print_function, division
+
+import itertools
+
+import numpy as np
+import scipy.spatial
+import pytest
+
+from alipy import star, quad, imgcat
+
+
+def identify_bruteforce(uknstars, refstars, trans=None, r=5.0):
+    """The dense cdist version of star.identify, kept as a reference."""
+    if trans is not None:
+        ukn = star.listtoarray(trans.applystarlist(uknstars))
+    else:
+        ukn = star.listtoarray(uknstars)
+    ref = star.listtoarray(refstars)
+
+    dists = scipy.spatial.distance.cdist(ukn, ref)
+    minokindexes = np.argwhere(np.min(dists, axis=1) <= r).flatten()
+
+    matchuknstars = []
+    matchrefstars = []
+    for i in minokindexes:
+        sortedrefs = np.argsort(dists[i, :])
+        if dists[i, sortedrefs[1]] > 2.0 * dists[i, sortedrefs[0]]:
+            matchuknstars.append(uknstars[i])
+            matchrefstars.append(refstars[sortedrefs[0]])
+
+    return (matchuknstars, matchrefstars)
+
+
+def make_starlists(seed, n=500, ncompanions=30):
+    """A reference star list, and a rotated, scaled and shifted subset of
+    it with noise and some close companions."""
+    rng = np.random.RandomState(seed)
+    xy = rng.uniform(0, 2000, (n, 2))
+    # Close pairs, to exercise the companion rejection.
+    xy = np.vstack([xy, xy[:ncompanions] + rng.uniform(-4, 4,
+                                                       (ncompanions, 2))])
+    refstars = [star.Star(x=x, y=y, name=str(i), flux=1.0)
+                for i, (x, y) in enumerate(xy)]
+
+    trans = star.SimpleTransform((0.99 * np.cos(0.3), 0.99 * np.sin(0.3),
+                                  35.0, -20.0))
+    keep = rng.permutation(len(xy))[:int(0.8 * len(xy))]
+    uknxy = trans.inverse().apply((xy[keep, 0], xy[keep, 1]))
+    uknxy = np.array(uknxy).T + rng.normal(0, 1.0, (len(keep), 2))
+    uknstars = [star.Star(x=x, y=y, name=str(i), flux=1.0)
+                for i, (x, y) in enumerate(uknxy)]
+
+    return uknstars, refstars, trans
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("r", [2.0, 5.0, 10.0])
+def test_identify_same_as_bruteforce(seed, r):
+    uknstars, refstars, trans = make_starlists(seed)
+
+    expected = identify_bruteforce(uknstars, refstars, trans=trans, r=r)
+    result = star.identify(uknstars, refstars, trans=trans, r=r,
+                           verbose=False, getstars=True)
+
+    assert len(expected[0]) > 0
+    for got, exp in zip(result, expected):
+        assert [s.name for s in got] == [s.name for s in exp]
+
+    assert star.identify(uknstars, refstars, trans=trans, r=r,
+                         verbose=False) == len(expected[0])
+
+
+def test_identify_single_ref_star():
+    refstars = [star.Star(x=10.0, y=10.0, name="a")]
+    uknstars = [star.Star(x=11.0, y=10.0, name="b"),
+                star.Star(x=50.0, y=50.0, name="c")]
+
+    (uknmatch, refmatch) = star.identify(uknstars, refstars, r=5.0,
+                                         verbose=False, getstars=True)
+
+    assert [s.name for s in uknmatch] == ["b"]
+    assert [s.name for s in refmatch] == ["a"]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_starlist_same_as_star_objects(seed):
+    uknstars, refstars, trans = make_starlists(seed)
+    uknlist = star.StarList.fromstars(uknstars)
+    reflist = star.StarList.fromstars(refstars)
+
+    assert np.all(star.listtoarray(uknlist, full=True) ==
+                  star.listtoarray(uknstars, full=True))
+    assert ([s.name for s in star.sortstarlistbyflux(uknlist)] ==
+            [s.name for s in star.sortstarlistbyflux(uknstars)])
+    assert np.allclose(star.listtoarray(trans.applystarlist(uknlist)),
+                       star.listtoarray(trans.applystarlist(uknstars)))
+
+    expected = star.identify(uknstars, refstars, trans=trans, verbose=False,
+                             getstars=True)
+    result = star.identify(uknlist, reflist, trans=trans, verbose=False,
+                           getstars=True)
+    for got, exp in zip(result, expected):
+        assert isinstance(got, star.StarList)
+        assert [s.name for s in got] == [s.name for s in exp]
+
+    assert np.allclose(star.fitstars(result[0], result[1]).v,
+                       star.fitstars(expected[0], expected[1]).v)
+
+
+def test_starlist_indexing():
+    stars = star.StarList(x=[1.0, 2.0, 3.0], y=[4.0, 5.0, 6.0],
+                          names=["a", "b", "c"], flux=[10.0, 30.0, 20.0],
+                          flags=[0, 2, 4])
+
+    assert isinstance(stars[1], star.Star)
+    assert stars[1].name == "b"
+    assert stars[1].props["FLAGS"] == 2
+    assert [s.name for s in stars.sortbyflux()] == ["b", "c", "a"]
+    assert [s.name for s in stars.filter(stars.flags < 4)] == ["a", "b"]
+    assert len(stars[:0]) == 0
+    assert star.StarList.fromstars(stars.tostars()).names.tolist() == \
+        ["a", "b", "c"]
+
+
+def makequads2_bruteforce(starlist, f, n, d):
+    """The distanceandsort version of quad.makequads2, kept as a
+    reference."""
+    sortedstars = star.sortstarlistbyflux(starlist)
+    (xmin, xmax, ymin, ymax) = star.area(sortedstars)
+    r = 2.0 * max(xmax - xmin, ymax - ymin) / f
+
+    quadlist = []
+    for xc in np.linspace(xmin, xmax, f + 2)[1:-1]:
+        for yc in np.linspace(ymin, ymax, f + 2)[1:-1]:
+            das = star.Star(x=xc, y=yc).distanceandsort(sortedstars)
+            brightestwithinr = star.sortstarlistbyflux(
+                [e["star"] for e in das if e["dist"] <= r])[:n]
+            for fourstars in itertools.combinations(brightestwithinr, 4):
+                if quad.mindist(fourstars) > d:
+                    quadlist.append(quad.Quad(fourstars))
+    return quadlist
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_makequads_same_as_quad_objects(seed):
+    refstars = make_starlists(seed)[1]
+    starlist = star.sortstarlistbyflux(refstars)[:30]
+
+    quads = quad.makequads1(starlist, n=8, d=20.0, verbose=False)
+    quads.extend(quad.makequads2(starlist, f=3, n=6, d=20.0, verbose=False))
+
+    expected = []
+    for fourstars in itertools.combinations(
+            star.sortstarlistbyflux(starlist)[:8], 4):
+        if quad.mindist(fourstars) > 20.0:
+            expected.append(quad.Quad(fourstars))
+    expected.extend(makequads2_bruteforce(starlist, f=3, n=6, d=20.0))
+
+    assert len(quads) == len(expected) > 0
+    for (got, exp) in zip(quads, expected):
+        assert np.allclose(got.hash, exp.hash, rtol=0, atol=1e-12)
+        assert [s.name for s in got.stars] == [s.name for s in exp.stars]
+
+
+def test_reference_cache(tmp_path):
+    fitsfile = tmp_path / "ref.fits"
+    fitsfile.write_bytes(b"not really a FITS file")
+
+    ref = imgcat.ImgCat(str(fitsfile))
+    ref.cat = "a SExtractor catalog"
+    ref.starlist = star.StarList.fromstars(make_starlists(0)[1])[:50]
+    ref.makemorequads(verbose=False)
+
+    cachepath = str(tmp_path / "cache" / imgcat.cachename(str(fitsfile)))
+    imgcat.savecache(ref, cachepath)
+    assert ref.cat == "a SExtractor catalog"
+
+    cached = imgcat.loadcache(cachepath, filepath="moved.fits")
+    assert cached.filepath == "moved.fits"
+    assert cached.cat is None
+    assert cached.quadlevel == ref.quadlevel
+    assert [q.hash for q in cached.quadlist] == [q.hash for q in ref.quadlist]
+    assert np.all(cached.starlist.x == ref.starlist.x)
+
+    assert imgcat.loadcache(str(tmp_path / "missing.pkl")) is None
+
+    names = set([imgcat.cachename(str(fitsfile)),
+                 imgcat.cachename(str(fitsfile), n=200),
+                 imgcat.cachename(str(fitsfile), r=3.0)])
+    fitsfile.write_bytes(b"another file")
+    names.add(imgcat.cachename(str(fitsfile)))
+    assert len(names) == 4
@@ -18,19 +18,56 @@ from datetime import datetime
 from datetime import timedelta
 
 import math
-from os import path, system, getcwd
+from os import path, getcwd
 import numpy as np
 import pandas as pd
 
 import sep
 import sewpy
 import os
+import shutil
+import subprocess
+import tempfile
 import time
 import glob
+from io import StringIO
 from astropy.utils.exceptions import AstropyWarning
 import warnings
 
 
+def run_tool(args, timeout=None):
+
+    """
+    Runs an external tool without a shell and returns its standard output.
+    The standard error is captured and printed if the tool fails (non-zero
+    exit code, timeout or missing tool).
+    @param args: The tool and its arguments.
+    @type args: list
+    @param timeout: Seconds after which the tool is killed.
+    @type timeout: float
+    @return: str
+    """
+
+    args = [str(arg) for arg in args]
+
+    try:
+        proc = subprocess.run(args, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print("{0} was killed after {1} sec.".format(args[0], timeout))
+        return("")
+    except OSError as e:
+        print(e)
+        return("")
+
+    if proc.returncode != 0:
+        print("{0} failed with exit code {1}: {2}".format(
+            args[0], proc.returncode, proc.stderr.strip()[-500:]))
+
+    return(proc.stdout)
+
+
 class FitsOps:
 
     def __init__(self, file_name, checksum=False, ignore_missing_end=True):
@@ -413,21 +450,14 @@ class AstCalc:
         """
 
         try:
-            file_path, file_and_ext = path.split(file_name)
-            system("xy2sky {0} {1} {2} > {3}/coors".format(
-                file_name,
-                x,
-                y,
-                file_path))
-            coors = np.genfromtxt('{0}/coors'.format(file_path),
+            coors = np.genfromtxt(StringIO(run_tool(['xy2sky', file_name,
+                                                     x, y])),
                                   comments='#',
                                   invalid_raise=False,
                                   delimiter=None,
                                   usecols=(0, 1),
                                   dtype="U")
 
-            system("rm -rf {0}/coors".format(file_path))
-
             c = coordinates.SkyCoord('{0} {1}'.format(coors[0], coors[1]),
                                      unit=(u.hourangle, u.deg), frame='fk5')
 
@@ -458,21 +488,14 @@ class AstCalc:
         """
 
         try:
-            file_path, file_and_ext = path.split(file_name)
-            system("xy2sky {0} {1} {2} > {3}/coors".format(
-                file_name,
-                x,
-                y,
-                file_path))
-            coors = np.genfromtxt('{0}/coors'.format(file_path),
+            coors = np.genfromtxt(StringIO(run_tool(['xy2sky', file_name,
+                                                     x, y])),
                                   comments='#',
                                   invalid_raise=False,
                                   delimiter=None,
                                   usecols=(0, 1),
                                   dtype="U")
 
-            system("rm -rf {0}/coors".format(file_path))
-
             c = coordinates.SkyCoord('{0} {1}'.format(coors[0], coors[1]),
                                      unit=(u.hourangle, u.deg), frame='fk5')
 
@@ -568,7 +591,8 @@ class AstCalc:
                     dec=None,
                     ra_keyword="objctra",
                     dec_keyword="objctdec",
-                    overwrite=False):
+                    overwrite=False,
+                    timeout=600):
 
         """
         The astrometry engine will take any image and return
@@ -592,6 +616,10 @@ class AstCalc:
         @type ra_keyword: str
         @param dec_keyword: DEC keyword in the FITS image header
         @type dec_keyword: str
+        @param overwrite: Replace the image with the solved one.
+        @type overwrite: boolean
+        @param timeout: Seconds after which solve-field is killed.
+        @type timeout: float
         @return: boolean
         """
     
@@ -610,40 +638,38 @@ class AstCalc:
                 ra = ra.replace(" ", ":")
                 dec = dec.replace(" ", ":")
                 
-            system(("solve-field --no-plots "
-                    "--no-verify --tweak-order {0} "
-                    "--downsample {1} --overwrite --radius {2} --no-tweak "
-                    "--ra {3} --dec {4} {5}").format(tweak_order,
-                                                     downsample,
-                                                     radius,
-                                                     ra,
-                                                     dec,
-                                                     image_path))
-            # Cleaning
             if ".gz" in image_path:
                 root = '.'.join(image_path.split('.')[:-2])
             else:
                 root, extension = path.splitext(image_path)
 
-            system(("rm -rf {0}-indx.png {0}-indx.xyls "
-                    "{0}-ngc.png {0}-objs.png "
-                    "{0}.axy {0}.corr "
-                    "{0}.match {0}.rdls "
-                    "{0}.solved {0}.wcs").format(root))
+            # solve-field works in its own directory: nothing to clean.
+            tmpdir = tempfile.mkdtemp(prefix='solve')
+            try:
+                solved = path.join(tmpdir, 'solved.fits')
+                run_tool(['solve-field', '--no-plots', '--no-verify',
+                          '--tweak-order', tweak_order,
+                          '--downsample', downsample, '--overwrite',
+                          '--radius', radius, '--no-tweak',
+                          '--ra', ra, '--dec', dec,
+                          '--dir', tmpdir, '--new-fits', solved,
+                          path.abspath(image_path)], timeout=timeout)
+
+                if not path.exists(solved):
+                    print(image_path + ' cannot be solved!')
+                    return(False)
 
-            if not path.exists(root + '.new'):
-                print(image_path + ' cannot be solved!')
-                return(False)
-            else:
                 if overwrite is False:
-                    system("mv {0}.new {0}_new.fits".format(root))
+                    shutil.move(solved, "{0}_new.fits".format(root))
                     print("{0}.fits --> {0}_new.fits: solved!".format(root))
                 elif overwrite is True:
                     print("Overwrite is True!")
-                    system("mv {0}.new {0}.fits".format(root))
+                    shutil.move(solved, "{0}.fits".format(root))
                     print("{0}.new --> {0}.fits: solved!".format(root))
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
 
-                return(True)
+            return(True)
         
         except Exception as e:
             print(e)
@@ -908,7 +934,8 @@ class AstCalc:
         iraf.ccmap.setParam('update', 'yes')
         iraf.ccmap(interactive='no')
 
-        system("rm -rf {0}/coords".format(getcwd()))
+        if path.exists("{0}/coords".format(getcwd())):
+            os.remove("{0}/coords".format(getcwd()))
 
         return_list = []
         
@@ -1207,8 +1234,178 @@ class RedOps:
         print(msg)
         return(msg)
 
+    def read_rows(self, hdu, y0, y1):
+
+        """
+        Reads rows of a memory-mapped image, applying BSCALE/BZERO to the
+        rows only.
+        @param hdu: Image HDU opened with do_not_scale_image_data.
+        @type hdu: astropy.io.fits.ImageHDU
+        @param y0: First row.
+        @type y0: int
+        @param y1: Row after the last one.
+        @type y1: int
+        @return: array
+        """
+
+        rows = hdu.data[y0:y1].astype(np.float32)
+        bscale = hdu.header.get('BSCALE', 1)
+        bzero = hdu.header.get('BZERO', 0)
+
+        if bscale != 1:
+            rows *= bscale
+        if bzero != 0:
+            rows += bzero
+
+        return(rows)
+
+    def create_master(self, out_file, header, shape):
+
+        """
+        Creates a float32 master file of the given shape, with an UNCERT
+        extension, without writing its pixels. The file is opened for row
+        by row writing through memory maps.
+        @param out_file: Master FITS file.
+        @type out_file: path
+        @param header: Keywords of the master.
+        @type header: astropy.io.fits.Header
+        @param shape: (rows, columns)
+        @type shape: tuple
+        @return: astropy.io.fits.HDUList
+        """
+
+        primary = fits.PrimaryHDU().header
+        primary['BITPIX'] = -32
+        primary['NAXIS'] = 2
+        primary.insert('NAXIS', ('NAXIS1', shape[1]), after=True)
+        primary.insert('NAXIS1', ('NAXIS2', shape[0]), after=True)
+        primary.extend(header.cards, strip=True, unique=True)
+
+        uncert = fits.ImageHDU(name='UNCERT').header
+        uncert['BITPIX'] = -32
+        uncert['NAXIS'] = 2
+        uncert.insert('NAXIS', ('NAXIS1', shape[1]), after=True)
+        uncert.insert('NAXIS1', ('NAXIS2', shape[0]), after=True)
+        uncert['UTYPE'] = 'StdDevUncertainty'
+
+        size = shape[0] * shape[1] * 4
+        size += -size % 2880
+
+        with open(out_file, 'wb') as f:
+            f.write(primary.tostring().encode('ascii'))
+            f.seek(size, 1)
+            f.write(uncert.tostring().encode('ascii'))
+            f.seek(size - 1, 1)
+            f.write(b'\0')
+
+        return(fits.open(out_file, mode='update', memmap=True))
+
+    def combine(self, file_names, out_file=None, method='median',
+                sigma=3.0, memory_limit=512, gain=1.0, master_bias=None,
+                unit=u.electron):
+
+        """
+        Combines calibration frames into a master frame without holding
+        the frames in memory. The frames are memory mapped and stacked in
+        chunks of rows that fit in memory_limit; each chunk is combined
+        and written to the master file before the next one is read. The
+        uncertainty of the master is the spread of the frames divided by
+        the square root of their number, as with ccdproc.combine.
+        @param file_names: Calibration FITS files, all of the same size.
+        @type file_names: list
+        @param out_file: Master FITS file (None: a temporary file).
+        @type out_file: path
+        @param method: median, or average for a sigma-clipped mean.
+        @type method: str
+        @param sigma: Clipping limit of the average (sigma).
+        @type sigma: float
+        @param memory_limit: Memory used by a chunk of the stack (MB).
+        @type memory_limit: float
+        @param gain: Gain multiplying the frames (electron/adu).
+        @type gain: float
+        @param master_bias: Master bias subtracted from the frames.
+        @type master_bias: ccdproc.CCDData
+        @param unit: Unit of the master.
+        @type unit: astropy.units.Unit
+        @return: ccdproc.CCDData
+        """
+
+        if method not in ('median', 'average'):
+            raise ValueError("Unknown combine method: {0}".format(method))
+
+        hdus = [fits.open(file_name, memmap=True,
+                          do_not_scale_image_data=True)
+                for file_name in file_names]
+
+        try:
+            shapes = set(hdu[0].data.shape for hdu in hdus)
+            if len(shapes) != 1:
+                raise ValueError("Frames of different sizes: {0}".format(
+                    sorted(shapes)))
+            ny, nx = shapes.pop()
+
+            header = fits.Header()
+            header['BUNIT'] = str(unit)
+            header['NCOMBINE'] = (len(hdus), 'Number of combined frames')
+            header['COMBTYPE'] = (method, 'Combination of the frames')
+
+            temporary = out_file is None
+            if temporary:
+                fd, out_file = tempfile.mkstemp(suffix='.fits')
+                os.close(fd)
+
+            master = self.create_master(out_file, header, (ny, nx))
+
+            bias = getattr(master_bias, 'data', master_bias)
+
+            # The stack, and the temporary arrays of its combination.
+            rows = max(1, int(memory_limit * 1024 ** 2) //
+                       (4 * len(hdus) * nx * 4))
+            stack = np.empty((len(hdus), min(rows, ny), nx),
+                             dtype=np.float32)
+
+            try:
+                for y0 in range(0, ny, rows):
+                    y1 = min(y0 + rows, ny)
+                    chunk = stack[:, :y1 - y0]
+                    for i, hdu in enumerate(hdus):
+                        chunk[i] = self.read_rows(hdu[0], y0, y1)
+                        chunk[i] *= gain
+                        if bias is not None:
+                            chunk[i] -= bias[y0:y1]
+
+                    if method == 'median':
+                        data = np.median(chunk, axis=0)
+                        spread = 1.4826 * np.median(
+                            np.abs(chunk - data), axis=0)
+                        count = len(hdus)
+                    else:
+                        center = np.median(chunk, axis=0)
+                        clipped = np.abs(chunk - center) > \
+                            sigma * np.std(chunk, axis=0)
+                        masked = np.ma.masked_array(chunk, clipped)
+                        data = masked.mean(axis=0).filled(np.nan)
+                        spread = masked.std(axis=0).filled(np.nan)
+                        count = np.maximum((~clipped).sum(axis=0), 1)
+
+                    master[0].data[y0:y1] = data
+                    master[1].data[y0:y1] = spread / np.sqrt(count)
+            finally:
+                master.close()
+
+            combined = ccdproc.CCDData.read(out_file, hdu_uncertainty='UNCERT',
+                                            memmap=False)
+            if temporary:
+                os.remove(out_file)
+        finally:
+            for hdu in hdus:
+                hdu.close()
+
+        return(combined)
+
     def make_zero(self, image_path, out_file=False,
-                  gain=0.57, readnoise=4.11, imagetyp='Bias'):
+                  gain=0.57, readnoise=4.11, imagetyp='Bias',
+                  method='median', memory_limit=512):
 
         """
         Creates master bias file.
@@ -1220,42 +1417,36 @@ class RedOps:
         @type gain: float
         @param readnoise: Read noise for the observations (in electrons).
         @type readnoise: float
+        @param method: median, or average for a sigma-clipped mean.
+        @type method: str
+        @param memory_limit: Memory used by the frames being combined (MB).
+        @type memory_limit: float
         @return: bolean
         """
     
         images = ImageFileCollection(image_path, keywords='*')
         
-        bias_list = []
         if len(images.files_filtered(imagetyp=imagetyp)) == 0:
             print("Could not find any BIAS file!")
             raise SystemExit
 
-        for filename in images.files_filtered(imagetyp=imagetyp):
-            ccd = ccdproc.CCDData.read(images.location + filename,
-                                       unit=u.adu)
-            
-            data_with_deviation = ccdproc.create_deviation(
-                ccd,
-                gain=gain * u.electron/u.adu,
-                readnoise=readnoise * u.electron)
-            
-            gain_corrected = ccdproc.gain_correct(data_with_deviation,
-                                                  gain*u.electron/u.adu)
-            
-            bias_list.append(gain_corrected)
+        bias_files = [images.location + filename for filename in
+                      images.files_filtered(imagetyp=imagetyp)]
 
-        master_bias = ccdproc.combine(bias_list, method='median')
-        
+        master_file = None
         if out_file:
             head, tail = os.path.split(image_path)
-            master_bias.write("{0}/master_bias.fits".format(head),
-                              overwrite=True)
+            master_file = "{0}/master_bias.fits".format(head)
+
+        master_bias = self.combine(bias_files, master_file, method=method,
+                                   memory_limit=memory_limit, gain=gain)
 
         print(">>> Master bias file is created.")
         return(master_bias)
 
     def make_dark(self, image_path, out_file=False,
-                  gain=0.57, readnoise=4.11, imagetyp='Dark'):
+                  gain=0.57, readnoise=4.11, imagetyp='Dark',
+                  method='median', memory_limit=512):
 
         """
         Creates master bias file.
@@ -1267,12 +1458,15 @@ class RedOps:
         @type gain: float
         @param readnoise: Read noise for the observations (in electrons).
         @type readnoise: float
+        @param method: median, or average for a sigma-clipped mean.
+        @type method: str
+        @param memory_limit: Memory used by the frames being combined (MB).
+        @type memory_limit: float
         @return: bolean
         """
 
         images = ImageFileCollection(image_path, keywords='*')
 
-        dark_list = []
         if len(images.files_filtered(imagetyp=imagetyp)) == 0:
             print("Could not find any DARK file!")
             raise SystemExit
@@ -1287,30 +1481,21 @@ class RedOps:
 
         print(">>> Dark exposures: {0}".format(dark_exptimes))
 
+        master_darks = {}
         for dark_exptime in dark_exptimes:
-            master_darks = {}
-            for filename in images.files_filtered(imagetyp=imagetyp,
-                                                  exptime=dark_exptime):
-                ccd = ccdproc.CCDData.read(images.location + filename,
-                                           unit=u.adu)
-
-                data_with_deviation = ccdproc.create_deviation(
-                    ccd,
-                    gain=gain * u.electron/u.adu,
-                    readnoise=readnoise * u.electron)
-
-                gain_corrected = ccdproc.gain_correct(data_with_deviation,
-                                                      gain*u.electron/u.adu)
-
-                dark_list.append(gain_corrected)
-
-            master_darks[dark_exptime] = ccdproc.combine(dark_list, method='median')
+            dark_files = [images.location + filename for filename in
+                          images.files_filtered(imagetyp=imagetyp,
+                                                exptime=dark_exptime)]
 
+            master_file = None
             if out_file:
                 head, tail = os.path.split(image_path)
-                master_darks[dark_exptime].write("{0}/master_dark_{1}.fits".format(head,
-                                                                    dark_exptime),
-                                                 overwrite=True)
+                master_file = "{0}/master_dark_{1}.fits".format(head,
+                                                                dark_exptime)
+
+            master_darks[dark_exptime] = self.combine(
+                dark_files, master_file, method=method,
+                memory_limit=memory_limit, gain=gain)
 
         print(">>> Master dark file is created.")
         return master_darks
@@ -1318,7 +1503,8 @@ class RedOps:
     def make_flat(self, image_path, out_file=False, filter=None,
                   imagetyp='Flat',
                   master_bias=None,
-                  gain=0.57, readnoise=4.11):
+                  gain=0.57, readnoise=4.11,
+                  method='median', memory_limit=512):
 
         """
         Creates master flat file.
@@ -1334,14 +1520,15 @@ class RedOps:
         @type gain: float
         @param readnoise: Read noise for the observations (in electrons).
         @type readnoise: float
+        @param method: median, or average for a sigma-clipped mean.
+        @type method: str
+        @param memory_limit: Memory used by the frames being combined (MB).
+        @type memory_limit: float
         @return: bolean
         """
 
         images = ImageFileCollection(image_path, keywords='*')
 
-        # create the flat fields
-        flat_list = []
-        
         if len(images.files_filtered(imagetyp=imagetyp,
                                      filter=filter)) == 0:
             print("Could not find any FLAT file with {0} filter!".format(
@@ -1349,30 +1536,18 @@ class RedOps:
             raise SystemExit
             return(False)
 
-        for filename in images.files_filtered(imagetyp=imagetyp,
-                                              filter=filter):
-            ccd = ccdproc.CCDData.read(images.location + filename,
-                                       unit=u.adu)
-
-            data_with_deviation = ccdproc.create_deviation(
-                ccd,
-                gain=gain * u.electron/u.adu,
-                readnoise=readnoise * u.electron)
-
-            gain_corrected = ccdproc.gain_correct(data_with_deviation,
-                                                  gain*u.electron/u.adu)
-
-            if master_bias:
-                gain_corrected = ccdproc.subtract_bias(gain_corrected,
-                                                       master_bias)
-            flat_list.append(gain_corrected)
-
-        master_flat = ccdproc.combine(flat_list, method='median')
+        flat_files = [images.location + filename for filename in
+                      images.files_filtered(imagetyp=imagetyp,
+                                            filter=filter)]
 
+        master_file = None
         if out_file:
             head, tail = os.path.split(image_path)
-            master_flat.write("{0}/master_flat.fits".format(head),
-                              overwrite=True)
+            master_file = "{0}/master_flat.fits".format(head)
+
+        master_flat = self.combine(flat_files, master_file, method=method,
+                                   memory_limit=memory_limit, gain=gain,
+                                   master_bias=master_bias)
 
         print(">>> Master flat file is created.")
         return(master_flat)
@@ -1442,12 +1617,13 @@ class RedOps:
         atmp = "{0}/atmp/".format(os.getcwd())
 
         # create tmp working dir.
-        os.system("rm -rf {0}".format(atmp))
+        shutil.rmtree(atmp, ignore_errors=True)
         os.makedirs(atmp)
 
         # copy all files to temp
 
-        os.system("cp -rv {0}/*.f*t* {1}".format(image_path, atmp))
+        for fits_file in glob.glob("{0}/*.f*t*".format(image_path)):
+            shutil.copy(fits_file, atmp)
         print(">>> Scientific images are copied!")
 
         if not os.path.exists(bdf_path) and bias_cor is not None \
@@ -1455,10 +1631,8 @@ class RedOps:
             print("BDF directory does not exist!")
             raise SystemExit
 
-        if len(glob.glob("{0}/*.f*t*".format(bdf_path))) > 0:
-            os.system("cp -rv {0}/*.f*t* {1}".format(
-                    bdf_path,
-                    atmp))
+        for fits_file in glob.glob("{0}/*.f*t*".format(bdf_path)):
+            shutil.copy(fits_file, atmp)
         
         print(">>> Calibration images are copied!")
 
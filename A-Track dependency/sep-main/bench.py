@@ -6,6 +6,18 @@ import time
 import numpy as np
 import sep
 
+try:
+    xrange
+except NameError:
+    xrange = range
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    from multiprocessing import cpu_count
+    HAVE_FUTURES = True
+except ImportError:
+    HAVE_FUTURES = False
+
 # try to import photutils for comparison timing
 try:
     import photutils
@@ -106,6 +118,32 @@ for ntile in [4]:
 
     print(line)
 
+#------------------------------------------------------------------------------
+# Background with several threads
+
+if HAVE_FUTURES:
+    nthreads_list = [1]
+    while nthreads_list[-1] * 2 <= max(2, cpu_count()):
+        nthreads_list.append(nthreads_list[-1] * 2)
+
+    for size in [4096, 8192]:
+        data = np.random.normal(100., 5., (size, size)).astype(np.float32)
+        nloop = 3
+        t_serial = None
+        for nthreads in nthreads_list:
+            t0 = time.time()
+            for _ in xrange(0, nloop):
+                bkg = sep.Background(data, nthreads=nthreads)
+            t1 = time.time()
+            t_sep = (t1-t0) * 1.e3 / nloop
+            if t_serial is None:
+                t_serial = t_sep
+            line = "| {0:4d}^2 bkg {1:2d} threads   |".format(size, nthreads)
+            line += "      {0:7.2f} ms | x{1:.2f}".format(t_sep,
+                                                      t_serial / t_sep)
+            print(line)
+        del data
+
 #------------------------------------------------------------------------------
 # Circular aperture photometry benchmarks
 
@@ -183,3 +221,42 @@ for r in r_list:
             line += " {0:7.2f} us/aper | {1:6.2f} |".format(t_pu, t_pu/t_sep)
 
         print(line)
+
+#------------------------------------------------------------------------------
+# Thread scaling: the C calls release the GIL, so several images can be
+# processed at once by a pool of threads.
+
+def process(image):
+    bkg = sep.Background(image)
+    image = image - bkg
+    objects = sep.extract(image, 1.5, err=bkg.globalrms)
+    flux, fluxerr, flag = sep.sum_circle(image, objects['x'], objects['y'],
+                                         5.0, err=bkg.globalrms)
+    return len(objects)
+
+if HAVE_FITS and HAVE_FUTURES:
+    nimage = 8
+    images = [np.tile(rawdata, (8, 8)).astype(np.float32)
+              for _ in range(nimage)]
+
+    print("")
+    label = "{0:d} x {1:4d}^2 images".format(nimage, images[0].shape[0])
+    print("| {0:23s} | threads | time       | speedup |".format(label))
+    print("|-------------------------|---------|------------|---------|")
+
+    t0 = time.time()
+    serial = [process(image) for image in images]
+    t_serial = time.time() - t0
+    print("| serial                  |       1 | {0:7.2f} ms |    1.00 |"
+          .format(t_serial * 1.e3))
+
+    nthreads = 2
+    while nthreads <= max(2, cpu_count()):
+        with ThreadPoolExecutor(nthreads) as executor:
+            t0 = time.time()
+            result = list(executor.map(process, images))
+            t = time.time() - t0
+        assert result == serial
+        print("| thread pool             | {0:7d} | {1:7.2f} ms | {2:7.2f} |"
+              .format(nthreads, t * 1.e3, t_serial / t))
+        nthreads *= 2
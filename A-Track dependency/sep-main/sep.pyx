@@ -52,13 +52,15 @@ APER_HASMASKED = np.short(0x0020)
 APER_ALLMASKED = np.short(0x0040)
 APER_NONPOSITIVE = np.short(0x0080)
 
-# macro defintion from sepcore.h
-# This is not part of the SEP API, but we pull it out because want to
-# explicitly detect memory errors so that we can raise MemoryError().
+# macro defintions from sepcore.h
+# These are not part of the SEP API, but we pull them out because want to
+# check the status of calls made without the GIL, and explicitly detect
+# memory errors so that we can raise MemoryError().
+DEF RETURN_OK = 0
 DEF MEMORY_ALLOC_ERROR = 1
 
 # header definitions
-cdef extern from "sep.h":
+cdef extern from "sep.h" nogil:
 
     ctypedef struct sep_image:
         const void *data
@@ -123,6 +125,13 @@ cdef extern from "sep.h":
                        double fthresh,
                        sep_bkg **bkg)
 
+    int sep_background_threads(const sep_image *im,
+                               int bw, int bh,
+                               int fw, int fh,
+                               double fthresh,
+                               int nthreads,
+                               sep_bkg **bkg)
+
     float sep_bkg_global(const sep_bkg *bkg)
     float sep_bkg_globalrms(const sep_bkg *bkg)
     int sep_bkg_array(const sep_bkg *bkg, void *arr, int dtype)
@@ -376,7 +385,7 @@ cdef int _parse_arrays(np.ndarray data, err, var, mask, segmap,
 cdef class Background:
     """
     Background(data, mask=None, maskthresh=0.0, bw=64, bh=64,
-               fw=3, fh=3, fthresh=0.0)
+               fw=3, fh=3, fthresh=0.0, nthreads=1)
 
     Representation of spatially variable image background and noise.
 
@@ -398,6 +407,10 @@ cdef class Background:
         Filter width and height in boxes. Default is 3.
     fthresh : float, optional
         Filter threshold. Default is 0.0.
+    nthreads : int, optional
+        Number of threads computing the statistics of the background boxes
+        (rows of boxes are shared between the threads). The result does not
+        depend on it. Default is 1.
     """
 
     cdef sep_bkg *ptr      # pointer to C struct
@@ -407,14 +420,18 @@ cdef class Background:
     @cython.wraparound(False)
     def __cinit__(self, np.ndarray data not None, np.ndarray mask=None,
                   float maskthresh=0.0, int bw=64, int bh=64,
-                  int fw=3, int fh=3, float fthresh=0.0):
+                  int fw=3, int fh=3, float fthresh=0.0, int nthreads=1):
 
         cdef int status
         cdef sep_image im
+        cdef sep_bkg *ptr = NULL
 
         _parse_arrays(data, None, None, mask, None, &im)
         im.maskthresh = maskthresh
-        status = sep_background(&im, bw, bh, fw, fh, fthresh, &self.ptr)
+        with nogil:
+            status = sep_background_threads(&im, bw, bh, fw, fh, fthresh,
+                                            nthreads, &ptr)
+        self.ptr = ptr
         _assert_ok(status)
 
         self.orig_dtype = data.dtype
@@ -423,9 +440,9 @@ cdef class Background:
     # for the docstring.
     def __init__(self, np.ndarray data not None, np.ndarray mask=None,
                  float maskthresh=0.0, int bw=64, int bh=64,
-                 int fw=3, int fh=3, float fthresh=0.0):
+                 int fw=3, int fh=3, float fthresh=0.0, int nthreads=1):
         """Background(data, mask=None, maskthresh=0.0, bw=64, bh=64,
-                      fw=3, fh=3, fthresh=0.0)"""
+                      fw=3, fh=3, fthresh=0.0, nthreads=1)"""
         pass
 
     property globalback:
@@ -454,8 +471,9 @@ cdef class Background:
         back : `~numpy.ndarray`
             Array with same dimensions as original data.
         """
-        cdef int sep_dtype
+        cdef int status, sep_dtype
         cdef np.uint8_t[:, :] buf
+        cdef sep_bkg *ptr
 
         if dtype is None:
             dtype = self.orig_dtype
@@ -465,7 +483,9 @@ cdef class Background:
 
         result = np.empty((self.ptr.h, self.ptr.w), dtype=dtype)
         buf = result.view(dtype=np.uint8)
-        status = sep_bkg_array(self.ptr, &buf[0, 0], sep_dtype)
+        ptr = self.ptr
+        with nogil:
+            status = sep_bkg_array(ptr, &buf[0, 0], sep_dtype)
         _assert_ok(status)
 
         return result
@@ -486,8 +506,9 @@ cdef class Background:
         rms : `~numpy.ndarray`
             Array with same dimensions as original data.
         """
-        cdef int sep_dtype
+        cdef int status, sep_dtype
         cdef np.uint8_t[:, :] buf
+        cdef sep_bkg *ptr
 
         if dtype is None:
             dtype = self.orig_dtype
@@ -497,7 +518,9 @@ cdef class Background:
 
         result = np.empty((self.ptr.h, self.ptr.w), dtype=dtype)
         buf = result.view(dtype=np.uint8)
-        status = sep_bkg_rmsarray(self.ptr, &buf[0, 0], sep_dtype)
+        ptr = self.ptr
+        with nogil:
+            status = sep_bkg_rmsarray(ptr, &buf[0, 0], sep_dtype)
         _assert_ok(status)
 
         return result
@@ -519,6 +542,7 @@ cdef class Background:
 
         cdef int w, h, status, sep_dtype
         cdef np.uint8_t[:, :] buf
+        cdef sep_bkg *ptr
 
         assert self.ptr is not NULL
 
@@ -531,7 +555,9 @@ cdef class Background:
             raise ValueError("Data dimensions do not match background "
                              "dimensions")
 
-        status = sep_bkg_subarray(self.ptr, &buf[0, 0], sep_dtype)
+        ptr = self.ptr
+        with nogil:
+            status = sep_bkg_subarray(ptr, &buf[0, 0], sep_dtype)
         _assert_ok(status)
 
     def __array__(self, dtype=None):
@@ -729,11 +755,12 @@ def extract(np.ndarray data not None, float thresh, err=None, var=None,
     else:
         thresh_type = SEP_THRESH_REL
 
-    status = sep_extract(&im,
-                         thresh, thresh_type, minarea,
-                         kernelptr, kernelw, kernelh, filter_typecode,
-                         deblend_nthresh, deblend_cont, clean, clean_param,
-                         &catalog)
+    with nogil:
+        status = sep_extract(&im,
+                             thresh, thresh_type, minarea,
+                             kernelptr, kernelw, kernelh, filter_typecode,
+                             deblend_nthresh, deblend_cont, clean,
+                             clean_param, &catalog)
     _assert_ok(status)
 
     # Allocate result record array and fill it
@@ -954,23 +981,27 @@ def sum_circle(np.ndarray data not None, x, y, r,
 
         it = np.broadcast(x, y, r, seg_id, sum, sumerr, flag)
 
-        while np.PyArray_MultiIter_NOTDONE(it):
-
-            status = sep_sum_circle(
-                &im,
-                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                (<int*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                subpix, 0,
-                <double*>np.PyArray_MultiIter_DATA(it, 4),
-                <double*>np.PyArray_MultiIter_DATA(it, 5),
-                &area1,
-                <short*>np.PyArray_MultiIter_DATA(it, 6))
-            _assert_ok(status)
-
-            # Advance the iterator
-            np.PyArray_MultiIter_NEXT(it)
+        status = RETURN_OK
+        with nogil:
+            while np.PyArray_MultiIter_NOTDONE(it):
+
+                status = sep_sum_circle(
+                    &im,
+                    (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                    (<int*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                    subpix, 0,
+                    <double*>np.PyArray_MultiIter_DATA(it, 4),
+                    <double*>np.PyArray_MultiIter_DATA(it, 5),
+                    &area1,
+                    <short*>np.PyArray_MultiIter_DATA(it, 6))
+                if status != RETURN_OK:
+                    break
+
+                # Advance the iterator
+                np.PyArray_MultiIter_NEXT(it)
+        _assert_ok(status)
 
         return sum, sumerr, flag
 
@@ -988,37 +1019,42 @@ def sum_circle(np.ndarray data not None, x, y, r,
         flag = np.empty(shape, np.short)
 
         it = np.broadcast(x, y, r, rin, rout, seg_id, sum, sumerr, flag)
-        while np.PyArray_MultiIter_NOTDONE(it):
-            status = sep_sum_circle(
-                &im,
-                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                (<int*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                subpix, 0, &flux1, &fluxerr1, &area1, &flag1)
-            _assert_ok(status)
-
-            # background subtraction
-            # Note that background output flags are not used.
-            status = sep_sum_circann(
-                &im,
-                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                (<int*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                1, SEP_MASK_IGNORE, &bkgflux, &bkgfluxerr, &bkgarea, &bkgflag)
-            _assert_ok(status)
-
-            if area1 > 0:
-              flux1 -= bkgflux / bkgarea * area1
-              bkgfluxerr = bkgfluxerr / bkgarea * area1
-              fluxerr1 = sqrt(fluxerr1*fluxerr1 + bkgfluxerr*bkgfluxerr)
-            (<double*>np.PyArray_MultiIter_DATA(it, 6))[0] = flux1
-            (<double*>np.PyArray_MultiIter_DATA(it, 7))[0] = fluxerr1
-            (<short*>np.PyArray_MultiIter_DATA(it, 8))[0] = flag1
-
-            np.PyArray_MultiIter_NEXT(it)
+        status = RETURN_OK
+        with nogil:
+            while np.PyArray_MultiIter_NOTDONE(it):
+                status = sep_sum_circle(
+                    &im,
+                    (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                    (<int*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                    subpix, 0, &flux1, &fluxerr1, &area1, &flag1)
+                if status != RETURN_OK:
+                    break
+
+                # background subtraction
+                # Note that background output flags are not used.
+                status = sep_sum_circann(
+                    &im,
+                    (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                    (<int*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                    1, SEP_MASK_IGNORE, &bkgflux, &bkgfluxerr, &bkgarea, &bkgflag)
+                if status != RETURN_OK:
+                    break
+
+                if area1 > 0:
+                  flux1 -= bkgflux / bkgarea * area1
+                  bkgfluxerr = bkgfluxerr / bkgarea * area1
+                  fluxerr1 = sqrt(fluxerr1*fluxerr1 + bkgfluxerr*bkgfluxerr)
+                (<double*>np.PyArray_MultiIter_DATA(it, 6))[0] = flux1
+                (<double*>np.PyArray_MultiIter_DATA(it, 7))[0] = fluxerr1
+                (<short*>np.PyArray_MultiIter_DATA(it, 8))[0] = flag1
+
+                np.PyArray_MultiIter_NEXT(it)
+        _assert_ok(status)
 
         return sum, sumerr, flag
 
@@ -1134,23 +1170,27 @@ def sum_circann(np.ndarray data not None, x, y, rin, rout,
     # it = np.broadcast(x, y, rin, rout, sum, sumerr, flag)
     it = np.broadcast(x, y, rin, rout, seg_id, sum, sumerr, flag)
 
-    while np.PyArray_MultiIter_NOTDONE(it):
-        status = sep_sum_circann(
-            &im,
-            (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-            (<int*>np.PyArray_MultiIter_DATA(it, 4))[0],
-            subpix, 0,
-            <double*>np.PyArray_MultiIter_DATA(it, 5),
-            <double*>np.PyArray_MultiIter_DATA(it, 6),
-            &area1,
-            <short*>np.PyArray_MultiIter_DATA(it, 7))
+    status = RETURN_OK
+    with nogil:
+        while np.PyArray_MultiIter_NOTDONE(it):
+            status = sep_sum_circann(
+                &im,
+                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                (<int*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                subpix, 0,
+                <double*>np.PyArray_MultiIter_DATA(it, 5),
+                <double*>np.PyArray_MultiIter_DATA(it, 6),
+                &area1,
+                <short*>np.PyArray_MultiIter_DATA(it, 7))
 
-        _assert_ok(status)
+            if status != RETURN_OK:
+                break
 
-        np.PyArray_MultiIter_NEXT(it)
+            np.PyArray_MultiIter_NEXT(it)
+    _assert_ok(status)
 
     return sum, sumerr, flag
 
@@ -1292,24 +1332,28 @@ def sum_ellipse(np.ndarray data not None, x, y, a, b, theta, r=1.0,
 
         #it = np.broadcast(x, y, a, b, theta, r, sum, sumerr, flag)
         it = np.broadcast(x, y, a, b, theta, r, seg_id, sum, sumerr, flag)
-        while np.PyArray_MultiIter_NOTDONE(it):
-            status = sep_sum_ellipse(
-                &im,
-                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                (<int*>np.PyArray_MultiIter_DATA(it, 6))[0],
-                subpix, 0,
-                <double*>np.PyArray_MultiIter_DATA(it, 7),
-                <double*>np.PyArray_MultiIter_DATA(it, 8),
-                &area1,
-                <short*>np.PyArray_MultiIter_DATA(it, 9))
-            _assert_ok(status)
-
-            np.PyArray_MultiIter_NEXT(it)
+        status = RETURN_OK
+        with nogil:
+            while np.PyArray_MultiIter_NOTDONE(it):
+                status = sep_sum_ellipse(
+                    &im,
+                    (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                    (<int*>np.PyArray_MultiIter_DATA(it, 6))[0],
+                    subpix, 0,
+                    <double*>np.PyArray_MultiIter_DATA(it, 7),
+                    <double*>np.PyArray_MultiIter_DATA(it, 8),
+                    &area1,
+                    <short*>np.PyArray_MultiIter_DATA(it, 9))
+                if status != RETURN_OK:
+                    break
+
+                np.PyArray_MultiIter_NEXT(it)
+        _assert_ok(status)
 
         return sum, sumerr, flag
 
@@ -1328,43 +1372,48 @@ def sum_ellipse(np.ndarray data not None, x, y, a, b, theta, r=1.0,
 
         # it = np.broadcast(x, y, a, b, theta, r, rin, rout, sum, sumerr, flag)
         it = np.broadcast(x, y, a, b, theta, r, rin, rout, seg_id, sum, sumerr, flag)
-        while np.PyArray_MultiIter_NOTDONE(it):
-            status = sep_sum_ellipse(
-                &im,
-                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                (<int*>np.PyArray_MultiIter_DATA(it, 8))[0],
-                subpix, 0, &flux1, &fluxerr1, &area1, &flag1)
-            _assert_ok(status)
-
-            status = sep_sum_ellipann(
-                &im,
-                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 6))[0],
-                (<double*>np.PyArray_MultiIter_DATA(it, 7))[0],
-                (<int*>np.PyArray_MultiIter_DATA(it, 8))[0],
-                subpix, 0, &bkgflux, &bkgfluxerr, &bkgarea, &bkgflag)
-            _assert_ok(status)
-
-            if area1 > 0:
-              flux1 -= bkgflux / bkgarea * area1
-              bkgfluxerr = bkgfluxerr / bkgarea * area1
-              fluxerr1 = sqrt(fluxerr1*fluxerr1 + bkgfluxerr*bkgfluxerr)
-
-            (<double*>np.PyArray_MultiIter_DATA(it, 9))[0] = flux1
-            (<double*>np.PyArray_MultiIter_DATA(it, 10))[0] = fluxerr1
-            (<short*>np.PyArray_MultiIter_DATA(it, 11))[0] = flag1
-
-            #PyArray_MultiIter_NEXT is used to advance the iterator
-            np.PyArray_MultiIter_NEXT(it)
+        status = RETURN_OK
+        with nogil:
+            while np.PyArray_MultiIter_NOTDONE(it):
+                status = sep_sum_ellipse(
+                    &im,
+                    (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                    (<int*>np.PyArray_MultiIter_DATA(it, 8))[0],
+                    subpix, 0, &flux1, &fluxerr1, &area1, &flag1)
+                if status != RETURN_OK:
+                    break
+
+                status = sep_sum_ellipann(
+                    &im,
+                    (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 6))[0],
+                    (<double*>np.PyArray_MultiIter_DATA(it, 7))[0],
+                    (<int*>np.PyArray_MultiIter_DATA(it, 8))[0],
+                    subpix, 0, &bkgflux, &bkgfluxerr, &bkgarea, &bkgflag)
+                if status != RETURN_OK:
+                    break
+
+                if area1 > 0:
+                  flux1 -= bkgflux / bkgarea * area1
+                  bkgfluxerr = bkgfluxerr / bkgarea * area1
+                  fluxerr1 = sqrt(fluxerr1*fluxerr1 + bkgfluxerr*bkgfluxerr)
+
+                (<double*>np.PyArray_MultiIter_DATA(it, 9))[0] = flux1
+                (<double*>np.PyArray_MultiIter_DATA(it, 10))[0] = fluxerr1
+                (<short*>np.PyArray_MultiIter_DATA(it, 11))[0] = flag1
+
+                #PyArray_MultiIter_NEXT is used to advance the iterator
+                np.PyArray_MultiIter_NEXT(it)
+        _assert_ok(status)
 
         return sum, sumerr, flag
 
@@ -1492,24 +1541,28 @@ def sum_ellipann(np.ndarray data not None, x, y, a, b, theta, rin, rout,
     flag = np.empty(shape, np.short)
 
     it = np.broadcast(x, y, a, b, theta, rin, rout, seg_id, sum, sumerr, flag)
-    while np.PyArray_MultiIter_NOTDONE(it):
-        status = sep_sum_ellipann(
-            &im,
-            (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
-            (<double*>np.PyArray_MultiIter_DATA(it, 6))[0],
-            (<int*>np.PyArray_MultiIter_DATA(it, 7))[0],
-            subpix, 0,
-            <double*>np.PyArray_MultiIter_DATA(it, 8),
-            <double*>np.PyArray_MultiIter_DATA(it, 9),
-            &area1,
-            <short*>np.PyArray_MultiIter_DATA(it, 10))
-        _assert_ok(status)
-        np.PyArray_MultiIter_NEXT(it)
+    status = RETURN_OK
+    with nogil:
+        while np.PyArray_MultiIter_NOTDONE(it):
+            status = sep_sum_ellipann(
+                &im,
+                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                (<double*>np.PyArray_MultiIter_DATA(it, 6))[0],
+                (<int*>np.PyArray_MultiIter_DATA(it, 7))[0],
+                subpix, 0,
+                <double*>np.PyArray_MultiIter_DATA(it, 8),
+                <double*>np.PyArray_MultiIter_DATA(it, 9),
+                &area1,
+                <short*>np.PyArray_MultiIter_DATA(it, 10))
+            if status != RETURN_OK:
+                break
+            np.PyArray_MultiIter_NEXT(it)
+    _assert_ok(status)
 
     return sum, sumerr, flag
 
@@ -1593,12 +1646,14 @@ def flux_radius(np.ndarray data not None, x, y, rmax, frac, normflux=None,
     cdef short flag1, bkgflag
     cdef int i
     cdef int status, fracn
+    cdef Py_ssize_t n
     cdef short[:] flag
     cdef double[:, :] radius
     cdef double[:] fractmp
     cdef double[:] xtmp
     cdef double[:] ytmp
     cdef double[:] rtmp
+    cdef np.int32_t[:] itmp
     cdef double[:] normfluxbuf
     cdef double *normfluxptr
     cdef sep_image im
@@ -1656,15 +1711,20 @@ def flux_radius(np.ndarray data not None, x, y, rmax, frac, normflux=None,
     flag = np.empty(len(xtmp), np.short)
     radius = np.empty((len(xtmp), len(fractmp)), dt)
 
-    for i in range(len(xtmp)):
-        if normfluxptr != NULL:
-            normfluxptr = &normfluxbuf[i]
-        status = sep_flux_radius(&im,
-                                 xtmp[i], ytmp[i], rtmp[i], itmp[i],
-                                 subpix, 0,
-                                 normfluxptr, &fractmp[0], fracn,
-                                 &radius[i, 0], &flag[i])
-        _assert_ok(status)
+    n = len(xtmp)
+    status = RETURN_OK
+    with nogil:
+        for i in range(n):
+            if normfluxptr != NULL:
+                normfluxptr = &normfluxbuf[i]
+            status = sep_flux_radius(&im,
+                                     xtmp[i], ytmp[i], rtmp[i], itmp[i],
+                                     subpix, 0,
+                                     normfluxptr, &fractmp[0], fracn,
+                                     &radius[i, 0], &flag[i])
+            if status != RETURN_OK:
+                break
+    _assert_ok(status)
 
     return (np.asarray(radius).reshape(inshape + infracshape),
             np.asarray(flag).reshape(inshape))
@@ -1708,6 +1768,7 @@ def mask_ellipse(np.ndarray arr not None, x, y, a=None, b=None, theta=None,
     cdef int w, h
     cdef np.uint8_t[:,:] buf
     cdef double cxx_, cyy_, cxy_
+    cdef np.broadcast it
 
     dt = np.dtype(np.double)
 
@@ -1729,18 +1790,19 @@ def mask_ellipse(np.ndarray arr not None, x, y, a=None, b=None, theta=None,
         theta = np.require(theta, dtype=dt)
 
         it = np.broadcast(x, y, a, b, theta, r)
-        while np.PyArray_MultiIter_NOTDONE(it):
-            sep_ellipse_coeffs((<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                               (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                               (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                               &cxx_, &cyy_, &cxy_)
-            sep_set_ellipse(<unsigned char *>&buf[0, 0], w, h,
-                            (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                            (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                            cxx_, cyy_, cxy_,
-                            (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                            1)
-            np.PyArray_MultiIter_NEXT(it)
+        with nogil:
+            while np.PyArray_MultiIter_NOTDONE(it):
+                sep_ellipse_coeffs((<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                                   (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                                   (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                                   &cxx_, &cyy_, &cxy_)
+                sep_set_ellipse(<unsigned char *>&buf[0, 0], w, h,
+                                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                                cxx_, cyy_, cxy_,
+                                (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                                1)
+                np.PyArray_MultiIter_NEXT(it)
 
     # cxx, cyy, cxy representation
     elif (cxx is not None and cyy is not None and cxy is not None):
@@ -1749,16 +1811,17 @@ def mask_ellipse(np.ndarray arr not None, x, y, a=None, b=None, theta=None,
         cxy = np.require(cxy, dtype=dt)
 
         it = np.broadcast(x, y, cxx, cyy, cxy, r)
-        while np.PyArray_MultiIter_NOTDONE(it):
-            sep_set_ellipse(<unsigned char *>&buf[0, 0], w, h,
-                            (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                            (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                            (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                            (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                            (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                            (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                            1)
-            np.PyArray_MultiIter_NEXT(it)
+        with nogil:
+            while np.PyArray_MultiIter_NOTDONE(it):
+                sep_set_ellipse(<unsigned char *>&buf[0, 0], w, h,
+                                (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                                (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                                (<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                                (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                                (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                                (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                                1)
+                np.PyArray_MultiIter_NEXT(it)
     else:
         raise ValueError("Must specify either a, b and theta or "
                          "cxx, cyy and cxy.")
@@ -1837,7 +1900,9 @@ def kron_radius(np.ndarray data not None, x, y, a, b, theta, r,
 
     """
 
+    cdef int status
     cdef double cxx, cyy, cxy
+    cdef np.broadcast it
     cdef sep_image im
 
     # Test for segmap without seg_id.  Nothing happens if seg_id supplied but
@@ -1873,21 +1938,25 @@ def kron_radius(np.ndarray data not None, x, y, a, b, theta, r,
     flag = np.empty(shape, np.short)
 
     it = np.broadcast(x, y, a, b, theta, r, seg_id, kr, flag)
-    while np.PyArray_MultiIter_NOTDONE(it):
-        sep_ellipse_coeffs((<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
-                           (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
-                           (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
-                           &cxx, &cyy, &cxy)
-        status = sep_kron_radius(&im,
-                                 (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                                 (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                                 cxx, cyy, cxy,
-                                 (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
-                                 (<int*>np.PyArray_MultiIter_DATA(it, 6))[0],
-                                 <double*>np.PyArray_MultiIter_DATA(it, 7),
-                                 <short*>np.PyArray_MultiIter_DATA(it, 8))
-        _assert_ok(status)
-        np.PyArray_MultiIter_NEXT(it)
+    status = RETURN_OK
+    with nogil:
+        while np.PyArray_MultiIter_NOTDONE(it):
+            sep_ellipse_coeffs((<double*>np.PyArray_MultiIter_DATA(it, 2))[0],
+                               (<double*>np.PyArray_MultiIter_DATA(it, 3))[0],
+                               (<double*>np.PyArray_MultiIter_DATA(it, 4))[0],
+                               &cxx, &cyy, &cxy)
+            status = sep_kron_radius(&im,
+                                     (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                                     (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                                     cxx, cyy, cxy,
+                                     (<double*>np.PyArray_MultiIter_DATA(it, 5))[0],
+                                     (<int*>np.PyArray_MultiIter_DATA(it, 6))[0],
+                                     <double*>np.PyArray_MultiIter_DATA(it, 7),
+                                     <short*>np.PyArray_MultiIter_DATA(it, 8))
+            if status != RETURN_OK:
+                break
+            np.PyArray_MultiIter_NEXT(it)
+    _assert_ok(status)
 
     return kr, flag
 
@@ -1956,6 +2025,7 @@ def winpos(np.ndarray data not None, xinit, yinit, sig,
     cdef int status
     cdef double cxx, cyy, cxy, sigval
     cdef int niter = 0  # not currently returned
+    cdef np.broadcast it
     cdef sep_image im
 
     _parse_arrays(data, None, None, mask, None, &im)
@@ -1974,21 +2044,25 @@ def winpos(np.ndarray data not None, xinit, yinit, sig,
     flag = np.empty(shape, np.short)
 
     it = np.broadcast(xinit, yinit, sig, x, y, flag)
-    while np.PyArray_MultiIter_NOTDONE(it):
-        sigval = (<double*>np.PyArray_MultiIter_DATA(it, 2))[0]
-        if sigval < minsig:
-            sigval = minsig
-        status = sep_windowed(&im,
-                              (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
-                              (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
-                              sigval,
-                              subpix, 0,
-                              <double*>np.PyArray_MultiIter_DATA(it, 3),
-                              <double*>np.PyArray_MultiIter_DATA(it, 4),
-                              &niter,
-                              <short*>np.PyArray_MultiIter_DATA(it, 5))
-        _assert_ok(status)
-        np.PyArray_MultiIter_NEXT(it)
+    status = RETURN_OK
+    with nogil:
+        while np.PyArray_MultiIter_NOTDONE(it):
+            sigval = (<double*>np.PyArray_MultiIter_DATA(it, 2))[0]
+            if sigval < minsig:
+                sigval = minsig
+            status = sep_windowed(&im,
+                                  (<double*>np.PyArray_MultiIter_DATA(it, 0))[0],
+                                  (<double*>np.PyArray_MultiIter_DATA(it, 1))[0],
+                                  sigval,
+                                  subpix, 0,
+                                  <double*>np.PyArray_MultiIter_DATA(it, 3),
+                                  <double*>np.PyArray_MultiIter_DATA(it, 4),
+                                  &niter,
+                                  <short*>np.PyArray_MultiIter_DATA(it, 5))
+            if status != RETURN_OK:
+                break
+            np.PyArray_MultiIter_NEXT(it)
+    _assert_ok(status)
 
     return x, y, flag
 
@@ -33,8 +33,11 @@ else:
     sourcefiles = [fname] + glob(os.path.join("src", "*.c"))
     headerfiles = glob(os.path.join("src", "*.h"))
     include_dirs = [numpy.get_include(), "src"]
+    # POSIX threads for the background statistics (not on Windows).
+    libraries = [] if sys.platform == "win32" else ["pthread"]
     extensions = [Extension("sep", sourcefiles, include_dirs=include_dirs,
-                            depends=headerfiles, define_macros=[("_USE_MATH_DEFINES", "1")])]
+                            depends=headerfiles, libraries=libraries,
+                            define_macros=[("_USE_MATH_DEFINES", "1")])]
     extensions = cythonize(extensions)
 
 
@@ -27,6 +27,15 @@
 #include "sep.h"
 #include "sepcore.h"
 
+/* The statistics of the background meshes can be computed by several
+   threads, with POSIX threads. */
+#if defined(_WIN32) && !defined(SEP_NO_THREADS)
+#define SEP_NO_THREADS
+#endif
+#ifndef SEP_NO_THREADS
+#include <pthread.h>
+#endif
+
 #define	BACK_MINGOODFRAC   0.5   /* min frac with good weights*/
 #define	QUANTIF_NSIGMA     5     /* histogram limits */
 #define	QUANTIF_NMAXLEVELS 4096  /* max nb of quantif. levels */
@@ -54,13 +63,24 @@ float backguess(backstruct *bkg, float *mean, float *sigma);
 int makebackspline(const sep_bkg *bkg, float *map, float *dmap);
 
 
-int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
-                   double fthresh, sep_bkg **bkg)
+/* Arguments and result of backrows() in a thread */
+typedef struct {
+  const sep_image *image;
+  sep_bkg *bkg;
+  int j0, step;
+  int status;
+} backrows_args;
+
+/* Background statistics (back, sigma) of the rows of meshes j0, j0 + step,
+ * j0 + 2*step, ... of the image. Each row only depends on its own pixels,
+ * so that the rows can be shared by several threads. */
+static int backrows(const sep_image *image, sep_bkg *bkg, int j0, int step)
 {
-  const BYTE *imt, *maskt;
+  const BYTE *imt, *maskt = NULL;
   int npix;                   /* size of image */
-  int nx, ny, nb;             /* number of background boxes in x, y, total */
+  int nx, ny;                 /* number of background boxes in x, y */
   int bufsize;                /* size of a "row" of boxes in pixels (w*bh) */
+  int rowsize;                /* size of this row of boxes in pixels */
   int elsize;                 /* size (in bytes) of an image array element */
   int melsize;                /* size (in bytes) of a mask array element */
   PIXTYPE *buf, *mbuf;
@@ -68,53 +88,24 @@ int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
   PIXTYPE maskthresh;
   array_converter convert, mconvert;
   backstruct *backmesh, *bm;  /* info about each background "box" */
-  sep_bkg *bkgout;          /* output */
   int j,k,m, status;
 
   status = RETURN_OK;
   npix = image->w * image->h;
-  bufsize = image->w * bh;
+  bufsize = image->w * bkg->bh;
   maskthresh = image->maskthresh;
   if (image->mask == NULL) maskthresh = 0.0;
+  nx = bkg->nx;
+  ny = bkg->ny;
 
-  backmesh = bm = NULL;
-  bkgout = NULL;
+  backmesh = NULL;
   buf = mbuf = NULL;
   buft = mbuft = NULL;
   convert = mconvert = NULL;
-
-  /* determine number of background boxes */
-  if ((nx = (image->w - 1) / bw + 1) < 1)
-    nx = 1;
-  if ((ny = (image->h - 1) / bh + 1) < 1)
-    ny = 1;
-  nb = nx*ny;
+  melsize = 0;
 
   /* Allocate temp memory & initialize */
   QCALLOC(backmesh, backstruct, nx, status);
-  bm = backmesh;
-
-  /* Allocate the returned struct */
-  QMALLOC(bkgout, sep_bkg, 1, status);
-  bkgout->w = image->w;
-  bkgout->h = image->h;
-  bkgout->nx = nx;
-  bkgout->ny = ny;
-  bkgout->n = nb;
-  bkgout->bw = bw;
-  bkgout->bh = bh;
-  bkgout->back = NULL;
-  bkgout->sigma = NULL;
-  bkgout->dback = NULL;
-  bkgout->dsigma = NULL;
-  QMALLOC(bkgout->back, float, nb, status);
-  QMALLOC(bkgout->sigma, float, nb, status);
-  QMALLOC(bkgout->dback, float, nb, status);
-  QMALLOC(bkgout->dsigma, float, nb, status);
-
-  /* cast input array pointers. These are used to step through the arrays. */
-  imt = (const BYTE *)image->data;
-  maskt = (const BYTE *)image->mask;
 
   /* get the correct array converter and element size, based on dtype code */
   status = get_array_converter(image->dtype, &convert, &elsize);
@@ -133,15 +124,11 @@ int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
     {
       QMALLOC(buf, PIXTYPE, bufsize, status);
       buft = buf;
-      if (status != RETURN_OK)
-	goto exit;
     }
   if (image->mask && (image->mdtype != PIXDTYPE))
     {
       QMALLOC(mbuf, PIXTYPE, bufsize, status);
       mbuft = mbuf;
-      if (status != RETURN_OK)
-	goto exit;
     }
 
   /* loop over rows of background boxes.
@@ -151,28 +138,35 @@ int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
    * because the pixel buffers are only read in from disk in
    * increments of a row of background boxes at a time.)
    */
-  for (j=0; j<ny; j++)
+  for (j=j0; j<ny; j+=step)
     {
+      /* array pointers to this row of background boxes */
+      imt = (const BYTE *)image->data + (size_t)elsize * bufsize * j;
+      if (image->mask)
+	maskt = (const BYTE *)image->mask + (size_t)melsize * bufsize * j;
+
       /* if the last row, modify the width appropriately*/
+      rowsize = bufsize;
       if (j == ny-1 && npix%bufsize)
-        bufsize = npix%bufsize;
+        rowsize = npix%bufsize;
 
       /* convert this row to PIXTYPE and store in buffer(s)*/
       if (image->dtype != PIXDTYPE)
-	convert(imt, bufsize, buf);
+	convert(imt, rowsize, buf);
       else
 	buft = (const PIXTYPE *)imt;
 
       if (image->mask)
 	{
 	  if (image->mdtype != PIXDTYPE)
-	    mconvert(maskt, bufsize, mbuf);
+	    mconvert(maskt, rowsize, mbuf);
 	  else
 	    mbuft = (const PIXTYPE *)maskt;
 	}
 
       /* Get clipped mean, sigma for all boxes in the row */
-      backstat(backmesh, buft, mbuft, bufsize, nx, image->w, bw, maskthresh);
+      backstat(backmesh, buft, mbuft, rowsize, nx, image->w, bkg->bw,
+	       maskthresh);
 
       /* Allocate histograms in each box in this row. */
       bm = backmesh;
@@ -181,31 +175,146 @@ int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
 	  bm->histo=NULL;
 	else
 	  QCALLOC(bm->histo, LONG, bm->nlevels, status);
-      backhisto(backmesh, buft, mbuft, bufsize, nx, image->w, bw, maskthresh);
+      backhisto(backmesh, buft, mbuft, rowsize, nx, image->w, bkg->bw,
+		maskthresh);
 
       /* Compute background statistics from the histograms */
       bm = backmesh;
       for (m=0; m<nx; m++, bm++)
 	{
 	  k = m+nx*j;
-	  backguess(bm, bkgout->back+k, bkgout->sigma+k);
+	  backguess(bm, bkg->back+k, bkg->sigma+k);
 	  free(bm->histo);
 	  bm->histo = NULL;
 	}
-
-      /* increment array pointers to next row of background boxes */
-      imt += elsize * bufsize;
-      if (image->mask)
-	maskt += melsize * bufsize;
     }
 
-  /* free memory */
+ exit:
   free(buf);
-  buf = NULL;
   free(mbuf);
-  mbuf = NULL;
+  if (backmesh)
+    {
+      bm = backmesh;
+      for (m=0; m<nx; m++, bm++)
+	free(bm->histo);
+    }
   free(backmesh);
-  backmesh = NULL;
+  return status;
+}
+
+#ifndef SEP_NO_THREADS
+static void *backrows_thread(void *arg)
+{
+  backrows_args *args = (backrows_args *)arg;
+
+  args->status = backrows(args->image, args->bkg, args->j0, args->step);
+  return NULL;
+}
+#endif
+
+int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
+                   double fthresh, sep_bkg **bkg)
+{
+  return sep_background_threads(image, bw, bh, fw, fh, fthresh, 1, bkg);
+}
+
+int sep_background_threads(const sep_image* image, int bw, int bh,
+			   int fw, int fh, double fthresh, int nthreads,
+			   sep_bkg **bkg)
+{
+  int nx, ny, nb;             /* number of background boxes in x, y, total */
+  sep_bkg *bkgout;          /* output */
+  int status;
+#ifndef SEP_NO_THREADS
+  pthread_t *threads;
+  backrows_args *args;
+  int t, nstarted;
+#endif
+
+  status = RETURN_OK;
+  bkgout = NULL;
+#ifndef SEP_NO_THREADS
+  threads = NULL;
+  args = NULL;
+  nstarted = 0;
+#endif
+
+  /* determine number of background boxes */
+  if ((nx = (image->w - 1) / bw + 1) < 1)
+    nx = 1;
+  if ((ny = (image->h - 1) / bh + 1) < 1)
+    ny = 1;
+  nb = nx*ny;
+
+  /* Allocate the returned struct */
+  QMALLOC(bkgout, sep_bkg, 1, status);
+  bkgout->w = image->w;
+  bkgout->h = image->h;
+  bkgout->nx = nx;
+  bkgout->ny = ny;
+  bkgout->n = nb;
+  bkgout->bw = bw;
+  bkgout->bh = bh;
+  bkgout->back = NULL;
+  bkgout->sigma = NULL;
+  bkgout->dback = NULL;
+  bkgout->dsigma = NULL;
+  QMALLOC(bkgout->back, float, nb, status);
+  QMALLOC(bkgout->sigma, float, nb, status);
+  QMALLOC(bkgout->dback, float, nb, status);
+  QMALLOC(bkgout->dsigma, float, nb, status);
+
+  /* Statistics of the rows of meshes, interleaved between the threads */
+  if (nthreads > ny)
+    nthreads = ny;
+#ifdef SEP_NO_THREADS
+  nthreads = 1;
+#endif
+  if (nthreads <= 1)
+    {
+      if ((status = backrows(image, bkgout, 0, 1)) != RETURN_OK)
+	goto exit;
+    }
+#ifndef SEP_NO_THREADS
+  else
+    {
+      QMALLOC(threads, pthread_t, nthreads, status);
+      QMALLOC(args, backrows_args, nthreads, status);
+      for (t=0; t<nthreads; t++)
+	{
+	  args[t].image = image;
+	  args[t].bkg = bkgout;
+	  args[t].j0 = t;
+	  args[t].step = nthreads;
+	  args[t].status = RETURN_OK;
+	}
+
+      /* the calling thread does the first share */
+      for (t=1; t<nthreads; t++, nstarted++)
+	if (pthread_create(&threads[t], NULL, backrows_thread, &args[t]))
+	  break;
+      args[0].status = backrows(image, bkgout, 0, nthreads);
+
+      /* the shares of threads that could not be started */
+      for (t=nstarted+1; t<nthreads; t++)
+	args[t].status = backrows(image, bkgout, t, nthreads);
+
+      for (t=1; t<=nstarted; t++)
+	pthread_join(threads[t], NULL);
+
+      for (t=0; t<nthreads; t++)
+	if (args[t].status != RETURN_OK)
+	  {
+	    status = args[t].status;
+	    goto exit;
+	  }
+
+      free(threads);
+      threads = NULL;
+      free(args);
+      args = NULL;
+    }
+#endif
 
   /* Median-filter and check suitability of the background map */
   if ((status = filterback(bkgout, fw, fh, fthresh)) != RETURN_OK)
@@ -224,15 +333,10 @@ int sep_background(const sep_image* image, int bw, int bh, int fw, int fh,
 
   /* If we encountered a problem, clean up any allocated memory */
  exit:
-  free(buf);
-  free(mbuf);
-  if (backmesh)
-    {
-      bm = backmesh;
-      for (m=0; m<nx; m++, bm++)
-	free(bm->histo);
-    }
-  free(backmesh);
+#ifndef SEP_NO_THREADS
+  free(threads);
+  free(args);
+#endif
   sep_bkg_free(bkgout);
   *bkg = NULL;
   return status;
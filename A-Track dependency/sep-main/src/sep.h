@@ -155,6 +155,20 @@ SEP_API int sep_background(const sep_image *image,
                    double fthresh,   /* filter threshold                 */
                    sep_bkg **bkg);   /* OUTPUT                           */
 
+/* sep_background_threads()
+ *
+ * Same as sep_background(), with the statistics of the rows of background
+ * tiles computed by `nthreads` threads (1 = in the calling thread only).
+ * The result does not depend on the number of threads. Without POSIX
+ * threads (Windows, or SEP_NO_THREADS defined), a single thread is used.
+ */
+SEP_API int sep_background_threads(const sep_image *image,
+                   int bw, int bh,   /* size of a single background tile */
+                   int fw, int fh,   /* filter size in tiles             */
+                   double fthresh,   /* filter threshold                 */
+                   int nthreads,     /* number of threads                */
+                   sep_bkg **bkg);   /* OUTPUT                           */
+
 
 /* sep_bkg_global[rms]()
  *
@@ -312,6 +312,24 @@ def test_background_rms():
     assert rms.dtype == np.float64
     assert rms.shape == (ny, nx)
 
+
+@pytest.mark.parametrize("dtype", SUPPORTED_IMAGE_DTYPES)
+@pytest.mark.parametrize("nthreads", [2, 3, 100])
+def test_background_threads(dtype, nthreads):
+    """The background does not depend on the number of threads"""
+
+    rng = np.random.RandomState(0)
+    data = (100. + 5. * rng.randn(1000, 700)).astype(dtype)
+    mask = rng.uniform(size=data.shape) < 0.05
+
+    for m in (None, mask):
+        expected = sep.Background(data, mask=m)
+        bkg = sep.Background(data, mask=m, nthreads=nthreads)
+        assert bkg.globalback == expected.globalback
+        assert bkg.globalrms == expected.globalrms
+        assert_equal(bkg.back(), expected.back())
+        assert_equal(bkg.rms(), expected.rms())
+
 # -----------------------------------------------------------------------------
 # Extract
 
@@ -724,3 +742,51 @@ def test_long_error_msg():
 
     # restore
     sep.set_extract_pixstack(old)
+
+
+def _measure(data):
+    """Background, extraction and photometry of an image, for the thread
+    tests."""
+    bkg = sep.Background(data)
+    data = data - bkg
+    objects = sep.extract(data, 1.5, err=bkg.globalrms)
+    x, y = objects['x'], objects['y']
+    a, b = objects['a'], objects['b']
+    theta = np.clip(objects['theta'].astype(np.float64), -np.pi/2, np.pi/2)
+    kronrad, _ = sep.kron_radius(data, x, y, a, b, theta, 6.0)
+    return (bkg.back(), bkg.rms(), objects,
+            sep.sum_circle(data, x, y, 3.0, err=bkg.globalrms),
+            sep.sum_ellipse(data, x, y, a, b, theta, 2.5 * kronrad,
+                            subpix=1),
+            sep.flux_radius(data, x, y, 6. * a, 0.5, subpix=5))
+
+
+@pytest.mark.skipif(NO_FITS, reason="no FITS reader")
+def test_threads_same_as_serial():
+    """The GIL is released in the C calls; threads must give the serial
+    results."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    images = [np.roll(image_data, 37 * i, axis=i % 2) for i in range(8)]
+    expected = [_measure(image) for image in images]
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(_measure, images))
+
+    for result, exp in zip(results, expected):
+        assert len(result[2]) > 0
+        for got, want in zip(result, exp):
+            if isinstance(got, tuple):
+                for g, w in zip(got, want):
+                    assert_equal(g, w)
+            else:
+                assert_equal(got, want)
+
+
+def test_error_without_gil():
+    """Errors of the C calls made without the GIL are still raised."""
+    data = np.ones((20, 20), dtype=np.float64)
+    with pytest.raises(Exception) as excinfo:
+        sep.sum_ellipse(data, [5., 10.], [5., 10.], 1.0, 1.0,
+                        [0.0, 4.0], 1.0)
+    assert 'invalid aperture parameters' in str(excinfo.value)
@@ -29,6 +29,20 @@ except ImportError:
           'the same folder as atrack.py.')
     raise SystemExit
 
+try:
+    import difference
+except ImportError:
+    print('Python cannot import difference.py. Make sure difference.py is in',
+          'the same folder as atrack.py.')
+    raise SystemExit
+
+try:
+    import tracking
+except ImportError:
+    print('Python cannot import tracking.py. Make sure tracking.py is in',
+          'the same folder as atrack.py.')
+    raise SystemExit
+
 try:
     from astropy.io import fits
     from astropy.table import Table, vstack
@@ -46,6 +60,7 @@ import glob
 import argparse
 from mpcreporter import astronomy
 from mpcreporter import io
+from mpcreporter import orbits
 import numpy as np
 
 
@@ -84,6 +99,10 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--skip-pngs',
                         action='store_true',
                         help='skip creating PNGs')
+    parser.add_argument('-s', '--stamps',
+                        action='store_true',
+                        help='create a postage stamp mosaic per object ' +
+                        'instead of full-frame PNGs')
     parser.add_argument('-g', '--skip-gif',
                         action='store_true',
                         help='skip creating animation file')
@@ -145,8 +164,20 @@ if __name__ == '__main__':
 #              .format(elapsed // 60, elapsed % 60))
 
     if not arguments.skip_cats:
+        catfitsdir = fitsdir
+        if config.get('difference', 'DIFFERENCE', fallback='False') == 'True':
+            print('\nSubtracting the template of the static sky...', end=' ')
+            diffdir = difference.make_differences(fitsdir, outdir)
+            elapsed = int(time.time() - start)
+            if diffdir is not None:
+                catfitsdir = diffdir
+                print('Complete!')
+                print('Difference images are saved in {0}.'.format(diffdir))
+            print('Elapsed time: {0} min {1} sec.'
+                  .format(elapsed // 60, elapsed % 60))
+
         print('\nCreating catalog files...', end=' ')
-        sources.make_catalog(fitsdir, outdir)
+        sources.make_catalog(catfitsdir, outdir)
         elapsed = int(time.time() - start)
         print('Complete!')
         print('Catalog files are saved as *.pysexcat.')
@@ -168,6 +199,20 @@ if __name__ == '__main__':
     print('Candidates for each image are saved as *.cnd.')
     print('Elapsed time: {0} min {1} sec.'.format(elapsed // 60, elapsed % 60))
 
+    if config.get('tracking', 'TRACKING', fallback='False') == 'True':
+        print('\nSearching for faint moving objects by synthetic tracking...',
+              end=' ')
+        trackdir = fitsdir
+        if config.get('difference', 'DIFFERENCE', fallback='False') == 'True' \
+                and os.path.isdir(outdir + '/difference'):
+            trackdir = outdir + '/difference'
+        tracked = tracking.search(trackdir, outdir)
+        elapsed = int(time.time() - start)
+        print('Complete!')
+        print('{0} detections are saved as tracking.csv.'.format(len(tracked)))
+        print('Elapsed time: {0} min {1} sec.'
+              .format(elapsed // 60, elapsed % 60))
+
     print('\nDetecting moving objects...\n')
     lines = asteroids.detect_lines(outdir, fitsdir)
 
@@ -319,10 +364,9 @@ if __name__ == '__main__':
         fileops = io.FileOps()
         timeops = astronomy.TimeOps()
         fitsops = astronomy.FitsOps()
-        astcalc = astronomy.AstCalc()
+        astcalc = astronomy.AstCalc(cache_dir="{0}/skybot".format(outdir))
 
         images_dir = fitsdir
-        the_res_file = "{0}/results.txt".format(outdir)
 
         magnitude = float(config.get('mpcreport', 'LIM_MAG'))
         radius = float(config.get('mpcreport', 'RADIUS'))
@@ -333,25 +377,36 @@ if __name__ == '__main__':
         print("Analysing A-Track result file...")
 
         my_files = fileops.get_file_list(images_dir)
-        res_file = fileops.read_res(the_res_file)
-        # print(res_file)
+        # results.txt is only a human-readable export; the reporter
+        # reads the object tables themselves.
+        res_file = fileops.table2res(*[table for table in
+                                       (moving_objects, uncertain_objects)
+                                       if isinstance(table, QTable)])
+
+        # A WCS propagated from the alignment reference (sources.astrometry)
+        # saves solving the first frame again.
+        propagated = "{0}/{1}.wcs".format(
+            outdir, os.path.splitext(os.path.basename(my_files[0]))[0])
 
         try:
             hdu1 = fits.open(my_files[0])
             wsc_check = hdu1[0].header['ctype1']
             wcs_file = my_files[0]
         except:
-            solve_wcs = astcalc.solve_field(my_files[0],
-                                            ra_keyword=str(config.get('mpcreport',
-                                                                      'RA')),
-                                            dec_keyword=str(config.get('mpcreport',
-                                                                       'DEC')),
-                                            )
-            if not solve_wcs:
-                raise SystemExit
-
-            root, extension = os.path.splitext(my_files[0])
-            wcs_file = root + "_new.fits"
+            if os.path.exists(propagated):
+                wcs_file = propagated
+            else:
+                solve_wcs = astcalc.solve_field(my_files[0],
+                                                ra_keyword=str(config.get('mpcreport',
+                                                                          'RA')),
+                                                dec_keyword=str(config.get('mpcreport',
+                                                                           'DEC')),
+                                                )
+                if not solve_wcs:
+                    raise SystemExit
+
+                root, extension = os.path.splitext(my_files[0])
+                wcs_file = root + "_new.fits"
 
         observer = config.get('mpcreport', 'OBSERVER')
 
@@ -375,83 +430,94 @@ if __name__ == '__main__':
         out_file = open(output, "w")
         out_file.write("{0}\n".format(h))
         print(h)
-        for i in res_file:
-            theid, frame, x, y, flux = i
-
-            coors = astcalc.xy2sky(wcs_file, x, y)
-
-            if not coors:
-                coors = astcalc.xy2skywcs(wcs_file, x, y)
-
-            coors2 = astcalc.xy2sky2(wcs_file, x, y)
 
-            if not coors2:
-                coors2 = astcalc.xy2sky2wcs(wcs_file, x, y)
-
-            coors2ra = coors2.ra.degree
-            coors2dec = coors2.dec.degree
-
-            fltr = fitsops.get_header(my_files[0],
-                                      config.get('mpcreport',
-                                                 'FILTER'))
-            fltr = str(fltr).strip().replace(" ", "_")
-
-            tm = timeops.get_timestamp_exp(my_files[int(frame)])
+        fltr = fitsops.get_header(my_files[0],
+                                  config.get('mpcreport',
+                                             'FILTER'))
+        fltr = str(fltr).strip().replace(" ", "_")
+
+        # One known-object search per frame, covering the whole field.
+        footprint = astcalc.frame_footprint(wcs_file)
+        frames = sorted(set(int(frame) for frame in res_file[:, 1]))
+        epochs = dict((frame, timeops.get_timestamp_exp(my_files[frame]))
+                      for frame in frames)
+
+        if footprint is not None:
+            queries = [(epochs[frame],) + tuple(footprint) + (observatory,)
+                       for frame in frames]
+
+        known_objects = config.get('mpcreport', 'KNOWN_OBJECTS',
+                                   fallback='skybot').strip().lower()
+
+        if footprint is None:
+            print('The field of {0} is unknown; the objects are not matched '
+                  'with known objects.'.format(wcs_file))
+            skyresults = [np.empty((0, 5), dtype="U") for frame in frames]
+        elif known_objects == 'mpcorb':
+            orbitops = orbits.OrbitOps(
+                database,
+                obscodes=config.get('mpcreport', 'OBSCODES_PATH',
+                                    fallback=None),
+                cache_dir="{0}/mpcorb".format(outdir))
+            skyresults = orbitops.find_frames(queries)
+        else:
+            skyresults = astcalc.find_skybot_frames(
+                queries,
+                max_workers=config.getint('mpcreport', 'SKYBOT_WORKERS',
+                                          fallback=4))
+        skyresults = dict(zip(frames, skyresults))
+
+        # All rows share the WCS of the reference frame.
+        all_coors, all_coors2 = astcalc.xy2sky_batch(wcs_file,
+                                                     res_file[:, 2],
+                                                     res_file[:, 3])
+
+        for i, row in enumerate(res_file):
+            theid, frame, x, y, flux = row
+            coors, coors2 = all_coors[i], all_coors2[i]
+
+            tm = epochs[int(frame)]
             tmm = timeops.convert_time_format(tm)
 
             mag = astcalc.flux2mag(flux)
 
-            # ccoor = afits_op.center_finder(wcs_file)
-
-            namesky = astcalc.find_skybot_objects(tm,
-                                                  coors2ra,
-                                                  coors2dec)
-            # print(namesky)
+            namesky = skyresults[int(frame)]
+            match = astcalc.match_skybot_objects(namesky, coors2)[0]
 
-            for u in range(len(namesky)):
-                # justID = namesky[u][0]
-                justname = namesky[u][1]
-
-                if astcalc.is_object(astcalc.radec2wcs(namesky[u][2],
-                                                       namesky[u][3]),
-                                     coors2):
+            if match >= 0:
+                if known_objects == 'mpcorb':
+                    mpcname = namesky[match][0]
+                    if len(mpcname) > 5:
+                        mpcname = "     " + mpcname
+                else:
+                    justname = namesky[match][1]
                     mpcname = fileops.find_if_in_database_name(database,
                                                                justname)
-                    if len(mpcname) == 5:
-                        spc = "         "
-                    elif len(mpcname) > 5:
-                        spc = "  "
-
-                    print("{0}{1}{2} {3}          {4} {5}      {6}".format(mpcname,
-                                                                           spc,
-                                                                           tmm,
-                                                                           coors,
-                                                                           mag,
-                                                                           fltr,
-                                                                           observatory))
-
-                    out_file.write("{0}{1}{2} {3}          {4} {5}      {6}\n".format(
-                        mpcname,
-                        spc,
-                        tmm,
-                        coors,
-                        mag,
-                        fltr,
-                        observatory))
-                    break
+                if len(mpcname) > 5:
+                    spc = "  "
                 else:
-                    p = "       NO{:03.0f}* {} {}          {} {}      {}".format(
-                        theid,
-                        tmm,
-                        coors,
-                        mag,
-                        fltr,
-                        observatory)
-
-                    print(p)
-
-                    out_file.write("{0}\n".format(p))
-                    break
+                    spc = "         "
+
+                p = "{0}{1}{2} {3}          {4} {5}      {6}".format(
+                    mpcname,
+                    spc,
+                    tmm,
+                    coors,
+                    mag,
+                    fltr,
+                    observatory)
+            else:
+                p = "       NO{:03.0f}* {} {}          {} {}      {}".format(
+                    theid,
+                    tmm,
+                    coors,
+                    mag,
+                    fltr,
+                    observatory)
+
+            print(p)
+            out_file.write("{0}\n".format(p))
+
         print("----- end -----")
         out_file.write("----- end -----")
         out_file.close()
@@ -469,20 +535,21 @@ if __name__ == '__main__':
 
         images = sorted(glob.glob(fitsdir + '/*.fits'))
 
-        for i, image in enumerate(images):
-            asteroid = objects[objects['FileID'] == i]
-            visuals.fits2png(image, outdir, asteroid)
-            print('{0} converted to png.'.format(image))
+        if arguments.stamps:
+            visuals.all_stamps(images, outdir, objects)
+        elif arguments.skip_gif:
+            visuals.all_pngs(images, outdir, objects)
+        else:
+            # The animation is written while the frames are rendered.
+            visuals.all_pngs(images, outdir, objects,
+                             animation='{0}/animation.gif'.format(outdir))
 
         elapsed = int(time.time() - start)
         print('\nPNG conversion completed.')
         print('Elapsed Time: {0} min {1} sec.'
               .format(elapsed // 60, elapsed % 60))
 
-        if not arguments.skip_gif:
-            print('\nCreating GIF (animation) file...')
-            os.popen('convert -delay 20 -loop 0 ' +
-                     '{0}/*.png {0}/animation.gif'.format(outdir))
+        if not arguments.skip_gif and not arguments.stamps:
             print('{0}/animation.gif created.'.format(outdir))
 
     print('Elapsed Time: {0} min {1} sec.'.format(elapsed // 60, elapsed % 60))
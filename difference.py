@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Authors: Yücel Kılıç, Murat Kaplan, Nurdan Karapınar, Tolga Atay.
+# This is an open-source software licensed under GPLv3.
+
+
+try:
+    from astropy.io import fits
+except ImportError:
+    print('Python cannot import astropy. Make sure astropy is installed.')
+    raise SystemExit
+
+try:
+    import numpy as np
+except ImportError:
+    print('Python cannot import numpy. Make sure numpy is installed.')
+    raise SystemExit
+
+try:
+    import frames
+except ImportError:
+    print('Python cannot import frames.py. Make sure frames.py is in',
+          'the same folder as difference.py.')
+    raise SystemExit
+
+import glob
+import os
+import warnings
+from configparser import ConfigParser
+
+config = ConfigParser()
+
+if os.path.exists('./atrack.config'):
+    config.read('./atrack.config')
+else:
+    print('Python cannot open the configuration file. Make sure atrack.config',
+          'is in the same folder as atrack.py.')
+    raise SystemExit
+
+# Template of the static sky: median or clip (sigma-clipped mean, σ from
+# the median absolute deviation), the clipping limit, and the memory used
+# by one chunk of the stack (MB).
+TEMPLATE = config.get('difference', 'TEMPLATE', fallback='median')
+CLIP_SIGMA = config.getfloat('difference', 'CLIP_SIGMA', fallback=3.0)
+CHUNK_MEMORY = config.getfloat('difference', 'CHUNK_MEMORY', fallback=512)
+
+
+def sky_level(fitsfile, cache, step=8):
+
+    '''
+    Median sky level of a frame, from every step-th pixel of every step-th
+    row.
+
+    @param fitsfile: FITS file.
+    @type fitsfile: string
+    @param cache: Frames the pixels are read from.
+    @type cache: frames.FrameCache
+    @param step: Sampling step (pixel).
+    @type step: integer
+    @return: float
+    '''
+
+    frame = cache.frame(fitsfile)
+    sample = cache.convert(frame['raw'][::step, ::step], frame, np.float32)
+
+    return(float(np.nanmedian(sample)))
+
+
+def combine(stack, method=TEMPLATE, sigma=CLIP_SIGMA, iterations=3):
+
+    '''
+    Combines a stack of frame chunks along its first axis. The clip method
+    rejects the pixels more than sigma from the median, σ being the robust
+    1.4826 * median(|stack - median|), so that an outlier does not widen
+    its own limit in a stack of a few frames; the rest are averaged.
+
+    @param stack: Chunks of the frames, (frames, rows, columns).
+    @type stack: numpy.ndarray
+    @param method: median, or clip for a sigma-clipped mean.
+    @type method: string
+    @param sigma: Clipping limit (σ) of the clip method.
+    @type sigma: float
+    @param iterations: Clipping iterations of the clip method.
+    @type iterations: integer
+    @return: numpy.ndarray
+    '''
+
+    if method == 'median':
+        return(np.median(stack, axis=0))
+
+    if method != 'clip':
+        raise ValueError('Unknown template method: {0}'.format(method))
+
+    stack = stack.copy()
+    with warnings.catch_warnings():
+        # Pixels clipped in every frame give NaN; they are filled below.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for i in range(iterations):
+            center = np.nanmedian(stack, axis=0)
+            deviation = np.abs(stack - center)
+            std = 1.4826 * np.nanmedian(deviation, axis=0)
+            clipped = deviation > sigma * std
+            if not clipped.any():
+                break
+            stack[clipped] = np.nan
+        mean = np.nanmean(stack, axis=0)
+
+    return(np.where(np.isnan(mean), center, mean))
+
+
+def chunk_rows(nframes, width, memory=CHUNK_MEMORY):
+
+    '''
+    Number of rows of a chunk, so that the float32 stack of the chunk and
+    the temporary arrays of its combination fit in memory.
+
+    @param nframes: Number of frames in the stack.
+    @type nframes: integer
+    @param width: Width of the frames (pixel).
+    @type width: integer
+    @param memory: Memory limit (MB).
+    @type memory: float
+    @return: integer
+    '''
+
+    return(max(1, int(memory * 1024 ** 2) // (4 * nframes * width * 4)))
+
+
+def create(outfile, header, shape):
+
+    '''
+    Creates a float32 FITS file of the given shape on disk without writing
+    its pixels, and opens it for chunk by chunk writing.
+
+    @param outfile: FITS file.
+    @type outfile: string
+    @param header: Header of the file (the data keywords are replaced).
+    @type header: astropy.io.fits.Header
+    @param shape: (rows, columns)
+    @type shape: tuple
+    @return: astropy.io.fits.HDUList
+    '''
+
+    header = header.copy()
+    for keyword in ('BSCALE', 'BZERO', 'BLANK'):
+        header.remove(keyword, ignore_missing=True, remove_all=True)
+    header['BITPIX'] = -32
+    header['NAXIS'] = 2
+    header['NAXIS1'] = shape[1]
+    header['NAXIS2'] = shape[0]
+
+    header.tofile(outfile, overwrite=True)
+    with open(outfile, 'rb+') as f:
+        # The data unit is padded to a multiple of 2880 bytes.
+        size = len(header.tostring()) + shape[0] * shape[1] * 4
+        f.seek(size + (-size) % 2880 - 1)
+        f.write(b'\0')
+
+    return(fits.open(outfile, mode='update', memmap=True))
+
+
+def subtract_template(fitsfiles, templatefile, diffdir, method=TEMPLATE,
+                      sigma=CLIP_SIGMA, memory=CHUNK_MEMORY):
+
+    '''
+    Builds a template of the static sky from aligned frames, and writes
+    the difference of each frame and the template. The frames are read
+    and the outputs written in chunks of rows through memory maps, so
+    that only one chunk of the whole stack is in memory. The sky level
+    of each frame is subtracted before the combination; the frames are
+    not scaled to each other.
+
+    @param fitsfiles: Aligned FITS files, all of the same size.
+    @type fitsfiles: list
+    @param templatefile: Output FITS file of the template.
+    @type templatefile: string
+    @param diffdir: Output directory of the difference images, which have
+    the names and headers of the frames.
+    @type diffdir: string
+    @param method: median, or clip for a sigma-clipped mean.
+    @type method: string
+    @param sigma: Clipping limit (σ) of the clip method.
+    @type sigma: float
+    @param memory: Memory limit of a chunk (MB).
+    @type memory: float
+    @return: list
+    '''
+
+    cache = frames.FrameCache(0, len(fitsfiles))
+    shapes = set(cache.frame(fitsfile)['raw'].shape for fitsfile in fitsfiles)
+
+    if len(shapes) != 1:
+        print('Frames of different sizes cannot be subtracted. Align them',
+              'first.')
+        cache.clear()
+        return([])
+
+    ny, nx = shapes.pop()
+    skies = [sky_level(fitsfile, cache) for fitsfile in fitsfiles]
+
+    if not os.path.isdir(diffdir):
+        os.makedirs(diffdir)
+
+    difffiles = [os.path.join(diffdir, os.path.basename(fitsfile))
+                 for fitsfile in fitsfiles]
+
+    header = cache.header(fitsfiles[0]).copy()
+    header['NCOMBINE'] = (len(fitsfiles), 'Number of combined frames')
+    header['COMBTYPE'] = (method, 'Combination of the template')
+    template = create(templatefile, header, (ny, nx))
+    outputs = [create(difffile, cache.header(fitsfile), (ny, nx))
+               for fitsfile, difffile in zip(fitsfiles, difffiles)]
+
+    rows = chunk_rows(len(fitsfiles), nx, memory)
+    stack = np.empty((len(fitsfiles), min(rows, ny), nx), dtype=np.float32)
+
+    try:
+        for y0 in range(0, ny, rows):
+            y1 = min(y0 + rows, ny)
+            chunk = stack[:, :y1 - y0]
+            for i, fitsfile in enumerate(fitsfiles):
+                chunk[i] = cache.section(fitsfile, y0, y1, 0, nx, np.float32)
+                chunk[i] -= skies[i]
+
+            sky = combine(chunk, method, sigma)
+            template[0].data[y0:y1] = sky
+            for i, output in enumerate(outputs):
+                output[0].data[y0:y1] = chunk[i] - sky
+    finally:
+        for hdu in [template] + outputs:
+            hdu.close()
+        cache.clear()
+
+    return(difffiles)
+
+
+def make_differences(fitsdir, outdir, method=TEMPLATE, sigma=CLIP_SIGMA,
+                     memory=CHUNK_MEMORY):
+
+    '''
+    Subtracts the template of the static sky from the aligned FITS files of
+    a directory (see subtract_template). The template is saved as
+    template.fits and the difference images in the difference directory
+    of outdir.
+
+    @param fitsdir: Directory of the aligned FITS files.
+    @type fitsdir: string
+    @param outdir: Output directory.
+    @type outdir: string
+    @param method: median, or clip for a sigma-clipped mean.
+    @type method: string
+    @param sigma: Clipping limit (σ) of the clip method.
+    @type sigma: float
+    @param memory: Memory limit of a chunk (MB).
+    @type memory: float
+    @return: string
+    '''
+
+    fitsfiles = sorted(glob.glob(fitsdir + '/*.fits'))
+    diffdir = os.path.join(outdir, 'difference')
+
+    if len(fitsfiles) < 3:
+        print('At least 3 frames are needed for a template.')
+        return(None)
+
+    difffiles = subtract_template(fitsfiles,
+                                  os.path.join(outdir, 'template.fits'),
+                                  diffdir, method, sigma, memory)
+
+    if not difffiles:
+        return(None)
+
+    return(diffdir)
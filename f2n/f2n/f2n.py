@@ -20,6 +20,9 @@ from astropy.io import fits
 
 fontsdir = os.path.join(os.path.dirname(__file__), "f2n_fonts")
 
+# Number of entries of the gray scale lookup tables.
+LUTSIZE = 65536
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
 
 
@@ -77,7 +80,9 @@ class f2nimage:
                                 raise RuntimeError(
                                         'Your array must be 2D.')
 
-                        self.numpyarray = numpyarray.astype(np.float32)
+                        # No copy if the array is already float32.
+                        self.numpyarray = np.asarray(numpyarray,
+                                                     dtype=np.float32)
 
                 # We keep trace of any crops through these :
                 self.xa = 0
@@ -189,31 +194,45 @@ class f2nimage:
                                         print('For the stats I will leave a '
                                               'border {0} pixels'.format(
                                                       border))
+                                # A view, the image is not copied.
                                 calcarray = self.numpyarray[border:-border,
-                                                            border:-border].copy()
+                                                            border:-border]
                         else:
-                                calcarray = self.numpyarray.copy()
+                                calcarray = self.numpyarray
                 else:
-                        calcarray = self.numpyarray.copy()
+                        calcarray = self.numpyarray
                         if self.verbose:
                                 print('Image is too small for a'
                                       ' border of {0}'.format(border))
-                calcarray.shape = calcarray.size  # We flatten the 2D array
+
+                # The statistics are done on a regular grid of about
+                # samplesizelimit pixels, so only the sample is copied.
+                step = max(int(np.sqrt(calcarray.size /
+                                       float(samplesizelimit))), 1)
+                statsel = calcarray[::step, ::step].ravel()
 
                 # Now we handle an eventual saturation so that it does
                 # not fool the code :
                 if satlevel > 0:
-                        calcarray = calcarray[calcarray < satlevel]
+                        statsel = statsel[statsel < satlevel]
                         # we simply skip pixels higher than satlevel...
 
-                # Starting with the simple possibilities :
+                # Starting with the simple possibilities. The extrema
+                # are taken over every pixel (without copying them) :
+                if (z1 == 'ex' or z2 == 'ex') and satlevel > 0:
+                        exmask = calcarray < satlevel
+                else:
+                        exmask = True
+
                 if z1 == 'ex':
-                        self.z1 = np.min(calcarray)
+                        self.z1 = np.min(calcarray, where=exmask,
+                                         initial=np.inf)
                         if self.verbose:
                                 print('Setting ex z1 to {0}'.format(self.z1))
 
                 if z2 == 'ex':
-                        self.z2 = np.max(calcarray)
+                        self.z2 = np.max(calcarray, where=exmask,
+                                         initial=-np.inf)
                         if self.verbose:
                                 print('Setting ex z2 to {0}'.format(self.z2))
 
@@ -231,24 +250,6 @@ class f2nimage:
                 if (z1 == 'auto' or z2 == 'auto' or
                         z1 == 'flat' or z2 == 'flat'):
 
-                        # To speed up, we do not want to do statistics
-                        # on the full image if it is large.  So we
-                        # prepare a small random sample of pixels.
-
-                        # We flatten the 2D array
-                        calcarray.shape = calcarray.size
-                        if calcarray.size > samplesizelimit:
-                                # selectionindices =
-                                # np.random.random_integers(low = 0,
-                                # high = calcarray.size - 1,
-                                # size=samplesizelimit)
-                                selectionindices = np.linspace(0,
-                                                               calcarray.size-1,
-                                                               samplesizelimit).astype(np.int)
-                                statsel = calcarray[selectionindices]
-                        else:
-                                statsel = calcarray
-
                         medianlevel = np.median(statsel)
                         firststd = np.std(statsel)
 
@@ -269,9 +270,9 @@ class f2nimage:
                                                                 
                         if z2 == 'auto':
                                 # Here we want to reject a percentage of high values...
-                                sortedstatsel = np.sort(statsel) 
-                                n = int(round(0.9995 * statsel.size))
-                                self.z2 = sortedstatsel[n]
+                                n = min(int(round(0.9995 * statsel.size)),
+                                        statsel.size - 1)
+                                self.z2 = np.partition(statsel, n)[n]
                                 if self.verbose:
                                         print('Setting auto z2 to {0}'.format(self.z2)) 
                                 
@@ -425,35 +426,26 @@ class f2nimage:
 
                 if scale == 'log' or scale == 'lin':
                         self.negative = negative
-                        # numpyarrayshape = self.numpyarray.shape
-
-                        # calcarray.ravel() # does not change in place
-                        # in fact !
-                        calcarray = calcarray.clip(min=self.z1, max=self.z2)
 
+                        # The stretch is tabulated once, and the pixels
+                        # go straight to uint8 through the table.
                         if scale == 'log':
-                                # calcarray = np.array(map(lambda x:
-                                # loggray(x, self.z1, self.z2),
-                                # calcarray))
-                                calcarray = loggray(calcarray, self.z1,
-                                                    self.z2)
+                                lut = loggray(np.linspace(
+                                        self.z1, self.z2, LUTSIZE),
+                                              self.z1, self.z2)
                         else:
-                                # calcarray = np.array(map(lambda x:
-                                # lingray(x, self.z1, self.z2),
-                                # calcarray))
-
-                                calcarray = lingray(calcarray, self.z1,
-                                                    self.z2)
-
-                        # calcarray.shape = numpyarrayshape
-                        # bwarray = np.zeros(calcarray.shape, dtype=np.uint8)
-                        bwarray = np.zeros(calcarray.shape, dtype=np.float64)
-                        calcarray.round(out=bwarray)
+                                lut = lingray(np.linspace(
+                                        self.z1, self.z2, LUTSIZE),
+                                              self.z1, self.z2)
+                        lut = np.nan_to_num(lut).round().clip(
+                                0, 255).astype(np.uint8)
 
                         if negative:
                                 if self.verbose:
                                         print('Using negative scale')
-                                bwarray = 255 - bwarray
+                                lut = 255 - lut
+
+                        bwarray = stretch(calcarray, self.z1, self.z2, lut)
 
                         if self.verbose:
                                 print('PIL range : [{0}, {1}]'.format(
@@ -1008,6 +1000,31 @@ class f2nimage:
                 self.pilimage.save(outfile, 'PNG')
 
 
+def stretch(x, a, b, lut, chunksize=256):
+        """
+        Maps x to uint8 through lut, which tabulates the gray scale
+        between the cutoffs a and b. Rows are done in chunks, so the
+        only full-size array is the uint8 result.
+        """
+        out = np.empty(x.shape, dtype=np.uint8)
+        n = len(lut) - 1
+        factor = n / float(b - a) if b != a else 0.0
+        buf = np.empty((min(chunksize, x.shape[0]),) + x.shape[1:],
+                       dtype=np.float32)
+
+        for i in range(0, x.shape[0], chunksize):
+                chunk = buf[:min(chunksize, x.shape[0] - i)]
+                np.subtract(x[i:i + chunksize], a, out=chunk,
+                            casting='unsafe')
+                chunk *= factor
+                np.nan_to_num(chunk, copy=False)
+                np.clip(chunk, 0, n, out=chunk)
+                np.rint(chunk, out=chunk)
+                np.take(lut, chunk.astype(np.intp), out=out[i:i + chunksize])
+
+        return out
+
+
 def lingray(x, a=None, b=None):
         """
         Auxiliary function that specifies the linear gray scale.
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Authors: Yücel Kılıç, Murat Kaplan, Nurdan Karapınar, Tolga Atay.
+# This is an open-source software licensed under GPLv3.
+
+
+try:
+    from astropy.io import fits
+except ImportError:
+    print('Python cannot import astropy. Make sure astropy is installed.')
+    raise SystemExit
+
+try:
+    import numpy as np
+except ImportError:
+    print('Python cannot import numpy. Make sure numpy is installed.')
+    raise SystemExit
+
+import os
+from collections import OrderedDict
+from configparser import ConfigParser
+
+config = ConfigParser()
+
+if os.path.exists('./atrack.config'):
+    config.read('./atrack.config')
+else:
+    print('Python cannot open the configuration file. Make sure atrack.config',
+          'is in the same folder as atrack.py.')
+    raise SystemExit
+
+
+class FrameCache:
+
+    def __init__(self, max_memory=1024, max_files=16):
+
+        '''
+        Memory-mapped access to FITS frames. The pixels stay on disk
+        until they are used; arrays converted to another dtype (or
+        scaled with BSCALE/BZERO) are kept in a least recently used
+        cache with a memory cap.
+
+        @param max_memory: Memory cap of the converted arrays (MB).
+        @type max_memory: float
+        @param max_files: Maximum number of open frames.
+        @type max_files: integer
+        '''
+
+        self.max_memory = max_memory * 1024 ** 2
+        self.max_files = max_files
+        self.frames = OrderedDict()
+        self.memory = 0
+
+    def frame(self, fitsfile):
+
+        '''
+        Opens a frame (or returns it from the cache) and marks it as the
+        most recently used one.
+
+        @param fitsfile: FITS file.
+        @type fitsfile: string
+        @return: dict
+        '''
+
+        fitsfile = os.path.abspath(fitsfile)
+
+        if fitsfile in self.frames:
+            self.frames.move_to_end(fitsfile)
+            return self.frames[fitsfile]
+
+        hdu = fits.open(fitsfile, memmap=True, do_not_scale_image_data=True)
+        header = hdu[0].header
+        frame = {'hdu': hdu,
+                 'raw': hdu[0].data,
+                 'bscale': header.get('BSCALE', 1),
+                 'bzero': header.get('BZERO', 0),
+                 'converted': {}}
+
+        self.frames[fitsfile] = frame
+        self.evict()
+
+        return frame
+
+    def evict(self):
+
+        '''
+        Closes the least recently used frames until the cache is within
+        its limits. The most recently used frame is always kept.
+        '''
+
+        while len(self.frames) > 1 and (len(self.frames) > self.max_files or
+                                        self.memory > self.max_memory):
+            fitsfile, frame = self.frames.popitem(last=False)
+            self.memory -= sum(array.nbytes
+                               for array in frame['converted'].values())
+            frame['hdu'].close()
+
+    def scaled(self, frame):
+
+        '''
+        Tells if the pixels of a frame need BSCALE/BZERO scaling.
+        @return: boolean
+        '''
+
+        return frame['bscale'] != 1 or frame['bzero'] != 0
+
+    def convert(self, raw, frame, dtype):
+
+        '''
+        Converts raw pixels to dtype, applying BSCALE/BZERO.
+        @return: numpy.ndarray
+        '''
+
+        array = raw.astype(dtype)
+
+        if self.scaled(frame):
+            array *= frame['bscale']
+            array += frame['bzero']
+
+        return array
+
+    def data(self, fitsfile, dtype=None):
+
+        '''
+        Returns the pixels of a frame. Unscaled frames asked for without a
+        dtype are returned as the memory map itself (no copy).
+
+        @param fitsfile: FITS file.
+        @type fitsfile: string
+        @param dtype: Wanted data type (default: stored type, or float32
+        for scaled frames).
+        @type dtype: numpy.dtype
+        @return: numpy.ndarray
+        '''
+
+        frame = self.frame(fitsfile)
+        raw = frame['raw']
+
+        if dtype is None:
+            if not self.scaled(frame):
+                return raw
+            dtype = np.float32
+
+        dtype = np.dtype(dtype)
+        if dtype == raw.dtype and not self.scaled(frame):
+            return raw
+
+        if dtype not in frame['converted']:
+            array = self.convert(raw, frame, dtype)
+            frame['converted'][dtype] = array
+            self.memory += array.nbytes
+            self.evict()
+
+        return frame['converted'][dtype]
+
+    def section(self, fitsfile, y0, y1, x0, x1, dtype=None):
+
+        '''
+        Returns a window of a frame, data[y0:y1, x0:x1]. Only the window
+        is read from disk, unless the converted frame is already cached.
+
+        @param fitsfile: FITS file.
+        @type fitsfile: string
+        @param dtype: Wanted data type (see data).
+        @type dtype: numpy.dtype
+        @return: numpy.ndarray
+        '''
+
+        frame = self.frame(fitsfile)
+        raw = frame['raw'][y0:y1, x0:x1]
+
+        if dtype is None:
+            if not self.scaled(frame):
+                return raw
+            dtype = np.float32
+
+        dtype = np.dtype(dtype)
+        if dtype in frame['converted']:
+            return frame['converted'][dtype][y0:y1, x0:x1]
+
+        if dtype == raw.dtype and not self.scaled(frame):
+            return raw
+
+        return self.convert(raw, frame, dtype)
+
+    def header(self, fitsfile):
+
+        '''
+        Returns the primary header of a frame.
+        @return: astropy.io.fits.Header
+        '''
+
+        return self.frame(fitsfile)['hdu'][0].header
+
+    def clear(self):
+
+        '''
+        Closes all frames.
+        '''
+
+        for frame in self.frames.values():
+            frame['hdu'].close()
+        self.frames.clear()
+        self.memory = 0
+
+
+# Frames shared by rendering, cutouts and photometry of a process.
+cache = FrameCache(config.getfloat('frames', 'CACHE_MEMORY', fallback=1024),
+                   config.getint('frames', 'CACHE_FILES', fallback=16))
+
+
+def data(fitsfile, dtype=None):
+
+    '''
+    FrameCache.data of the shared cache.
+    '''
+
+    return cache.data(fitsfile, dtype)
+
+
+def section(fitsfile, y0, y1, x0, x1, dtype=None):
+
+    '''
+    FrameCache.section of the shared cache.
+    '''
+
+    return cache.section(fitsfile, y0, y1, x0, x1, dtype)
+
+
+def header(fitsfile):
+
+    '''
+    FrameCache.header of the shared cache.
+    '''
+
+    return cache.header(fitsfile)
@@ -58,10 +58,11 @@ atrack_dep_pip(){
    echo '      Installing dependencies via pip3.'
    echo ''
    echo ''
-   echo '      Installing pandas, numpy' 
+   echo '      Installing pandas, numpy, sep' 
    echo '      (Be patient...)'
    echo ''
    pip3 install --upgrade pandas   
+   pip3 install --upgrade sep
    mkdir atrack_tmp/
    cd atrack_tmp/
    echo ''
@@ -128,7 +129,7 @@ distro=$(cat /etc/issue| head -n1| awk '{print $1}')
 if [ $distro = "Debian" -o $distro = "Ubuntu" -o $distro = "Linux" ]; then
     echo ''
     echo 'The following extra packages will be installed for A-Track;'
-    echo 'pandas, numpy, alipy, astroasciidata'
+    echo 'pandas, numpy, sep, alipy, astroasciidata'
     echo $DEPS_deb
     echo ''
     read -r -p "Do you want to proceed? [y/N] " response
@@ -144,7 +145,7 @@ if [ $distro = "Debian" -o $distro = "Ubuntu" -o $distro = "Linux" ]; then
 elif [ $distro = "Fedora" -o $distro = "CentOS" ]; then
     echo ''
     echo 'The following extra packages will be installed for A-Track;'
-    echo 'pandas, numpy, alipy, astroasciidata'
+    echo 'pandas, numpy, sep, alipy, astroasciidata'
     echo $DEPS_rpm
     echo ''
     read -r -p "Do you want to proceed? [y/N] " response
@@ -20,7 +20,7 @@ atrack_install_dep(){
    echo ''
    echo '      imagemagick, pandas, numpy, sextractor, pyfits'
    echo '      pyfits, scipy, matplotlib, pyds9, alipy'
-   echo '      astroasciidata, f2n, pillow;'
+   echo '      astroasciidata, f2n, pillow, sep;'
    echo '      will be installed. (Be patient...)'
    echo ''
    brew update
@@ -31,7 +31,7 @@ atrack_install_dep(){
 	   brew install $pkg
        fi
    done
-   pip3 install --upgrade numpy pandas pyfits scipy matplotlib pillow
+   pip3 install --upgrade numpy pandas pyfits scipy matplotlib pillow sep
    pip3 install git+https://github.com/ericmandel/pyds9.git#egg=pyds9
    mkdir atrack_tmp/
    cd atrack_tmp/
@@ -99,7 +99,7 @@ if [ "$(uname -s)" == "Darwin" ]; then
 	echo 'The following extra packages will be installed for A-Track;'
 	echo 'imagemagick, pandas, numpy, sextractor, pyfits'
 	echo 'pyfits, scipy, matplotlib, pyds9, alipy'
-	echo 'astroasciidata, f2n, pillow.'
+	echo 'astroasciidata, f2n, pillow, sep.'
 	read -r -p "Do you want to proceed? [y/N] " response
 	case $response in
 	    [yY][eE][sS]|[yY])
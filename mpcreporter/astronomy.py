@@ -9,13 +9,41 @@ from astropy.time import Time
 from datetime import datetime
 from datetime import timedelta
 
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from io import StringIO
 from math import log10
-from os import path, system
+from os import path, makedirs, replace
+from urllib.request import urlopen
+
+import numpy as np
 from numpy import genfromtxt
 
 from .io import FileOps
 
 
+SKYBOT_URL = ("http://vo.imcce.fr/webservices/skybot/"
+              "skybotconesearch_query.php"
+              "?-ep={0}&-ra={1}&-dec={2}&-rm={3}&-output=object&"
+              "-loc={4}&-filter=120&-objFilter=120&-from="
+              "SkybotDoc&-mime=text")
+
+
+def http_get(url, timeout=60):
+
+    """
+    Default HTTP client of AstCalc: returns the response body as text.
+    @param url: Requested URL.
+    @type url: str
+    @param timeout: Timeout in seconds.
+    @type timeout: float
+    @return: str
+    """
+
+    with urlopen(url, timeout=timeout) as response:
+        return(response.read().decode("utf-8", "replace"))
+
+
 class FitsOps:
 
     def __init__(self):
@@ -73,10 +101,41 @@ NET {6}""".format(code, observer, observer, tel,
 
 class AstCalc:
 
-    def __init__(self):
+    def __init__(self, http_get=http_get, cache_dir=None, runner=None):
+
+        """
+        @param http_get: Callable taking a URL and returning the response
+        body as text. Replace it with a stand-in to work offline.
+        @type http_get: callable
+        @param cache_dir: Directory for cached SkyBoT responses
+        (None disables the cache).
+        @type cache_dir: str
+        @param runner: Runs the external tools (xy2sky, solve-field) with
+        its run and solve_field functions (None: A-Track's runner module,
+        imported when a tool is first needed).
+        @type runner: module
+        """
+
         self.fileops = FileOps()
         self.fitsops = FitsOps()
         self.timeops = TimeOps()
+        self.http_get = http_get
+        self.cache_dir = cache_dir
+        self._runner = runner
+
+    @property
+    def runner(self):
+
+        """
+        The runner of the external tools.
+        @return: module
+        """
+
+        if self._runner is None:
+            import runner
+            self._runner = runner
+
+        return(self._runner)
 
     def is_object(self, coor1, coor2, max_dist=10, min_dist=0):
 
@@ -126,31 +185,165 @@ class AstCalc:
         @type ra: str
         @param dec: DEC of field center for search, format: degrees or hh:mm:ss
         @type dec: str
-        @param radius: Radius.
+        @param radius: Radius (arcmin).
         @type radius: float
         @param observatory: Observation code.
         @type observatory: str
-        @return: str
+        @return: array
         """
 
         try:
             epoch = self.timeops.date2jd(odate)
-            bashcmd = ("wget -q \"http://vo.imcce.fr/webservices/skybot/"
-                       "skybotconesearch_query.php"
-                       "?-ep={0}&-ra={1}&-dec={2}&-rm={3}&-output=object&"
-                       "-loc={4}&-filter=120&-objFilter=120&-from="
-                       "SkybotDoc&-mime=text\" -O skybot.cat").format(
-                           epoch,
-                           ra,
-                           dec,
-                           radius,
-                           observatory)
-
-            system(bashcmd)
-            skyresult = self.fileops.read_file_as_array("skybot.cat")
-            system('rm -rf skybot.cat')
-            return (skyresult)
+            return(self.skybot_cone_search(epoch, ra, dec, radius,
+                                           observatory))
+
+        except Exception as e:
+            print(e)
+
+    def skybot_cone_search(self, epoch, ra, dec, radius=16,
+                           observatory="A84"):
+
+        """
+        Runs one SkyBoT cone search. Responses are cached on disk
+        (see cache_dir), keyed by epoch, centre, radius and observatory.
+
+        @param epoch: Observation epoch (JD).
+        @type epoch: float
+        @param ra: RA of field center, degrees
+        @type ra: float
+        @param dec: DEC of field center, degrees
+        @type dec: float
+        @param radius: Radius (arcmin).
+        @type radius: float
+        @param observatory: Observation code.
+        @type observatory: str
+        @return: array
+        """
+
+        key = "{0:.6f} {1:.6f} {2:.6f} {3:.4f} {4}".format(
+            float(epoch), float(ra), float(dec), float(radius), observatory)
+        cache_file = None
+
+        if self.cache_dir is not None:
+            cache_file = path.join(self.cache_dir, "{0}.skybot".format(
+                sha1(key.encode()).hexdigest()))
+
+        if cache_file is not None and path.exists(cache_file):
+            with open(cache_file) as f:
+                text = f.read()
+        else:
+            text = self.http_get(SKYBOT_URL.format(*key.split()))
+
+            if cache_file is not None:
+                makedirs(self.cache_dir, exist_ok=True)
+                with open(cache_file + ".tmp", "w") as f:
+                    f.write(text)
+                replace(cache_file + ".tmp", cache_file)
+
+        return(self.parse_skybot(text))
+
+    def parse_skybot(self, text):
+
+        """
+        Reads a SkyBoT text response into a 2D array of strings
+        (Num, Name, RA(h), DE(deg), ...), one row per object.
+        @param text: SkyBoT response.
+        @type text: str
+        @return: array
+        """
+
+        lines = [line for line in text.splitlines()
+                 if line.strip() and not line.startswith("#")]
+
+        if not lines:
+            return(np.empty((0, 4), dtype="U"))
+
+        skyresult = genfromtxt(StringIO("\n".join(lines)),
+                               comments=None,
+                               delimiter=" | ",
+                               dtype="U")
 
+        return(np.char.strip(np.atleast_2d(skyresult)))
+
+    def find_skybot_frames(self, queries, max_workers=4):
+
+        """
+        Runs one SkyBoT cone search per frame, concurrently.
+
+        @param queries: (odate, ra, dec, radius, observatory) tuples,
+        one per frame.
+        @type queries: list
+        @param max_workers: Maximum number of simultaneous requests.
+        @type max_workers: int
+        @return: list
+        """
+
+        def query(args):
+            odate, ra, dec, radius, observatory = args
+            skyresult = self.find_skybot_objects(odate, ra, dec,
+                                                 radius=radius,
+                                                 observatory=observatory)
+            if skyresult is None:
+                skyresult = np.empty((0, 4), dtype="U")
+            return(skyresult)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return(list(pool.map(query, queries)))
+
+    def match_skybot_objects(self, skyresult, coors, max_dist=10):
+
+        """
+        Finds the closest SkyBoT object of each detection.
+
+        @param skyresult: SkyBoT objects as returned by skybot_cone_search.
+        @type skyresult: array
+        @param coors: Detected objects' coordinates.
+        @type coors: SkyCoord
+        @param max_dist: Max distance limit in arcsec.
+        @type max_dist: float
+        @return: array (row of skyresult, -1 if nothing is close enough)
+        """
+
+        if coors.isscalar:
+            coors = coors.reshape((1,))
+        matches = np.full(len(coors), -1)
+
+        if len(skyresult) == 0:
+            return(matches)
+
+        catalog = coordinates.SkyCoord(skyresult[:, 2], skyresult[:, 3],
+                                       unit=(u.hourangle, u.deg),
+                                       frame='fk5')
+        idx, sep2d, _ = coors.match_to_catalog_sky(catalog)
+        close = sep2d.arcsecond <= max_dist
+        matches[close] = idx[close]
+
+        return(matches)
+
+    def frame_footprint(self, file_name):
+
+        """
+        Returns the field center and the radius of the circle
+        covering the whole frame. The size of the frame is NAXIS1/NAXIS2,
+        or IMAGEW/IMAGEH in a header-only .wcs file.
+        @param file_name: FITS image file name with path.
+        @type file_name: str
+        @return: list (ra, dec in degrees, radius in arcmin), or None if
+        the WCS or the size of the frame cannot be read
+        """
+
+        try:
+            header = fits.getheader(file_name)
+            w = WCS(header)
+            naxis1 = float(header.get("naxis1") or header["imagew"])
+            naxis2 = float(header.get("naxis2") or header["imageh"])
+            pix = [[naxis1 / 2, naxis2 / 2],
+                   [0, 0], [naxis1, 0], [0, naxis2], [naxis1, naxis2]]
+            sky = w.wcs_pix2world(pix, 0)
+            points = coordinates.SkyCoord(sky * u.deg, frame='fk5')
+            radius = points[0].separation(points[1:]).arcminute.max()
+
+            return([sky[0][0], sky[0][1], radius])
         except Exception as e:
             print(e)
 
@@ -228,6 +421,35 @@ class AstCalc:
         except Exception as e:
             pass
 
+    def xy2sky_batch(self, file_name, x, y):
+
+        """
+        Converts physical coordinates of many objects to WCS coordinates
+        with a single WCS. Returns both the MPC report strings and the
+        coordinates for calculations.
+
+        @param file_name: FITS image file name with path.
+        @type file_name: str
+        @param x: x coordinates of objects.
+        @type x: array
+        @param y: y coordinates of objects.
+        @type y: array
+        @return: list (array of str, SkyCoord)
+        """
+
+        w = WCS(fits.getheader(file_name))
+        ra, dec = w.wcs_pix2world(np.asarray(x, dtype=float),
+                                  np.asarray(y, dtype=float), 0)
+        astcoords = coordinates.SkyCoord(ra * u.deg, dec * u.deg,
+                                         frame='fk5')
+
+        alpha = astcoords.ra.to_string(unit=u.hourangle, sep=" ",
+                                       precision=2, pad=True)
+        delta = astcoords.dec.to_string(unit=u.deg, sep=" ", precision=1,
+                                        alwayssign=True, pad=True)
+
+        return([np.char.add(np.char.add(alpha, " "), delta), astcoords])
+
     def xy2skywcs(self, file_name, x, y):
 
         """
@@ -244,21 +466,14 @@ class AstCalc:
         """
 
         try:
-            file_path, file_and_ext = path.split(file_name)
-            system("xy2sky {0} {1} {2} > {3}/coors".format(
-                file_name,
-                x,
-                y,
-                file_path))
-            coors = genfromtxt('{0}/coors'.format(file_path),
+            result = self.runner.run(['xy2sky', file_name, x, y])
+            coors = genfromtxt(StringIO(result.stdout),
                                comments='#',
                                invalid_raise=False,
                                delimiter=None,
                                usecols=(0, 1),
                                dtype="U")
 
-            system("rm -rf {0}/coors".format(file_path))
-
             c = coordinates.SkyCoord('{0} {1}'.format(coors[0], coors[1]),
                                      unit=(u.hourangle, u.deg), frame='fk5')
 
@@ -286,21 +501,14 @@ class AstCalc:
         """
 
         try:
-            file_path, file_and_ext = path.split(file_name)
-            system("xy2sky {0} {1} {2} > {3}/coors".format(
-                file_name,
-                x,
-                y,
-                file_path))
-            coors = genfromtxt('{0}/coors'.format(file_path),
+            result = self.runner.run(['xy2sky', file_name, x, y])
+            coors = genfromtxt(StringIO(result.stdout),
                                comments='#',
                                invalid_raise=False,
                                delimiter=None,
                                usecols=(0, 1),
                                dtype="U")
 
-            system("rm -rf {0}/coors".format(file_path))
-
             c = coordinates.SkyCoord('{0} {1}'.format(coors[0], coors[1]),
                                      unit=(u.hourangle, u.deg), frame='fk5')
 
@@ -365,43 +573,24 @@ class AstCalc:
         @return: boolean
         """
 
-        try:        
+        try:
             if ra is None and dec is None:
                 fo = FitsOps()
                 ra = fo.get_header(image_path, ra_keyword)
                 dec = fo.get_header(image_path, dec_keyword)
-                ra = ra.strip()
-                dec = dec.strip()
-                ra = ra.replace(" ", ":")
-                dec = dec.replace(" ", ":")
-            else:
-                ra = ra.strip()
-                dec = dec.strip()
-                ra = ra.replace(" ", ":")
-                dec = dec.replace(" ", ":")
-#######################################################################2022.9.15
-            system(("solve-field --no-plots "
-                   "--no-verify --tweak-order {0} "
-                   "--downsample {1} --overwrite --radius {2} --no-tweak "
-                   "--ra {3} --dec {4} {5}").format(str(tweak_order),
-                                                    str(downsample),
-                                                    str(radius),
-                                                    str(ra),
-                                                    str(dec),
-                                                    str(image_path)))
-            # Cleaning
+            ra = ra.strip().replace(" ", ":")
+            dec = dec.strip().replace(" ", ":")
+
             root, extension = path.splitext(image_path)
-            system(("rm -rf {0}-indx.png {0}-indx.xyls "
-                    "{0}-ngc.png {0}-objs.png "
-                    "{0}.axy {0}.corr "
-                    "{0}.match {0}.rdls "
-                    "{0}.solved {0}.wcs").format(root))
 
-            if not path.exists(root + '.new'):
+            if not self.runner.solve_field(image_path, ra, dec,
+                                           "{0}_new.fits".format(root),
+                                           tweak_order=tweak_order,
+                                           downsample=downsample,
+                                           radius=radius):
                 print(image_path + ' cannot be solved!')
                 return (False)
             else:
-                system("mv {0}.new {0}_new.fits".format(root))
                 print("{0}.fits --> {0}_new.fits: solved!".format(root))
                 return (True)
 
@@ -43,6 +43,26 @@ class FileOps:
         except Exception as e:
             print(e)
 
+    def table2res(self, *tables):
+
+        """
+        Builds the reporter rows (ObjectID, FileID, x, y, Flux) directly
+        from A-Track object tables, in the same layout as read_res.
+        @param tables: Moving and uncertain object tables.
+        @type tables: astropy.table.Table
+        @return: array
+        """
+
+        columns = ['ObjectID', 'FileID', 'x', 'y', 'Flux']
+        rows = [np.column_stack([np.asarray(table[col], dtype=float)
+                                 for col in columns])
+                for table in tables if len(table)]
+
+        if not rows:
+            return(np.empty((0, len(columns))))
+
+        return(np.concatenate(rows))
+
     def get_file_list(self, dir_name):
 
         """
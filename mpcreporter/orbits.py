@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+from astropy import coordinates
+from astropy import units as u
+from astropy.coordinates import get_body_barycentric
+from astropy.time import Time
+
+from hashlib import sha1
+from os import path, makedirs, replace
+
+import numpy as np
+
+from .astronomy import AstCalc
+
+
+# Gaussian gravitational constant squared (AU^3/day^2) and
+# speed of light (AU/day).
+GM_SUN = 0.01720209895 ** 2
+C_AU_DAY = 173.1446326846693
+EARTH_RADIUS_AU = 6378.137 / 149597870.7
+OBLIQUITY_J2000 = np.radians(23.4392911)
+
+# Packed MPC epoch digits: 1-9, then A=10 ... V=31.
+PACKED_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUV"
+
+
+class OrbitOps:
+
+    def __init__(self, database, obscodes=None, cache_dir=None,
+                 margin=1.0):
+
+        """
+        Predicts positions of the objects of the MPC Orbit (MPCORB)
+        Database without any network access.
+
+        @param database: MPCORB.DAT path.
+        @type database: str
+        @param obscodes: MPC ObsCodes file path. Without it the
+        positions are geocentric.
+        @type obscodes: str
+        @param cache_dir: Directory for parsed elements and the
+        per-night positions (None disables the cache).
+        @type cache_dir: str
+        @param margin: Largest motion expected within a night (degrees).
+        @type margin: float
+        """
+
+        self.database = database
+        self.obscodes = obscodes
+        self.cache_dir = cache_dir
+        self.margin = margin
+        self.elements = None
+        self.stamp = None
+        self.astcalc = AstCalc()
+
+    def cache_file(self, *key):
+
+        """
+        Returns the cache file name for the given key, or None.
+        @return: str
+        """
+
+        if self.cache_dir is None:
+            return(None)
+
+        makedirs(self.cache_dir, exist_ok=True)
+        key = " ".join(str(k) for k in key)
+
+        return(path.join(self.cache_dir, "{0}.npz".format(
+            sha1(key.encode()).hexdigest())))
+
+    def load_elements(self):
+
+        """
+        Reads the orbital elements of MPCORB.DAT into NumPy arrays. The
+        size and mtime of the file they are read from are kept in stamp.
+        @return: dict
+        """
+
+        if self.elements is not None:
+            return(self.elements)
+
+        self.stamp = (path.getsize(self.database),
+                      path.getmtime(self.database))
+        cache_file = self.cache_file("mpcorb", self.database, *self.stamp)
+
+        if cache_file is not None and path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                self.elements = dict(cached)
+            return(self.elements)
+
+        with open(self.database, "rb") as f:
+            raw = f.read()
+
+        # The records start after the dashed line closing the header.
+        header_end = raw.find(b"\n-----")
+        if header_end >= 0:
+            raw = raw[raw.index(b"\n", header_end + 1) + 1:]
+
+        # Trailing blanks may be stripped; pad every record to 202 columns.
+        lines = np.array([line for line in raw.splitlines()
+                          if len(line) >= 103], dtype="S202")
+        table = lines.view("S1").reshape(len(lines), lines.itemsize)
+
+        def column(first, last):
+            # MPC column numbers are 1-based and inclusive.
+            return(table[:, first - 1:last].copy().view(
+                "S{0}".format(last - first + 1)).ravel())
+
+        def numbers(first, last):
+            col = np.char.strip(column(first, last))
+            return(np.where(col == b"", b"nan", col).astype(float))
+
+        packed_epochs, inverse = np.unique(column(21, 25),
+                                           return_inverse=True)
+        epochs = np.array([self.unpack_epoch(epoch.decode())
+                           for epoch in packed_epochs])
+
+        names = np.char.strip(column(167, 194)).astype("U")
+        # "(1) Ceres" is reported as "Ceres", as SkyBoT does.
+        names = np.array([name.split(") ", 1)[-1] for name in names])
+
+        self.elements = {
+            "designation": np.char.strip(column(1, 7)).astype("U"),
+            "name": names,
+            "H": numbers(9, 13),
+            "G": numbers(15, 19),
+            "epoch": epochs[inverse.ravel()],
+            "M": np.radians(numbers(27, 35)),
+            "peri": np.radians(numbers(38, 46)),
+            "node": np.radians(numbers(49, 57)),
+            "incl": np.radians(numbers(60, 68)),
+            "e": numbers(71, 79),
+            "n": np.radians(numbers(81, 91)),
+            "a": numbers(93, 103)}
+
+        if cache_file is not None:
+            np.savez(cache_file + ".tmp.npz", **self.elements)
+            replace(cache_file + ".tmp.npz", cache_file)
+
+        return(self.elements)
+
+    def unpack_epoch(self, packed):
+
+        """
+        Converts a packed MPC epoch (e.g. K239T) to TT Julian Date.
+        @param packed: Packed epoch.
+        @type packed: str
+        @return: float
+        """
+
+        year = (PACKED_DIGITS.index(packed[0]) * 100 + int(packed[1:3]))
+        month = PACKED_DIGITS.index(packed[3])
+        day = PACKED_DIGITS.index(packed[4])
+
+        return(Time("{0:04d}-{1:02d}-{2:02d}".format(year, month, day),
+                    scale="tt").jd)
+
+    def kepler(self, M, e, iterations=20):
+
+        """
+        Solves Kepler's equation M = E - e sin(E) for all orbits at once.
+        @param M: Mean anomalies (radian).
+        @type M: array
+        @param e: Eccentricities.
+        @type e: array
+        @return: array
+        """
+
+        M = np.remainder(M, 2 * np.pi)
+        E = np.where(e < 0.8, M, np.pi)
+
+        for _ in range(iterations):
+            dE = (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+            E -= dE
+            if np.nanmax(np.abs(dE)) < 1e-12:
+                break
+
+        return(E)
+
+    def propagate(self, jd, idx=None):
+
+        """
+        Heliocentric equatorial (J2000) positions of the orbits at the
+        given TDB Julian Date, with a two-body Kepler propagation.
+
+        @param jd: Epoch (TDB JD), scalar or one per orbit.
+        @type jd: float, array
+        @param idx: Orbits to propagate (default: all).
+        @type idx: array
+        @return: array (3, n) in AU
+        """
+
+        el = self.load_elements()
+        if idx is None:
+            idx = slice(None)
+
+        a, e, incl = el["a"][idx], el["e"][idx], el["incl"][idx]
+        peri, node = el["peri"][idx], el["node"][idx]
+        M = el["M"][idx] + el["n"][idx] * (jd - el["epoch"][idx])
+
+        E = self.kepler(M, e)
+        xv = a * (np.cos(E) - e)
+        yv = a * np.sqrt(1 - e * e) * np.sin(E)
+
+        cos_p, sin_p = np.cos(peri), np.sin(peri)
+        cos_n, sin_n = np.cos(node), np.sin(node)
+        cos_i, sin_i = np.cos(incl), np.sin(incl)
+
+        # Orbital plane -> ecliptic J2000
+        x = ((cos_n * cos_p - sin_n * sin_p * cos_i) * xv +
+             (-cos_n * sin_p - sin_n * cos_p * cos_i) * yv)
+        y = ((sin_n * cos_p + cos_n * sin_p * cos_i) * xv +
+             (-sin_n * sin_p + cos_n * cos_p * cos_i) * yv)
+        z = (sin_p * sin_i) * xv + (cos_p * sin_i) * yv
+
+        # Ecliptic -> equatorial J2000
+        cos_e, sin_e = np.cos(OBLIQUITY_J2000), np.sin(OBLIQUITY_J2000)
+
+        return(np.array([x, cos_e * y - sin_e * z, sin_e * y + cos_e * z]))
+
+    def observatory_code(self, observatory):
+
+        """
+        Reads longitude and parallax constants of an observatory from
+        the MPC ObsCodes file.
+
+        @param observatory: Observatory code.
+        @type observatory: str
+        @return: list (longitude in degrees, rho cos phi, rho sin phi)
+        """
+
+        if self.obscodes is None or not path.exists(self.obscodes):
+            return(None)
+
+        with open(self.obscodes) as f:
+            for line in f:
+                if line[:3] == observatory:
+                    try:
+                        return([float(line[4:13]), float(line[13:21]),
+                                float(line[21:30])])
+                    except ValueError:
+                        # Space-based or roving observer
+                        return(None)
+
+    def observer_position(self, t, observatory):
+
+        """
+        Barycentric equatorial position of the observer (AU).
+        @param t: Observation time.
+        @type t: astropy.time.Time
+        @param observatory: Observatory code.
+        @type observatory: str
+        @return: array
+        """
+
+        earth = get_body_barycentric("earth", t).xyz.to(u.au).value
+        code = self.observatory_code(observatory)
+
+        if code is None:
+            return(earth)
+
+        longitude, rho_cos, rho_sin = code
+        theta = t.sidereal_time("apparent", longitude * u.deg).radian
+
+        return(earth + EARTH_RADIUS_AU * np.array([rho_cos * np.cos(theta),
+                                                   rho_cos * np.sin(theta),
+                                                   rho_sin]))
+
+    def predict(self, odate, observatory, idx=None):
+
+        """
+        Topocentric astrometric RA/Dec of the orbits, corrected for
+        light time.
+
+        @param odate: Observation date (UTC).
+        @type odate: date
+        @param observatory: Observatory code.
+        @type observatory: str
+        @param idx: Orbits to compute (default: all).
+        @type idx: array
+        @return: list (ra, dec in degrees)
+        """
+
+        t = Time(odate, scale="utc")
+        jd = t.tdb.jd
+        sun = get_body_barycentric("sun", t).xyz.to(u.au).value
+        observer = self.observer_position(t, observatory) - sun
+
+        # One light-time iteration is enough at the arcsec level.
+        rel = self.propagate(jd, idx) - observer[:, None]
+        delta = np.sqrt(np.sum(rel * rel, axis=0))
+        rel = self.propagate(jd - delta / C_AU_DAY, idx) - observer[:, None]
+
+        ra = np.degrees(np.arctan2(rel[1], rel[0])) % 360
+        dec = np.degrees(np.arctan2(rel[2], np.hypot(rel[0], rel[1])))
+
+        return([ra, dec])
+
+    def night_positions(self, odate, observatory):
+
+        """
+        Positions of all orbits at the middle of the (local) night of
+        odate. They are cached and only used to preselect the objects
+        near a field.
+
+        @param odate: Observation date (UTC).
+        @type odate: date
+        @param observatory: Observatory code.
+        @type observatory: str
+        @return: list (ra, dec in degrees)
+        """
+
+        code = self.observatory_code(observatory)
+        longitude = code[0] if code is not None else 0.0
+        if longitude > 180:
+            longitude -= 360
+
+        # JD changes at noon UTC; shift it to local noon.
+        night = int(Time(odate, scale="utc").jd + longitude / 360.0)
+        midnight = Time(night + 0.5 - longitude / 360.0, format="jd",
+                        scale="utc")
+
+        # The positions are those of the rows of the loaded database.
+        self.load_elements()
+        cache_file = self.cache_file("night", self.database, *self.stamp,
+                                     night, observatory)
+
+        if cache_file is not None and path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return([cached["ra"], cached["dec"]])
+
+        ra, dec = self.predict(midnight.datetime, observatory)
+        ra, dec = ra.astype(np.float32), dec.astype(np.float32)
+
+        if cache_file is not None:
+            np.savez(cache_file + ".tmp.npz", ra=ra, dec=dec)
+            replace(cache_file + ".tmp.npz", cache_file)
+
+        return([ra, dec])
+
+    def find_objects(self, odate, ra, dec, radius=16, observatory="A84"):
+
+        """
+        Lists the known objects in a field, in the same layout as the
+        SkyBoT results (designation, name, RA(h), DE(deg), V).
+
+        @param odate: Observation date (UTC).
+        @type odate: date
+        @param ra: RA of field center, degrees
+        @type ra: float
+        @param dec: DEC of field center, degrees
+        @type dec: float
+        @param radius: Radius (arcmin).
+        @type radius: float
+        @param observatory: Observatory code.
+        @type observatory: str
+        @return: array
+        """
+
+        try:
+            el = self.load_elements()
+            centre = coordinates.SkyCoord(ra * u.deg, dec * u.deg)
+
+            night_ra, night_dec = self.night_positions(odate, observatory)
+            near = centre.separation(coordinates.SkyCoord(
+                night_ra * u.deg, night_dec * u.deg)).degree
+            idx = np.flatnonzero(near <= radius / 60.0 + self.margin)
+
+            obj_ra, obj_dec = self.predict(odate, observatory, idx)
+            objects = coordinates.SkyCoord(obj_ra * u.deg, obj_dec * u.deg)
+            inside = centre.separation(objects).arcminute <= radius
+            idx, objects = idx[inside], objects[inside]
+
+            rows = np.empty((len(idx), 5), dtype="U32")
+            rows[:, 0] = el["designation"][idx]
+            rows[:, 1] = el["name"][idx]
+            rows[:, 2] = objects.ra.to_string(u.hour, sep=" ", precision=2,
+                                              pad=True)
+            rows[:, 3] = objects.dec.to_string(u.deg, sep=" ", precision=1,
+                                               alwayssign=True, pad=True)
+            rows[:, 4] = np.char.mod("%.1f", self.magnitude(
+                idx, odate, observatory))
+
+            return(rows)
+
+        except Exception as e:
+            print(e)
+
+    def magnitude(self, idx, odate, observatory):
+
+        """
+        Apparent V magnitude of the orbits with the H, G system.
+        @return: array
+        """
+
+        el = self.load_elements()
+        t = Time(odate, scale="utc")
+        sun = get_body_barycentric("sun", t).xyz.to(u.au).value
+        observer = self.observer_position(t, observatory) - sun
+
+        helio = self.propagate(t.tdb.jd, idx)
+        rel = helio - observer[:, None]
+        r = np.sqrt(np.sum(helio * helio, axis=0))
+        delta = np.sqrt(np.sum(rel * rel, axis=0))
+        phase = np.arccos(np.clip(np.sum(helio * rel, axis=0) /
+                                  (r * delta), -1, 1))
+
+        tan_half = np.tan(phase / 2)
+        phi1 = np.exp(-3.33 * tan_half ** 0.63)
+        phi2 = np.exp(-1.87 * tan_half ** 1.22)
+        G = np.where(np.isnan(el["G"][idx]), 0.15, el["G"][idx])
+
+        return(el["H"][idx] + 5 * np.log10(r * delta) -
+               2.5 * np.log10((1 - G) * phi1 + G * phi2))
+
+    def find_frames(self, queries):
+
+        """
+        Same as AstCalc.find_skybot_frames, computed locally.
+
+        @param queries: (odate, ra, dec, radius, observatory) tuples,
+        one per frame.
+        @type queries: list
+        @return: list
+        """
+
+        results = []
+
+        for odate, ra, dec, radius, observatory in queries:
+            objects = self.find_objects(odate, ra, dec, radius=radius,
+                                        observatory=observatory)
+            if objects is None:
+                objects = np.empty((0, 5), dtype="U")
+            results.append(objects)
+
+        return(results)
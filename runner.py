@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Authors: Yücel Kılıç, Murat Kaplan, Nurdan Karapınar, Tolga Atay.
+# This is an open-source software licensed under GPLv3.
+
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+config = ConfigParser()
+
+if os.path.exists('./atrack.config'):
+    config.read('./atrack.config')
+else:
+    print('Python cannot open the configuration file. Make sure atrack.config',
+          'is in the same folder as atrack.py.')
+    raise SystemExit
+
+# Default timeout of an external tool (sec.) and number of tools run at once
+# (0 = number of CPUs).
+TIMEOUT = config.getfloat('runner', 'TIMEOUT', fallback=600)
+MAX_JOBS = config.getint('runner', 'MAX_JOBS', fallback=0)
+
+
+class Result(namedtuple('Result', ['args', 'returncode', 'stdout', 'stderr',
+                                   'timedout'])):
+
+    '''
+    Outcome of an external tool: its arguments, exit code, standard output,
+    standard error and whether it was killed by the timeout.
+    '''
+
+    @property
+    def ok(self):
+
+        '''
+        Tells if the tool ran to the end with a zero exit code.
+        @return: boolean
+        '''
+
+        return self.returncode == 0 and not self.timedout
+
+
+def run(args, timeout=TIMEOUT, cwd=None, stdout=None):
+
+    '''
+    Runs an external tool without a shell, and waits for it. The standard
+    error is captured, and so is the standard output unless a file is given.
+    Failures (missing tool, non-zero exit code, timeout) are reported and
+    returned, never raised.
+
+    @param args: The tool and its arguments.
+    @type args: list
+    @param timeout: Seconds after which the tool is killed (None: no limit).
+    @type timeout: float
+    @param cwd: Working directory of the tool.
+    @type cwd: string
+    @param stdout: File the standard output is written to.
+    @type stdout: string
+    @return: Result
+    '''
+
+    args = [str(arg) for arg in args]
+
+    try:
+        if stdout is None:
+            proc = subprocess.run(args, cwd=cwd, timeout=timeout,
+                                  stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+        else:
+            with open(stdout, 'w') as f:
+                proc = subprocess.run(args, cwd=cwd, timeout=timeout,
+                                      stdin=subprocess.DEVNULL, stdout=f,
+                                      stderr=subprocess.PIPE,
+                                      universal_newlines=True)
+        result = Result(args, proc.returncode, proc.stdout or '',
+                        proc.stderr, False)
+    except subprocess.TimeoutExpired as e:
+        result = Result(args, None, '', e.stderr or '', True)
+    except OSError as e:
+        result = Result(args, 127, '', str(e), False)
+
+    if result.timedout:
+        print('{0} was killed after {1} sec.'.format(args[0], timeout))
+    elif result.returncode != 0:
+        print('{0} failed with exit code {1}: {2}'.format(
+            args[0], result.returncode, result.stderr.strip()[-500:]))
+
+    return result
+
+
+def parallel(function, items, max_jobs=MAX_JOBS):
+
+    '''
+    Calls function on each item in a pool of threads, at most max_jobs at
+    once. Meant for functions that wait for external tools.
+
+    @param function: Function of one argument.
+    @type function: function
+    @param items: Arguments of the calls.
+    @type items: list
+    @param max_jobs: Maximum number of simultaneous calls (0: number of CPUs).
+    @type max_jobs: integer
+    @return: list
+    '''
+
+    items = list(items)
+    if not items:
+        return []
+
+    max_jobs = min(max_jobs or cpu_count(), len(items))
+
+    with ThreadPoolExecutor(max_jobs) as executor:
+        return list(executor.map(function, items))
+
+
+@contextmanager
+def workdir(prefix='atrack'):
+
+    '''
+    A temporary working directory for one tool invocation, removed with all
+    its files afterwards.
+
+    @param prefix: Prefix of the directory name.
+    @type prefix: string
+    '''
+
+    tmpdir = tempfile.mkdtemp(prefix=prefix)
+    try:
+        yield tmpdir
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def solve_field(image_path, ra, dec, outfile, tweak_order=2, downsample=4,
+                radius=0.2, timeout=TIMEOUT):
+
+    '''
+    Runs astrometry.net's solve-field on a FITS image in its own working
+    directory, and moves the solved image to outfile.
+
+    @param image_path: FITS image file name with path
+    @type image_path: str
+    @param ra: RA of field center for search, format: degrees or hh:mm:ss
+    @type ra: str
+    @param dec: DEC of field center for search, format: degrees or hh:mm:ss
+    @type dec: str
+    @param outfile: Output FITS file with the WCS (may be image_path).
+    @type outfile: str
+    @param tweak_order: Polynomial order of SIP WCS corrections
+    @type tweak_order: integer
+    @param downsample: Downsample the image by factor int before
+    running source extraction
+    @type downsample: integer
+    @param radius: Only search in indexes within 'radius' of the
+    field center given by --ra and --dec
+    @type radius: float
+    @param timeout: Seconds after which solve-field is killed.
+    @type timeout: float
+    @return: boolean
+    '''
+
+    with workdir('solve') as tmpdir:
+        solved = os.path.join(tmpdir, 'solved.fits')
+        result = run(['solve-field', '--no-plots', '--no-verify',
+                      '--tweak-order', tweak_order,
+                      '--downsample', downsample, '--overwrite',
+                      '--radius', radius, '--no-tweak',
+                      '--ra', ra, '--dec', dec,
+                      '--dir', tmpdir, '--new-fits', solved,
+                      os.path.abspath(image_path)],
+                     timeout=timeout)
+
+        if not result.ok or not os.path.exists(solved):
+            return False
+
+        shutil.move(solved, outfile)
+
+    return True
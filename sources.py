@@ -16,12 +16,21 @@ except ImportError:
     print('Python cannot import alipy. Make sure alipy is installed.')
     raise SystemExit
 
+try:
+    import sep
+except ImportError:
+    # sep is only needed by the tiled extraction (EXTRACT_TILE).
+    sep = None
+
 import glob
 import os
+import re
 from configparser import ConfigParser
+from multiprocessing import cpu_count
 from astropy.io import fits
+from astropy.wcs import WCS
 
-from astrolib import astronomy
+import runner
 
 config = ConfigParser()
 
@@ -33,9 +42,32 @@ else:
     raise SystemExit
 
 
-def align(fitsdir, reference, outdir):
+def remap(cmd):
+    '''
+    Remaps one image onto the reference frame. The output tiles are
+    interpolated in a thread pool.
+
+    @param cmd: FITS file, SimpleTransform, output shape, output directory
+    and number of threads.
+    @type cmd: tuple
+    '''
+
+    filepath, trans, outshape, outdir, nthreads = cmd
+    alipy.align.tiledaffineremap(filepath, trans, shape=outshape,
+                                 outdir=outdir, makepng=False,
+                                 nthreads=nthreads, verbose=False)
+
+
+def align(fitsdir, reference, outdir,
+          mode=config.get('sources', 'ALIGN_MODE', fallback='pixel')):
     '''
-    Aligns the given FITS images using alipy.
+    Aligns the given FITS images using alipy. Identification and remapping
+    of the images run on all CPUs.
+
+    In 'pixel' mode the images are remapped onto the reference frame and
+    saved as *affineremap.fits. In 'catalog' mode no image is written: the
+    transforms are saved in 'transforms.txt' of the output directory, to be
+    applied to the catalog files by align_catalogs.
 
     @param fitsdir: Directory for the FITS images to be aligned.
     @type fitsdir: string
@@ -43,6 +75,8 @@ def align(fitsdir, reference, outdir):
     @type reference: string
     @param outdir: Output directory for the aligned images.
     @type outdir: string
+    @param mode: Alignment mode, 'pixel' or 'catalog'.
+    @type mode: string
     '''
 
     types = (fitsdir + '/*.fits', fitsdir + '/*.fit',
@@ -56,29 +90,358 @@ def align(fitsdir, reference, outdir):
     if not reference:
         reference = images[0]
 
+    nCPU = cpu_count()
+
+    # The reference star list and quads are cached across runs.
+    cachedir = config.get('sources', 'ALIGN_CACHE', fallback='').strip()
+
     identifications = alipy.ident.run(reference, images, visu=False,
-                                      sexkeepcat=False, verbose=False)
+                                      sexkeepcat=False, verbose=False,
+                                      ncpu=nCPU,
+                                      cachedir=cachedir or None)
+
+    wcs_mode = config.get('sources', 'WCS_MODE', fallback='solve')
+    propagate = (config.get('sources', 'solve_field') == "True" and
+                 wcs_mode.strip().lower() == 'propagate')
+
+    if mode.strip().lower() == 'catalog':
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        write_transforms('{0}/transforms.txt'.format(outdir),
+                         identifications)
+        if propagate:
+            astrometry(reference, identifications, outdir, mode='catalog')
+        return
 
     outshape = alipy.align.shape(reference, verbose=False)
 
+    # One image at a time, each on all CPUs: only one image is in memory.
     for idn in identifications:
-
         if idn.ok:
-            alipy.align.affineremap(idn.ukn.filepath, idn.trans,
-                                    shape=outshape, outdir=outdir,
-                                    makepng=False, verbose=False)
+            remap((idn.ukn.filepath, idn.trans, outshape, outdir, nCPU))
 
-    if config.get('sources', 'solve_field') == "True":
+    if propagate:
+        astrometry(reference, identifications, outdir, mode='pixel')
+    elif config.get('sources', 'solve_field') == "True":
         wcs_images = sorted(glob.glob(outdir + "/*affineremap.fits"))
 
-        for fits_image in wcs_images:
-            # check wCS info
-            ac = astronomy.AstCalc()
-            print(">>> solve_field is working for {0}".format(fits_image))
-            ac.solve_field(fits_image, radius=2,
-                           ra_keyword=config.get('mpcreport', 'RA'),
-                           dec_keyword=config.get('mpcreport', 'DEC'),
-                           overwrite=True)
+        print(">>> solve_field is working for {0} images".format(
+            len(wcs_images)))
+        solve_fields(wcs_images, radius=2,
+                     ra_keyword=config.get('mpcreport', 'RA'),
+                     dec_keyword=config.get('mpcreport', 'DEC'),
+                     overwrite=True)
+
+
+def astrometry(reference, identifications, outdir, mode='pixel',
+               max_residual=config.getfloat('sources', 'WCS_MAX_RESIDUAL',
+                                            fallback=1.0)):
+    '''
+    Solves the WCS of the reference image once, and gives it to the other
+    frames through their alipy transforms: each frame gets the reference WCS
+    composed with its transform (see propagate_wcs), written to
+    <outdir>/<name>.wcs, and in 'pixel' mode the aligned images, which are
+    on the reference grid, get the reference WCS as it is.
+    A frame whose matched stars are more than max_residual arcsec (RMS) off
+    with the propagated WCS is solved on its own with solve-field instead.
+
+    @param reference: Reference FITS image.
+    @type reference: string
+    @param identifications: Identifications returned by alipy.ident.run.
+    @type identifications: list
+    @param outdir: Output directory of align.
+    @type outdir: string
+    @param mode: Alignment mode, 'pixel' or 'catalog'.
+    @type mode: string
+    @param max_residual: Maximum RMS residual of the matched stars (arcsec).
+    @type max_residual: float
+    @return: dict of boolean (WCS written), by FITS file
+    '''
+
+    print(">>> solve_field is working for {0}".format(reference))
+    refheader = solved_header(reference)
+    if refheader is None:
+        print(reference + ' cannot be solved!')
+        return {}
+
+    wcs_ref = WCS(refheader)
+    written = {}
+
+    for idn in identifications:
+        if not idn.ok:
+            continue
+
+        name = os.path.splitext(os.path.basename(idn.ukn.filepath))[0]
+        wcsfile = '{0}/{1}.wcs'.format(outdir, name)
+        aligned = '{0}/{1}_affineremap.fits'.format(outdir, name)
+
+        wcs = propagate_wcs(wcs_ref, idn.trans)
+        header = fits.getheader(idn.ukn.filepath)
+        wcs.pixel_shape = (header['NAXIS1'], header['NAXIS2'])
+        residual = wcs_residual(wcs_ref, wcs,
+                                alipy.star.listtoarray(idn.uknmatchstars),
+                                alipy.star.listtoarray(idn.refmatchstars))
+
+        if residual <= max_residual:
+            write_wcs(wcsfile, wcs, create=True)
+            if mode == 'pixel':
+                write_wcs(aligned, wcs_ref)
+            written[idn.ukn.filepath] = True
+            continue
+
+        # The aligned image is solved in pixel mode, the frame otherwise.
+        solve_path = aligned if mode == 'pixel' else idn.ukn.filepath
+        print("{0}: propagated WCS is {1:.2f} arcsec off, solving {2}".format(
+            name, residual, solve_path))
+
+        header = solved_header(solve_path)
+        if header is None:
+            print(solve_path + ' cannot be solved!')
+            written[idn.ukn.filepath] = False
+            continue
+
+        write_wcs(solve_path if mode == 'pixel' else wcsfile, WCS(header),
+                  create=(mode != 'pixel'))
+        written[idn.ukn.filepath] = True
+
+    return written
+
+
+def solved_header(image_path,
+                  radius=2,
+                  ra_keyword=config.get('mpcreport', 'RA', fallback='RA'),
+                  dec_keyword=config.get('mpcreport', 'DEC',
+                                         fallback='DEC')):
+    '''
+    Solves an image with solve-field, leaving the image as it is.
+
+    @param image_path: FITS image file name with path
+    @type image_path: str
+    @param radius: Search radius around the header coordinates (deg).
+    @type radius: float
+    @param ra_keyword: RA keyword in the FITS image header
+    @type ra_keyword: str
+    @param dec_keyword: DEC keyword in the FITS image header
+    @type dec_keyword: str
+    @return: astropy.io.fits.Header of the solved image, or None
+    '''
+
+    ra = str(get_header(image_path, ra_keyword)).strip().replace(" ", ":")
+    dec = str(get_header(image_path, dec_keyword)).strip().replace(" ", ":")
+
+    with runner.workdir('wcs') as tmpdir:
+        solved = os.path.join(tmpdir, 'solved.fits')
+        if not runner.solve_field(image_path, ra, dec, solved,
+                                  radius=radius):
+            return None
+        return fits.getheader(solved)
+
+
+def propagate_wcs(wcs_ref, trans):
+    '''
+    WCS of a frame, from the WCS of the reference and the
+    alipy.star.SimpleTransform T that brings the frame onto the reference:
+    CRPIX = T^-1(CRPIX_ref) and CD = CD_ref . M, M being the linear part of
+    T. The distortion (SIP) terms of the reference are dropped, so that the
+    result is an approximation.
+
+    @param wcs_ref: WCS of the reference.
+    @type wcs_ref: astropy.wcs.WCS
+    @param trans: Transform of the frame onto the reference.
+    @type trans: alipy.star.SimpleTransform
+    @return: astropy.wcs.WCS
+    '''
+
+    matrix, offset = trans.matrixform()
+    crpix = trans.inverse().apply(wcs_ref.wcs.crpix)
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = [ctype.replace('-SIP', '') for ctype in wcs_ref.wcs.ctype]
+    wcs.wcs.cunit = wcs_ref.wcs.cunit
+    wcs.wcs.crval = wcs_ref.wcs.crval
+    wcs.wcs.crpix = crpix
+    wcs.wcs.cd = np.dot(wcs_ref.pixel_scale_matrix, matrix)
+    wcs.wcs.radesys = wcs_ref.wcs.radesys
+    wcs.wcs.equinox = wcs_ref.wcs.equinox
+    wcs.wcs.lonpole = wcs_ref.wcs.lonpole
+    wcs.wcs.latpole = wcs_ref.wcs.latpole
+
+    return wcs
+
+
+def wcs_residual(wcs_ref, wcs, framexy, refxy):
+    '''
+    RMS distance on the sky between matched stars: the frame positions
+    through the frame WCS, and the reference positions through the
+    reference WCS.
+
+    @param wcs_ref: WCS of the reference.
+    @type wcs_ref: astropy.wcs.WCS
+    @param wcs: WCS of the frame.
+    @type wcs: astropy.wcs.WCS
+    @param framexy: Positions of the stars in the frame (SExtractor pixels).
+    @type framexy: numpy.ndarray
+    @param refxy: Positions of the same stars in the reference.
+    @type refxy: numpy.ndarray
+    @return: float (arcsec, infinite without stars)
+    '''
+
+    if len(framexy) == 0:
+        return np.inf
+
+    ra, dec = np.radians(wcs.all_pix2world(framexy[:, 0], framexy[:, 1], 1))
+    ra0, dec0 = np.radians(wcs_ref.all_pix2world(refxy[:, 0], refxy[:, 1],
+                                                 1))
+
+    # Haversine separations
+    sep = 2 * np.arcsin(np.sqrt(
+        np.sin((dec - dec0) / 2) ** 2 +
+        np.cos(dec) * np.cos(dec0) * np.sin((ra - ra0) / 2) ** 2))
+
+    return float(np.degrees(np.sqrt(np.mean(sep ** 2))) * 3600)
+
+
+def write_wcs(fitsfile, wcs, create=False):
+    '''
+    Replaces the WCS keywords of a FITS header. With create, a header-only
+    FITS file is written instead (like the .wcs files of astrometry.net),
+    with the size of the frame as IMAGEW and IMAGEH if the WCS has it.
+
+    @param fitsfile: FITS file.
+    @type fitsfile: string
+    @param wcs: The new WCS.
+    @type wcs: astropy.wcs.WCS
+    @param create: Write a new header-only file.
+    @type create: boolean
+    '''
+
+    wcsheader = wcs.to_header(relax=True)
+
+    if create:
+        if wcs.pixel_shape is not None:
+            wcsheader['IMAGEW'] = (wcs.pixel_shape[0], 'Image width')
+            wcsheader['IMAGEH'] = (wcs.pixel_shape[1], 'Image height')
+        fits.PrimaryHDU(header=wcsheader).writeto(fitsfile, overwrite=True)
+        return
+
+    with fits.open(fitsfile, mode='update') as hdu:
+        header = hdu[0].header
+        oldkeys = WCS(header).to_header(relax=True)
+        for key in list(oldkeys.keys()) + ['CD1_1', 'CD1_2', 'CD2_1',
+                                           'CD2_2']:
+            header.remove(key, ignore_missing=True, remove_all=True)
+        header.update(wcsheader)
+
+
+def write_transforms(transfile, identifications):
+    '''
+    Writes the transforms of the identified images onto the reference frame,
+    one line per image: file name and the (a, b, c, d) of the
+    alipy.star.SimpleTransform.
+
+    @param transfile: Output file.
+    @type transfile: string
+    @param identifications: Identifications returned by alipy.ident.run.
+    @type identifications: list
+    '''
+
+    with open(transfile, 'w') as f:
+        f.write('# file a b c d\n')
+        for idn in identifications:
+            if idn.ok:
+                f.write('{0} {1!r} {2!r} {3!r} {4!r}\n'.format(
+                    os.path.basename(idn.ukn.filepath),
+                    *[float(v) for v in idn.trans.v]))
+
+
+def read_transforms(transfile):
+    '''
+    Reads a file written by write_transforms.
+
+    @param transfile: Transform file.
+    @type transfile: string
+    @return: dict of alipy.star.SimpleTransform, by image file name
+    '''
+
+    transforms = {}
+    with open(transfile) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            name, a, b, c, d = line.split()
+            transforms[name] = alipy.star.SimpleTransform(
+                (float(a), float(b), float(c), float(d)))
+
+    return transforms
+
+
+def transform_catalog(catfile, trans):
+    '''
+    Applies a transform to the X_IMAGE and Y_IMAGE columns of a SExtractor
+    catalog file, in place. The catalog is marked as aligned, so that it is
+    never transformed twice.
+
+    @param catfile: SExtractor catalog file (ASCII_HEAD).
+    @type catfile: string
+    @param trans: Transform onto the reference frame.
+    @type trans: alipy.star.SimpleTransform
+    @return: boolean
+    '''
+
+    with open(catfile) as f:
+        lines = f.readlines()
+
+    header = [line for line in lines if line.startswith('#')]
+    if any(line.startswith('# ALIGNED') for line in header):
+        return False
+
+    columns = {}
+    for line in header:
+        fields = line[1:].split()
+        if len(fields) > 1 and fields[0].isdigit():
+            columns[fields[1]] = int(fields[0]) - 1
+
+    catalog = np.genfromtxt(catfile, delimiter=None, comments='#',
+                            ndmin=2)
+
+    if catalog.size:
+        x, y = columns['X_IMAGE'], columns['Y_IMAGE']
+        catalog[:, x], catalog[:, y] = trans.apply((catalog[:, x],
+                                                    catalog[:, y]))
+
+    with open(catfile, 'w') as f:
+        f.writelines(header)
+        f.write('# ALIGNED {0!r} {1!r} {2!r} {3!r}\n'.format(
+            *[float(v) for v in trans.v]))
+        np.savetxt(f, catalog, fmt='%.10g', delimiter=' ')
+
+    return True
+
+
+def align_catalogs(catdir, transfile=None):
+    '''
+    Catalog-space alignment: moves the x, y columns of the catalog files onto
+    the reference frame, with the transforms saved by align in 'catalog'
+    mode. R.A. and Decl. are left as they are.
+
+    @param catdir: Directory which contains the catalog files.
+    @type catdir: string
+    @param transfile: Transform file (default: catdir/transforms.txt).
+    @type transfile: string
+    @return: int
+    '''
+
+    if transfile is None:
+        transfile = '{0}/transforms.txt'.format(catdir)
+
+    aligned = 0
+    for name, trans in read_transforms(transfile).items():
+        catfile = '{0}/{1}.pysexcat'.format(catdir,
+                                            os.path.splitext(name)[0])
+        if os.path.exists(catfile) and transform_catalog(catfile, trans):
+            aligned += 1
+
+    return aligned
 
 
 def make_catalog(fitsdir, outdir,
@@ -98,9 +461,14 @@ def make_catalog(fitsdir, outdir,
                  GAIN=float(config.get('sources', 'GAIN')),
                  rerun=config.get('sources', 'rerun'),
                  keepcat=config.get('sources', 'keepcat'),
-                 verbose=config.get('sources', 'verbose')):
+                 verbose=config.get('sources', 'verbose'),
+                 EXTRACT_TILE=config.getint('sources', 'EXTRACT_TILE',
+                                            fallback=0),
+                 EXTRACT_OVERLAP=config.getint('sources', 'EXTRACT_OVERLAP',
+                                               fallback=64)):
     '''
-    Creates SExtractor catalogs from FITS files.
+    Creates SExtractor catalogs from FITS files. With EXTRACT_TILE, the
+    catalogs are extracted with sep instead, in tiles (see tiled_catalog).
 
     @param fitsdir: Directory for the FITS files to be used.
     @type fitsdir: string
@@ -148,30 +516,300 @@ def make_catalog(fitsdir, outdir,
     @type keepcat: boolean
     @param verbose: Notifies the user via terminal.
     @type verbose: boolean
+    @param EXTRACT_TILE: Tile size of the sep extraction (pixel), 0 for
+    SExtractor on whole frames.
+    @type EXTRACT_TILE: integer
+    @param EXTRACT_OVERLAP: Margin around the tiles (pixel). Objects larger
+    than the margin may be cut at the tile borders.
+    @type EXTRACT_OVERLAP: integer
     '''
 
     fitsfiles = sorted(glob.glob(fitsdir + '/*.fits'))
 
-    for fitsfile in fitsfiles:
-
-        pysex.run(fitsfile,
-                  conf_args={'DETECT_THRESH': DETECT_THRESH,
-                             'ANALYSIS_THRESH': ANALYSIS_THRESH,
-                             'DETECT_MINAREA': DETECT_MINAREA,
-                             'SATUR_LEVEL': SATUR_LEVEL,
-                             'GAIN': GAIN,
-                             'DEBLEND_NTHRESH': DEBLEND_NTHRESH,
-                             'DEBLEND_MINCONT': DEBLEND_MINCONT,
-                             'PIXEL_SCALE': PIXEL_SCALE,
-                             'SEEING_FWHM': SEEING_FWHM,
-                             'PHOT_AUTOPARAMS': PHOT_AUTOPARAMS,
-                             'BACK_SIZE': BACK_SIZE,
-                             'BACK_FILTERSIZE': BACK_FILTERSIZE,
-                             'FILTER': 'Y',
-                             'VERBOSE_TYPE': 'QUIET'},
-                  params=['FLAGS', 'X_IMAGE', 'Y_IMAGE', 'ALPHA_J2000', 'DELTA_J2000', 'FLUX_AUTO', 'FLUXERR_AUTO',
-                          'BACKGROUND', 'MAG_AUTO', 'MAGERR_AUTO', 'FWHM_IMAGE', 'ELONGATION'],
-                  rerun=rerun, keepcat=keepcat, catdir=outdir)
+    if EXTRACT_TILE > 0:
+        if sep is None:
+            print('Python cannot import sep. Make sure sep is installed, or',
+                  'set EXTRACT_TILE to 0.')
+            raise SystemExit
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        for fitsfile in fitsfiles:
+            catfile = '{0}/{1}.pysexcat'.format(
+                outdir, os.path.splitext(os.path.basename(fitsfile))[0])
+            if str(rerun) != "True" and os.path.exists(catfile):
+                continue
+            tiled_catalog(fitsfile, catfile, tilesize=EXTRACT_TILE,
+                          overlap=EXTRACT_OVERLAP,
+                          DETECT_THRESH=DETECT_THRESH,
+                          DETECT_MINAREA=DETECT_MINAREA,
+                          PHOT_AUTOPARAMS=PHOT_AUTOPARAMS,
+                          BACK_SIZE=BACK_SIZE,
+                          BACK_FILTERSIZE=BACK_FILTERSIZE,
+                          DEBLEND_NTHRESH=DEBLEND_NTHRESH,
+                          SATUR_LEVEL=SATUR_LEVEL,
+                          DEBLEND_MINCONT=DEBLEND_MINCONT,
+                          GAIN=GAIN)
+        return
+
+    conf_args = {'DETECT_THRESH': DETECT_THRESH,
+                 'ANALYSIS_THRESH': ANALYSIS_THRESH,
+                 'DETECT_MINAREA': DETECT_MINAREA,
+                 'SATUR_LEVEL': SATUR_LEVEL,
+                 'GAIN': GAIN,
+                 'DEBLEND_NTHRESH': DEBLEND_NTHRESH,
+                 'DEBLEND_MINCONT': DEBLEND_MINCONT,
+                 'PIXEL_SCALE': PIXEL_SCALE,
+                 'SEEING_FWHM': SEEING_FWHM,
+                 'PHOT_AUTOPARAMS': PHOT_AUTOPARAMS,
+                 'BACK_SIZE': BACK_SIZE,
+                 'BACK_FILTERSIZE': BACK_FILTERSIZE,
+                 'FILTER': 'Y',
+                 'VERBOSE_TYPE': 'QUIET'}
+    params = ['FLAGS', 'X_IMAGE', 'Y_IMAGE', 'ALPHA_J2000', 'DELTA_J2000',
+              'FLUX_AUTO', 'FLUXERR_AUTO', 'BACKGROUND', 'MAG_AUTO',
+              'MAGERR_AUTO', 'FWHM_IMAGE', 'ELONGATION']
+
+    # SExtractor runs on several frames at once, each in its own directory.
+    runner.parallel(lambda fitsfile: pysex.run(fitsfile, conf_args=conf_args,
+                                               params=params, rerun=rerun,
+                                               keepcat=keepcat,
+                                               catdir=outdir,
+                                               timeout=runner.TIMEOUT),
+                    fitsfiles)
+
+
+# Columns of the catalogs, as asked to SExtractor by make_catalog.
+CATALOG_COLUMNS = [('FLAGS', 'Extraction flags', '', '%3d'),
+                   ('X_IMAGE', 'Object position along x', 'pixel', '%10.3f'),
+                   ('Y_IMAGE', 'Object position along y', 'pixel', '%10.3f'),
+                   ('ALPHA_J2000', 'Right ascension of barycenter (J2000)',
+                    'deg', '%11.7f'),
+                   ('DELTA_J2000', 'Declination of barycenter (J2000)',
+                    'deg', '%+11.7f'),
+                   ('FLUX_AUTO', 'Flux within a Kron-like elliptical aperture',
+                    'count', '%12.7g'),
+                   ('FLUXERR_AUTO', 'RMS error for AUTO flux', 'count',
+                    '%12.7g'),
+                   ('BACKGROUND', 'Background at centroid position', 'count',
+                    '%12.7g'),
+                   ('MAG_AUTO', 'Kron-like elliptical aperture magnitude',
+                    'mag', '%8.4f'),
+                   ('MAGERR_AUTO', 'RMS error for AUTO magnitude', 'mag',
+                    '%8.4f'),
+                   ('FWHM_IMAGE', 'FWHM assuming a gaussian core', 'pixel',
+                    '%8.2f'),
+                   ('ELONGATION', 'A_IMAGE/B_IMAGE', '', '%8.3f')]
+
+
+def tiles(shape, tilesize, overlap):
+    '''
+    Splits an image into tiles. Each tile has a core, the tiles' cores
+    cover the image without overlapping, and is extracted with a margin of
+    overlap pixels around its core.
+
+    @param shape: Shape of the image (ny, nx).
+    @type shape: tuple
+    @param tilesize: Size of the cores (pixel).
+    @type tilesize: integer
+    @param overlap: Margin around the cores (pixel).
+    @type overlap: integer
+    @return: list of (core, tile), each a tuple (y0, y1, x0, x1)
+    '''
+
+    ny, nx = shape
+    result = []
+    for y0 in range(0, ny, tilesize):
+        for x0 in range(0, nx, tilesize):
+            y1 = min(y0 + tilesize, ny)
+            x1 = min(x0 + tilesize, nx)
+            result.append(((y0, y1, x0, x1),
+                           (max(y0 - overlap, 0), min(y1 + overlap, ny),
+                            max(x0 - overlap, 0), min(x1 + overlap, nx))))
+    return result
+
+
+def extract_tile(sub, rms, back, core, tile,
+                 DETECT_THRESH=3, DETECT_MINAREA=5, PHOT_AUTOPARAMS=(2.5, 3.5),
+                 DEBLEND_NTHRESH=32, DEBLEND_MINCONT=0.005, SATUR_LEVEL=None,
+                 GAIN=None):
+    '''
+    Extracts the objects of one tile with sep, and measures them like
+    SExtractor does for the CATALOG_COLUMNS. Only the objects whose centroid
+    is in the core of the tile are kept, so that the tiles of an image give
+    each object once. The apertures are measured on the whole image, so they
+    are not cut at the tile borders.
+
+    @param sub: The background subtracted image.
+    @type sub: numpy.ndarray
+    @param rms: Background RMS of the image.
+    @type rms: numpy.ndarray
+    @param back: Background of the image.
+    @type back: numpy.ndarray
+    @param core: Core of the tile (y0, y1, x0, x1).
+    @type core: tuple
+    @param tile: The tile with its margin (y0, y1, x0, x1).
+    @type tile: tuple
+    @return: numpy.ndarray, one row by object (CATALOG_COLUMNS without the
+    sky coordinates, which are zero)
+    '''
+
+    y0, y1, x0, x1 = tile
+    objects = sep.extract(np.ascontiguousarray(sub[y0:y1, x0:x1]),
+                          DETECT_THRESH,
+                          err=np.ascontiguousarray(rms[y0:y1, x0:x1]),
+                          minarea=DETECT_MINAREA,
+                          deblend_nthresh=DEBLEND_NTHRESH,
+                          deblend_cont=DEBLEND_MINCONT)
+
+    # Pixel i of the core covers the positions [i - 0.5, i + 0.5).
+    cy0, cy1, cx0, cx1 = core
+    x = objects['x'] + x0
+    y = objects['y'] + y0
+    incore = ((x >= cx0 - 0.5) & (x < cx1 - 0.5) &
+              (y >= cy0 - 0.5) & (y < cy1 - 0.5))
+    objects, x, y = objects[incore], x[incore], y[incore]
+
+    catalog = np.zeros((len(objects), len(CATALOG_COLUMNS)))
+    if len(objects) == 0:
+        return catalog
+
+    a, b = objects['a'], objects['b']
+    # float32 theta may be just outside of the [-pi/2, pi/2] of sep's
+    # apertures.
+    theta = np.clip(objects['theta'].astype(float), -np.pi / 2, np.pi / 2)
+    kron_fact, min_radius = PHOT_AUTOPARAMS
+
+    # Like SExtractor, the Kron radius is at least min_radius (in a, b).
+    kronrad, kronflag = sep.kron_radius(sub, x, y, a, b, theta, 6.0)
+    flux, fluxerr, flag = sep.sum_ellipse(sub, x, y, a, b, theta,
+                                          np.maximum(kron_fact * kronrad,
+                                                     min_radius),
+                                          err=rms, gain=GAIN, subpix=1)
+    flag |= kronflag
+
+    radius, _ = sep.flux_radius(sub, x, y, 6.0 * a, 0.5, normflux=flux,
+                                subpix=5)
+
+    flags = np.zeros(len(objects), dtype=int)
+    flags[(objects['flag'] & sep.OBJ_MERGED) != 0] |= 2
+    flags[(objects['flag'] & sep.OBJ_TRUNC) != 0] |= 8
+    flags[(flag & (sep.APER_TRUNC | sep.APER_HASMASKED)) != 0] |= 16
+    if SATUR_LEVEL is not None:
+        ypeak = objects['ypeak'] + y0
+        xpeak = objects['xpeak'] + x0
+        peak = sub[ypeak, xpeak] + back[ypeak, xpeak]
+        flags[peak >= SATUR_LEVEL] |= 4
+
+    positive = flux > 0
+    mag = np.full(len(objects), 99.0)
+    magerr = np.full(len(objects), 99.0)
+    mag[positive] = -2.5 * np.log10(flux[positive])
+    magerr[positive] = 1.0857 * fluxerr[positive] / flux[positive]
+
+    # SExtractor positions are 1-based.
+    catalog[:, 0] = flags
+    catalog[:, 1] = x + 1
+    catalog[:, 2] = y + 1
+    catalog[:, 5] = flux
+    catalog[:, 6] = fluxerr
+    catalog[:, 7] = back[objects['ycpeak'] + y0, objects['xcpeak'] + x0]
+    catalog[:, 8] = mag
+    catalog[:, 9] = magerr
+    catalog[:, 10] = 2 * radius
+    catalog[:, 11] = a / b
+
+    return catalog
+
+
+def tiled_catalog(fitsfile, catfile, tilesize=2048, overlap=64,
+                  DETECT_THRESH=3, DETECT_MINAREA=5,
+                  PHOT_AUTOPARAMS='2.5, 3.5', BACK_SIZE=64, BACK_FILTERSIZE=3,
+                  DEBLEND_NTHRESH=32, SATUR_LEVEL=None, DEBLEND_MINCONT=0.005,
+                  GAIN=None, max_jobs=runner.MAX_JOBS):
+    '''
+    Creates the catalog of a FITS image with sep, the tiles of the image
+    being extracted in parallel. The background is modelled once, on the
+    whole image, so the tiles see the same background as a whole-frame
+    extraction, and each object is kept by the tile whose core contains its
+    centroid. The catalog has the columns and format of make_catalog's
+    SExtractor catalogs.
+
+    @param fitsfile: FITS image.
+    @type fitsfile: string
+    @param catfile: Output catalog file.
+    @type catfile: string
+    @param tilesize: Size of the tiles (pixel).
+    @type tilesize: integer
+    @param overlap: Margin around the tiles (pixel).
+    @type overlap: integer
+    @param max_jobs: Maximum number of tiles extracted at once.
+    @type max_jobs: integer
+    @return: numpy.ndarray, the catalog
+    '''
+
+    data = fits.getdata(fitsfile).astype(np.float32)
+
+    bkg = sep.Background(data, bw=BACK_SIZE, bh=BACK_SIZE,
+                         fw=BACK_FILTERSIZE, fh=BACK_FILTERSIZE,
+                         nthreads=max_jobs or cpu_count())
+    back = bkg.back()
+    rms = bkg.rms()
+    # The background is subtracted in place, data is not needed anymore.
+    sub = data
+    bkg.subfrom(sub)
+
+    autoparams = [float(value) for value in
+                  re.findall(r'[-+]?\d*\.?\d+', str(PHOT_AUTOPARAMS))]
+
+    catalogs = runner.parallel(
+        lambda tile: extract_tile(sub, rms, back, *tile,
+                                  DETECT_THRESH=DETECT_THRESH,
+                                  DETECT_MINAREA=int(DETECT_MINAREA),
+                                  PHOT_AUTOPARAMS=autoparams[:2],
+                                  DEBLEND_NTHRESH=DEBLEND_NTHRESH,
+                                  DEBLEND_MINCONT=DEBLEND_MINCONT,
+                                  SATUR_LEVEL=SATUR_LEVEL,
+                                  GAIN=GAIN),
+        tiles(data.shape, tilesize, overlap), max_jobs=max_jobs)
+
+    catalog = np.vstack(catalogs)
+    catalog = catalog[np.lexsort((catalog[:, 1], catalog[:, 2]))]
+
+    header = fits.getheader(fitsfile)
+    try:
+        wcs = WCS(header)
+    except Exception as e:
+        print(e)
+        wcs = None
+    if wcs is not None and wcs.has_celestial and len(catalog):
+        catalog[:, 3], catalog[:, 4] = wcs.celestial.all_pix2world(
+            catalog[:, 1], catalog[:, 2], 1)
+
+    write_catalog(catfile, catalog)
+
+    return catalog
+
+
+def write_catalog(catfile, catalog):
+    '''
+    Writes a catalog in SExtractor's ASCII_HEAD format, with the
+    CATALOG_COLUMNS.
+
+    @param catfile: Output catalog file.
+    @type catfile: string
+    @param catalog: One row by object.
+    @type catalog: numpy.ndarray
+    '''
+
+    header = '\n'.join('{0:>4d} {1:<22s} {2:<58s} [{3}]'.format(
+        i + 1, name, description, unit) if unit else
+        '{0:>4d} {1:<22s} {2}'.format(i + 1, name, description)
+        for i, (name, description, unit, _) in
+        enumerate(CATALOG_COLUMNS))
+
+    np.savetxt(catfile, catalog.reshape(-1, len(CATALOG_COLUMNS)),
+               fmt=[fmt for (_, _, _, fmt) in CATALOG_COLUMNS],
+               header=header, comments='#', delimiter=' ')
 
 
 def make_master(catdir):
@@ -218,7 +856,9 @@ def solve_field(image_path,
                 ra=None,
                 dec=None,
                 ra_keyword="objctra",
-                dec_keyword="objctdec"):
+                dec_keyword="objctdec",
+                overwrite=False,
+                timeout=runner.TIMEOUT):
     """
     The astrometry engine will take any image and return
     the astrometry world coordinate system (WCS).
@@ -241,51 +881,57 @@ def solve_field(image_path,
     @type ra_keyword: str
     @param dec_keyword: DEC keyword in the FITS image header
     @type dec_keyword: str
+    @param overwrite: Replace the image with the solved one, instead of
+    writing <root>_new.fits.
+    @type overwrite: boolean
+    @param timeout: Seconds after which solve-field is killed.
+    @type timeout: float
     @return: boolean
     """
 
     try:
         if ra is None and dec is None:
-            ra = get_header(ra_keyword)
-            dec = get_header(dec_keyword)
-            ra = ra.strip()
-            dec = dec.strip()
-            ra = ra.replace(" ", ":")
-            dec = dec.replace(" ", ":")
-        else:
-            ra = ra.strip()
-            dec = dec.strip()
-            ra = ra.replace(" ", ":")
-            dec = dec.replace(" ", ":")
-#######################################################################2022.9.15
-        os.system(("solve-field --no-plots -N none "
-                   "--no-verify --tweak-order {0} "
-                   "--downsample {1} --overwrite --radius {2} --no-tweak "
-                   "--ra {3} --dec {4} {5}").format(str(tweak_order),
-                                                    str(downsample),
-                                                    str(radius),
-                                                    str(ra),
-                                                    str(dec),
-                                                    str(image_path)))
-        # Cleaning
+            ra = get_header(image_path, ra_keyword)
+            dec = get_header(image_path, dec_keyword)
+        ra = str(ra).strip().replace(" ", ":")
+        dec = str(dec).strip().replace(" ", ":")
+
         if ".gz" in image_path:
             root = '.'.join(image_path.split('.')[:-2])
         else:
             root, extension = path.splitext(image_path)
 
-        os.system(("rm -rf {0}-indx.png {0}-indx.xyls "
-                   "{0}-ngc.png {0}-objs.png "
-                   "{0}.axy {0}.corr "
-                   "{0}.match {0}.rdls "
-                   "{0}.solved {0}.wcs").format(root))
+        if overwrite:
+            outfile = image_path
+        else:
+            outfile = "{0}_new.fits".format(root)
 
-        if not path.exists(root + '.new'):
+        if not runner.solve_field(image_path, ra, dec, outfile,
+                                  tweak_order=tweak_order,
+                                  downsample=downsample, radius=radius,
+                                  timeout=timeout):
             print(image_path + ' cannot be solved!')
             return (False)
         else:
-            os.system("mv {0}.new {0}_new.fits".format(root))
-            print("{0}.fits --> {0}_new.fits: solved!".format(root))
+            print("{0} --> {1}: solved!".format(image_path, outfile))
             return (True)
 
     except Exception as e:
         print(e)
+
+
+def solve_fields(images, max_jobs=runner.MAX_JOBS, **kwargs):
+    """
+    Runs solve_field on several images at once.
+
+    @param images: FITS image file names with path
+    @type images: list
+    @param max_jobs: Maximum number of solve-field runs at once (0: number
+    of CPUs).
+    @type max_jobs: integer
+    @param kwargs: Arguments of solve_field.
+    @return: list of boolean
+    """
+
+    return runner.parallel(lambda image: solve_field(image, **kwargs),
+                           images, max_jobs=max_jobs)
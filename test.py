@@ -0,0 +1,128 @@
+#!/usr/bin/env py.test
+# Run from the A-Track folder (the modules read ./atrack.config), with
+# alipy on the path.
+from __future__ import print_function, division
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.wcs import WCS
+
+import difference
+import sources
+from mpcreporter.astronomy import AstCalc
+from mpcreporter.orbits import OrbitOps
+
+
+def make_wcs(shape=(2048, 1024)):
+    """A TAN WCS of 1 arcsec pixels, centered on the frame (FITS pixels
+    start at 1)."""
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [150.0, 20.0]
+    wcs.wcs.crpix = [shape[0] / 2 + 1, shape[1] / 2 + 1]
+    wcs.wcs.cd = [[-1 / 3600, 0], [0, 1 / 3600]]
+    wcs.pixel_shape = shape
+    return wcs
+
+
+def test_wcs_file_footprint(tmp_path):
+    wcsfile = str(tmp_path / 'frame.wcs')
+    sources.write_wcs(wcsfile, make_wcs(), create=True)
+
+    header = fits.getheader(wcsfile)
+    assert (header['IMAGEW'], header['IMAGEH']) == (2048, 1024)
+
+    footprint = AstCalc().frame_footprint(wcsfile)
+    assert footprint is not None
+    ra, dec, radius = footprint
+    assert ra == pytest.approx(150.0)
+    assert dec == pytest.approx(20.0)
+    # Half of the diagonal of a 2048 x 1024 arcsec frame.
+    assert radius == pytest.approx(np.hypot(1024, 512) / 60, rel=1e-3)
+
+
+def test_image_footprint(tmp_path):
+    fitsfile = str(tmp_path / 'frame.fits')
+    fits.PrimaryHDU(np.zeros((1024, 2048), dtype=np.float32),
+                    header=make_wcs().to_header()).writeto(fitsfile)
+
+    ra, dec, radius = AstCalc().frame_footprint(fitsfile)
+    assert (ra, dec) == pytest.approx((150.0, 20.0))
+    assert radius == pytest.approx(np.hypot(1024, 512) / 60, rel=1e-3)
+
+
+def test_clip_rejects_outlier():
+    rng = np.random.RandomState(0)
+    stack = rng.normal(100.0, 1.0, (7, 20, 20)).astype(np.float32)
+    stack[3, 5, 5] = 1000.0
+
+    # With 7 frames, the outlier is within 3 standard deviations of the
+    # median; it has to be rejected by the robust σ.
+    sky = difference.combine(stack, 'clip', 3.0)
+    assert sky[5, 5] == pytest.approx(100.0, abs=2.0)
+    assert np.all(np.abs(sky - 100.0) < 2.0)
+
+
+def mpcorb_record(designation, name, M, peri, node, incl, e, a):
+    """An MPCORB.DAT record (epoch 2025 May 5.0 TT); the fields are placed
+    at their 1-based MPC columns."""
+    record = [" "] * 202
+
+    def put(first, text):
+        record[first - 1:first - 1 + len(text)] = text
+
+    put(1, "{0:<7}".format(designation))
+    put(9, "{0:5.2f}".format(3.34))
+    put(15, "{0:5.2f}".format(0.15))
+    put(21, "K2555")
+    put(27, "{0:9.5f}".format(M))
+    put(38, "{0:9.5f}".format(peri))
+    put(49, "{0:9.5f}".format(node))
+    put(60, "{0:9.5f}".format(incl))
+    put(71, "{0:9.7f}".format(e))
+    put(81, "{0:11.8f}".format(0.98560767 / a ** 1.5))
+    put(93, "{0:11.7f}".format(a))
+    put(167, "{0:<28}".format(name))
+    return "".join(record).rstrip()
+
+
+def write_mpcorb(database, records):
+    with open(database, "w") as f:
+        f.write("MPCORB test fixture\n")
+        f.write("-" * 160 + "\n")
+        f.write("\n".join(records) + "\n")
+
+
+def test_find_objects_after_mpcorb_update(tmp_path):
+    ceres = mpcorb_record("00001", "(1) Ceres", 10.0, 73.4, 80.3, 10.6,
+                          0.0790, 2.767)
+    pallas = mpcorb_record("00002", "(2) Pallas", 190.0, 310.9, 172.9,
+                           34.9, 0.2300, 2.771)
+    database = str(tmp_path / "MPCORB.DAT")
+    cache_dir = str(tmp_path / "cache")
+    odate = datetime(2025, 5, 5, 21, 0)
+
+    write_mpcorb(database, [ceres, pallas])
+    orbitops = OrbitOps(database, cache_dir=cache_dir)
+    ra, dec = orbitops.predict(odate, "500")
+
+    expected = [("00001", "Ceres"), ("00002", "Pallas")]
+    for i, known in enumerate(expected):
+        rows = orbitops.find_objects(odate, ra[i], dec[i], radius=5,
+                                     observatory="500")
+        assert [tuple(row[:2]) for row in rows] == [known]
+
+    # The same rows in another order, and so the same size: the cached
+    # positions of the night must not be reused.
+    write_mpcorb(database, [pallas, ceres])
+    stat = os.stat(database)
+    os.utime(database, (stat.st_atime, stat.st_mtime + 10))
+
+    orbitops = OrbitOps(database, cache_dir=cache_dir)
+    rows = orbitops.find_objects(odate, ra[0], dec[0], radius=5,
+                                 observatory="500")
+    assert [tuple(row[:2]) for row in rows] == [("00001", "Ceres")]
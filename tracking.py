@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+# Authors: Yücel Kılıç, Murat Kaplan, Nurdan Karapınar, Tolga Atay.
+# This is an open-source software licensed under GPLv3.
+
+
+try:
+    from astropy.io import fits
+    from astropy.wcs import WCS
+except ImportError:
+    print('Python cannot import astropy. Make sure astropy is installed.')
+    raise SystemExit
+
+try:
+    import numpy as np
+except ImportError:
+    print('Python cannot import numpy. Make sure numpy is installed.')
+    raise SystemExit
+
+try:
+    import pandas as pd
+except ImportError:
+    print('Python cannot import pandas. Make sure pandas is installed.')
+    raise SystemExit
+
+try:
+    import frames
+except ImportError:
+    print('Python cannot import frames.py. Make sure frames.py is in',
+          'the same folder as tracking.py.')
+    raise SystemExit
+
+import glob
+import os
+import time
+from multiprocessing import Pool, cpu_count
+from configparser import ConfigParser
+
+config = ConfigParser()
+
+if os.path.exists('./atrack.config'):
+    config.read('./atrack.config')
+else:
+    print('Python cannot open the configuration file. Make sure atrack.config',
+          'is in the same folder as atrack.py.')
+    raise SystemExit
+
+# Velocity grid step (pixel of drift over the whole sequence), size of the
+# blocks the stacks are summed in (pixel), FWHM of the matched filter (pixel,
+# 0 = none) and detection limit in the stacks (σ).
+STEP = config.getfloat('tracking', 'STEP', fallback=1.0)
+BLOCK = config.getint('tracking', 'BLOCK', fallback=256)
+KERNEL_FWHM = config.getfloat('tracking', 'KERNEL_FWHM', fallback=2.5)
+SNR_MIN = config.getfloat('tracking', 'SNR_MIN', fallback=7.0)
+
+# Detections of the search, as written to tracking.csv.
+COLUMNS = ['x', 'y', 'alpha_J2000', 'delta_J2000', 'vx', 'vy', 'speed',
+           'snr']
+
+
+def epoch(header):
+
+    '''
+    Mid-exposure time of a frame, from its DATE-OBS (and TIME-OBS) and
+    EXPTIME keywords.
+
+    @param header: Header of the frame.
+    @type header: astropy.io.fits.Header
+    @return: float (sec.)
+    '''
+
+    obs_date = header['date-obs']
+    if "T" not in obs_date:
+        obs_date = "{0}T{1}".format(obs_date.strip(),
+                                    header['time-obs'].strip())
+
+    try:
+        obs_time = time.strptime(obs_date, '%Y-%m-%dT%H:%M:%S.%f')
+    except ValueError:
+        obs_time = time.strptime(obs_date, '%Y-%m-%dT%H:%M:%S')
+
+    return(time.mktime(obs_time) + header.get('exptime', 0) / 2)
+
+
+def velocities(span, vmin, vmax, step=STEP):
+
+    '''
+    Grid of the velocities searched. Neighbouring velocities drift apart by
+    step pixels over the sequence; the speeds are between vmin and vmax.
+
+    @param span: Time between the first and last frames (sec.).
+    @type span: float
+    @param vmin: Minimum speed (pixel/sec.).
+    @type vmin: float
+    @param vmax: Maximum speed (pixel/sec.).
+    @type vmax: float
+    @param step: Grid step (pixel over the sequence).
+    @type step: float
+    @return: numpy.ndarray (vx, vy)
+    '''
+
+    dv = step / span
+    axis = np.arange(-vmax, vmax + dv / 2, dv)
+    vx, vy = np.meshgrid(axis, axis)
+    speed = np.hypot(vx, vy)
+    keep = (speed >= vmin) & (speed <= vmax)
+
+    return(np.column_stack((vx[keep], vy[keep])))
+
+
+def offsets(grid, epochs):
+
+    '''
+    Integer pixel offsets of the frames for each velocity, without the
+    velocities that give the same offsets as an earlier one.
+
+    @param grid: Velocities (vx, vy) (pixel/sec.).
+    @type grid: numpy.ndarray
+    @param epochs: Frame times from the first frame (sec.).
+    @type epochs: numpy.ndarray
+    @return: numpy.ndarray (velocity, frame, dx/dy), numpy.ndarray
+    '''
+
+    shifts = np.rint(grid[:, None, :] * epochs[None, :, None]).astype(int)
+    shifts, unique = np.unique(shifts, axis=0, return_index=True)
+
+    return(shifts, grid[unique])
+
+
+def gaussian_filter(data, fwhm):
+
+    '''
+    Convolves a frame with a normalized Gaussian through FFTs.
+
+    @param data: Frame.
+    @type data: numpy.ndarray
+    @param fwhm: FWHM of the Gaussian (pixel).
+    @type fwhm: float
+    @return: numpy.ndarray
+    '''
+
+    sigma = fwhm / 2.3548
+    ny, nx = data.shape
+    fy = np.fft.fftfreq(ny)[:, None]
+    fx = np.fft.rfftfreq(nx)[None, :]
+    kernel = np.exp(-2 * (np.pi * sigma) ** 2 * (fx ** 2 + fy ** 2))
+
+    return(np.fft.irfft2(np.fft.rfft2(data) * kernel, s=data.shape))
+
+
+def normalize(fitsfile, fwhm=KERNEL_FWHM):
+
+    '''
+    A frame in units of its noise: sky subtracted, matched filtered and
+    divided by the robust standard deviation. Pixels without data are 0.
+
+    @param fitsfile: FITS file.
+    @type fitsfile: string
+    @param fwhm: FWHM of the matched filter (pixel, 0 = none).
+    @type fwhm: float
+    @return: numpy.ndarray
+    '''
+
+    data = np.array(frames.data(fitsfile, np.float32), dtype=np.float64)
+    data[~np.isfinite(data)] = np.nanmedian(data)
+    data -= np.median(data[::4, ::4])
+
+    if fwhm > 0:
+        data = gaussian_filter(data, fwhm)
+
+    sample = data[::4, ::4]
+    sigma = 1.4826 * np.median(np.abs(sample - np.median(sample)))
+    if sigma > 0:
+        data /= sigma
+
+    return(data.astype(np.float32))
+
+
+def search_block(BSS):
+
+    '''
+    Sums the shifted frames for each velocity in a block of the stack, and
+    keeps the highest sum at each pixel with the velocity giving it. The
+    frames are read once for the block, with a margin for the largest
+    offset; each sum is then made of plain slices.
+
+    @param BSS: Tuple (stack file, block (y0, y1, x0, x1), offsets).
+    @type BSS: tuple
+    @return: tuple (block, best sum, index of the velocity)
+    '''
+
+    stackfile, block, shifts = BSS[0], BSS[1], BSS[2]
+    stack = np.load(stackfile, mmap_mode='r')
+    nframes, ny, nx = stack.shape
+    y0, y1, x0, x1 = block
+    h, w = y1 - y0, x1 - x0
+    r = int(np.abs(shifts).max())
+
+    # The block and its margin, zero outside the frames.
+    region = np.zeros((nframes, h + 2 * r, w + 2 * r), dtype=np.float32)
+    ry0, ry1 = max(y0 - r, 0), min(y1 + r, ny)
+    rx0, rx1 = max(x0 - r, 0), min(x1 + r, nx)
+    region[:, ry0 - y0 + r:ry1 - y0 + r, rx0 - x0 + r:rx1 - x0 + r] = \
+        stack[:, ry0:ry1, rx0:rx1]
+
+    best = np.full((h, w), -np.inf, dtype=np.float32)
+    index = np.zeros((h, w), dtype=np.int32)
+    better = np.empty((h, w), dtype=bool)
+
+    # partial[i] is the sum of the frames before i. The offsets are sorted,
+    # so consecutive velocities share the offsets of their first frames,
+    # and only the sums after the first different offset are redone.
+    partial = np.zeros((nframes + 1, h, w), dtype=np.float32)
+    previous = None
+
+    for k, shift in enumerate(shifts):
+        first = 0
+        if previous is not None:
+            first = np.argmax(np.any(shift != previous, axis=1))
+        for i in range(first, nframes):
+            dx, dy = shift[i]
+            np.add(partial[i], region[i, r + dy:r + dy + h, r + dx:r + dx + w],
+                   out=partial[i + 1])
+        previous = shift
+
+        np.greater(partial[nframes], best, out=better)
+        np.copyto(best, partial[nframes], where=better)
+        np.copyto(index, k, where=better)
+
+    return(block, best / np.sqrt(nframes), index)
+
+
+def peaks(snr, threshold):
+
+    '''
+    Local maxima of a map above a threshold, the brightest first.
+
+    @param snr: Map.
+    @type snr: numpy.ndarray
+    @param threshold: Lowest value of a peak.
+    @type threshold: float
+    @return: numpy.ndarray (y, x)
+    '''
+
+    padded = np.pad(snr, 1, mode='constant', constant_values=-np.inf)
+    ismax = snr >= threshold
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy or dx:
+                ismax &= snr >= padded[1 + dy:1 + dy + snr.shape[0],
+                                       1 + dx:1 + dx + snr.shape[1]]
+
+    y, x = np.nonzero(ismax)
+    order = np.argsort(-snr[y, x], kind='stable')
+
+    return(np.column_stack((y[order], x[order])))
+
+
+def distinct(positions, grid, epochs, radius, nmin=2):
+
+    '''
+    Drops the detections whose track passes within radius of the track of
+    a brighter detection in nmin frames or more. Velocities close to the
+    one of an object align a part of its images, and give such fainter
+    copies of its detection.
+
+    @param positions: Positions (x, y) at the first epoch, the brightest
+    detection first.
+    @type positions: numpy.ndarray
+    @param grid: Velocities (vx, vy) of the detections (pixel/sec.).
+    @type grid: numpy.ndarray
+    @param epochs: Frame times from the first frame (sec.).
+    @type epochs: numpy.ndarray
+    @param radius: Distance below which the tracks coincide (pixel).
+    @type radius: float
+    @param nmin: Number of coinciding frames.
+    @type nmin: integer
+    @return: list (indices of the kept detections)
+    '''
+
+    tracks = positions[:, None, :] + grid[:, None, :] * epochs[None, :, None]
+    kept = []
+
+    for j in range(len(tracks)):
+        if all(np.sum(np.hypot(*(tracks[j] - tracks[q]).T) <= radius) < nmin
+               for q in kept):
+            kept.append(j)
+
+    return(kept)
+
+
+def search(fitsdir, outdir,
+           SPEED_MIN=float(config.get('asteroids', 'SPEED_MIN')),
+           V_MAX=float(config.get('asteroids', 'V_MAX')),
+           SCALE=float(config.get('asteroids', 'SCALE')),
+           step=STEP, block=BLOCK, fwhm=KERNEL_FWHM, snr_min=SNR_MIN,
+           processes=None):
+
+    '''
+    Synthetic tracking search for moving objects too faint to be detected
+    in single frames. The aligned frames (difference images preferably,
+    so that the stars are removed) are shifted by the offsets a velocity
+    predicts from the frame epochs and summed, for a grid of velocities;
+    peaks of the sums are reported with their velocities. The sums are
+    computed with integer shifts in blocks of the frames, over a process
+    pool. Pixels of a frame are clipped to a third of the limit of a sum,
+    so objects bright enough to be detected in single frames are found at
+    lower SNRs than their true ones.
+
+    @param fitsdir: Directory of the aligned FITS files.
+    @type fitsdir: string
+    @param outdir: Output directory; detections are saved in tracking.csv.
+    @type outdir: string
+    @param SPEED_MIN: Minimum speed of a moving object ("/min).
+    @type SPEED_MIN: float
+    @param V_MAX: Maximum angular velocity of a moving object ("/sec).
+    @type V_MAX: float
+    @param SCALE: Pixel scale (arcsec).
+    @type SCALE: float
+    @param step: Velocity grid step (pixel over the sequence).
+    @type step: float
+    @param block: Size of the blocks (pixel).
+    @type block: integer
+    @param fwhm: FWHM of the matched filter (pixel, 0 = none).
+    @type fwhm: float
+    @param snr_min: Detection limit in the sums (σ).
+    @type snr_min: float
+    @param processes: Number of processes (default: number of CPUs).
+    @type processes: integer
+    @return: pandas.DataFrame
+    '''
+
+    fitsfiles = sorted(glob.glob(fitsdir + '/*.fits'))
+    if len(fitsfiles) < 3:
+        print('At least 3 frames are needed for synthetic tracking.')
+        return(pd.DataFrame(columns=COLUMNS))
+
+    epochs = np.array([epoch(frames.header(fitsfile))
+                       for fitsfile in fitsfiles])
+    epochs -= epochs[0]
+    span = np.ptp(epochs)
+    if span <= 0:
+        print('The frames have the same epoch; no motion can be tracked.')
+        return(pd.DataFrame(columns=COLUMNS))
+    shape = frames.data(fitsfiles[0]).shape
+
+    shifts, grid = offsets(velocities(span, SPEED_MIN / 60 / SCALE,
+                                      V_MAX / SCALE, step), epochs)
+    if not len(grid):
+        print('No velocity to search between SPEED_MIN and V_MAX.')
+        return(pd.DataFrame(columns=COLUMNS))
+
+    # The normalized frames, shared with the processes as a memory map.
+    # They are clipped so that sources in one or two frames (bright stars,
+    # cosmic rays, fast movers) stay below the limit in every sum.
+    clip = snr_min * np.sqrt(len(fitsfiles)) / 3
+    stackfile = os.path.join(outdir, 'tracking.npy')
+    stack = np.lib.format.open_memmap(stackfile, mode='w+', dtype=np.float32,
+                                      shape=(len(fitsfiles),) + shape)
+    for i, fitsfile in enumerate(fitsfiles):
+        stack[i] = np.clip(normalize(fitsfile, fwhm), -clip, clip)
+    stack.flush()
+    del stack
+
+    blocks = [(y0, min(y0 + block, shape[0]), x0, min(x0 + block, shape[1]))
+              for y0 in range(0, shape[0], block)
+              for x0 in range(0, shape[1], block)]
+    cmds = [tuple([stackfile, b, shifts]) for b in blocks]
+
+    snr = np.empty(shape, dtype=np.float32)
+    index = np.empty(shape, dtype=np.int32)
+
+    try:
+        with Pool(processes or cpu_count()) as pool:
+            for (y0, y1, x0, x1), best, k in pool.imap_unordered(
+                    search_block, cmds):
+                snr[y0:y1, x0:x1] = best
+                index[y0:y1, x0:x1] = k
+    finally:
+        os.remove(stackfile)
+
+    yx = peaks(snr, snr_min)
+    v = grid[index[yx[:, 0], yx[:, 1]]]
+    kept = distinct(yx[:, ::-1].astype(float), v, epochs, max(3, 2 * fwhm))
+    yx, v = yx[kept], v[kept]
+    y, x = yx[:, 0], yx[:, 1]
+
+    detections = pd.DataFrame(columns=COLUMNS, index=range(len(yx)),
+                              dtype=float)
+    detections['x'] = x + 1
+    detections['y'] = y + 1
+    detections['vx'] = v[:, 0]
+    detections['vy'] = v[:, 1]
+    detections['speed'] = np.hypot(v[:, 0], v[:, 1]) * SCALE * 60
+    detections['snr'] = snr[y, x]
+
+    try:
+        wcs = WCS(frames.header(fitsfiles[0]))
+        if wcs.has_celestial and len(yx):
+            alpha, delta = wcs.celestial.all_pix2world(x + 1, y + 1, 1)
+            detections['alpha_J2000'] = alpha
+            detections['delta_J2000'] = delta
+    except Exception as e:
+        print(e)
+
+    detections.to_csv(os.path.join(outdir, 'tracking.csv'), index=False)
+
+    return(detections)
@@ -3,12 +3,6 @@
 # This is an open-source software licensed under GPLv3.
 
 
-try:
-    from astropy.io import fits
-except ImportError:
-    print('Python cannot import astropy. Make sure astropy is installed.')
-    raise SystemExit
-
 try:
     import numpy as np
 except ImportError:
@@ -21,8 +15,17 @@ except ImportError:
     print('Python cannot import f2n. Make sure f2n is installed.')
     raise SystemExit
 
+try:
+    from PIL import Image, GifImagePlugin
+except ImportError:
+    print('Python cannot import PIL. Make sure pillow is installed.')
+    raise SystemExit
+
 import os
 from configparser import ConfigParser
+from multiprocessing import Pool, cpu_count
+
+import frames
 
 config = ConfigParser()
 
@@ -45,10 +48,12 @@ def fits2png(fitsfile, outdir, asteroid=None,
     @type fitsfile: string
     @param outdir: Output directory for the png files.
     @type outdir: string
-    @param asteroid: numpy array for the moving objects.
-    @type asteroid: numpy.ndarray
+    @param asteroid: Moving objects of the image, as a table or as
+    object_rows.
+    @type asteroid: astropy.table.Table, numpy.ndarray
     @param SPEED_MIN: Minimum speed of a moving object.
     @type SPEED_MIN: float
+    @return: PIL.Image
     '''
 
     try:
@@ -57,18 +62,18 @@ def fits2png(fitsfile, outdir, asteroid=None,
         print('Python cannot import f2n. Make sure f2n is installed.')
         raise SystemExit
 
-    image = f2n.fromfits(fitsfile, verbose=False)
+    image = f2n.f2nimage(frames.data(fitsfile).transpose(), verbose=False)
     image.setzscale('auto', 'auto')
     image.makepilimage('log', negative=False)
 
-    if len(asteroid) > 0:
+    if asteroid is not None and not isinstance(asteroid, np.ndarray):
+        asteroid = object_rows(asteroid)
+
+    if asteroid is not None and len(asteroid) > 0:
 
-        for i in range(len(asteroid)):
+        for x, y, speed, objectid in asteroid:
 
-            x = float(asteroid['x'][i].value)
-            y = float(asteroid['y'][i].value)
-            speed = float(asteroid['Sky Motion'][i].value)
-            label = '{0}'.format(int(asteroid['ObjectID'][i]))
+            label = '{0}'.format(int(objectid))
 
             if speed >= SPEED_MIN:
                 color = (0, 255, 0)
@@ -82,16 +87,327 @@ def fits2png(fitsfile, outdir, asteroid=None,
 
     fits_head = os.path.splitext(os.path.basename(fitsfile))[0]
 
-    hdu = fits.open(fitsfile)
-    obs_date = hdu[0].header['date-obs']
+    obs_date = frames.header(fitsfile)['date-obs']
     image.writeinfo([obs_date], colour=(255, 100, 0))
 
     image.tonet(os.path.join(outdir, fits_head + '.png'))
 
+    return image.pilimage
+
+
+def object_rows(asteroid):
+
+    '''
+    Converts an object table into plain (x, y, Sky Motion, ObjectID)
+    rows, which are cheap to send to worker processes.
+
+    @param asteroid: Moving objects.
+    @type asteroid: astropy.table.Table
+    @return: numpy.ndarray
+    '''
+
+    if len(asteroid) == 0:
+        return np.empty((0, 4))
+
+    return np.column_stack([np.asarray(asteroid[col], dtype=float)
+                            for col in ('x', 'y', 'Sky Motion', 'ObjectID')])
+
+
+def png_worker(cmd):
+
+    '''
+    Renders one PNG file in a worker process.
+
+    @param cmd: FITS file, output directory, object rows of the image and
+    the maximum animation frame size (None for no animation frame).
+    @type cmd: tuple
+    @return: tuple (FITS file, animation frame or None)
+    '''
+
+    fitsfile, outdir, rows, max_size = cmd
+    pilimage = fits2png(fitsfile, outdir, rows)
+
+    if max_size is None:
+        return fitsfile, None
+
+    return fitsfile, gif_frame(pilimage, max_size)
+
+
+def all_pngs(images, outdir, objects, animation=None,
+             GIF_MAX_SIZE=config.getint('visuals', 'GIF_MAX_SIZE',
+                                        fallback=800),
+             GIF_DELAY=config.getint('visuals', 'GIF_DELAY',
+                                     fallback=200)):
+
+    '''
+    Transforms all FITS images into PNG files in parallel. The PNG
+    names follow the FITS names, so their order does not depend on
+    which worker finishes first.
+
+    @param images: Sorted FITS files; FileID is the index in this list.
+    @type images: list
+    @param outdir: Output directory for the png files.
+    @type outdir: string
+    @param objects: Moving and uncertain objects.
+    @type objects: astropy.table.Table
+    @param animation: GIF file to stream the frames into (optional).
+    @type animation: string
+    @param GIF_MAX_SIZE: Maximum width and height of animation frames.
+    @type GIF_MAX_SIZE: integer
+    @param GIF_DELAY: Delay between animation frames (ms).
+    @type GIF_DELAY: integer
+    '''
+
+    file_ids = np.asarray(objects['FileID'], dtype=int)
+    rows = object_rows(objects)
+    max_size = GIF_MAX_SIZE if animation else None
+    cmds = [(image, outdir, rows[file_ids == i], max_size)
+            for i, image in enumerate(images)]
+
+    nCPU = min(cpu_count(), max(len(cmds), 1))
+    gif = GifWriter(animation, GIF_DELAY) if animation else None
+
+    try:
+        with Pool(nCPU) as pool:
+            for image, frame in pool.imap(png_worker, cmds):
+                print('{0} converted to png.'.format(image))
+                if gif is not None:
+                    gif.append(frame)
+    finally:
+        if gif is not None:
+            gif.close()
+
+
+def gif_palette():
+
+    '''
+    The palette shared by all animation frames: 248 gray levels and the
+    colours used for drawing.
+
+    @return: PIL.Image
+    '''
+
+    grays = np.round(np.linspace(0, 255, 248)).astype(np.uint8)
+    colours = [(0, 255, 0), (255, 0, 0), (255, 100, 0), (255, 255, 0),
+               (0, 0, 255), (0, 255, 255), (255, 0, 255), (255, 128, 128)]
+    palette = np.concatenate([np.repeat(grays, 3),
+                              np.ravel(colours).astype(np.uint8)])
+
+    image = Image.new('P', (1, 1))
+    image.putpalette(palette.tobytes())
+
+    return image
+
+
+def gif_frame(pilimage, max_size):
+
+    '''
+    Downsamples a rendered frame and maps it to the shared palette.
+
+    @param pilimage: Rendered frame.
+    @type pilimage: PIL.Image
+    @param max_size: Maximum width and height (pixel).
+    @type max_size: integer
+    @return: PIL.Image
+    '''
+
+    frame = pilimage.convert('RGB')
+    frame.thumbnail((max_size, max_size))
+
+    return frame.quantize(palette=gif_palette(), dither=0)
+
+
+class GifWriter:
+
+    def __init__(self, outfile, delay=200, loop=0):
+
+        '''
+        Writes an animated GIF frame by frame, so only the current frame
+        is kept in memory. All frames have to use gif_palette.
+
+        @param outfile: GIF file.
+        @type outfile: string
+        @param delay: Delay between frames (ms).
+        @type delay: integer
+        @param loop: Number of loops (0 = forever).
+        @type loop: integer
+        '''
+
+        self.outfile = outfile
+        self.delay = delay
+        self.loop = loop
+        self.fp = open(outfile, 'wb')
+        self.nframes = 0
+
+    def append(self, frame):
+
+        '''
+        Appends a frame to the animation.
+
+        @param frame: Frame made by gif_frame.
+        @type frame: PIL.Image
+        '''
+
+        if self.nframes == 0:
+            header, _ = GifImagePlugin.getheader(
+                frame, info={'loop': self.loop, 'duration': self.delay,
+                             'optimize': False})
+            for block in header:
+                self.fp.write(block)
+
+        for block in GifImagePlugin.getdata(frame, duration=self.delay,
+                                            optimize=False):
+            self.fp.write(block)
+
+        self.nframes += 1
+
+    def close(self):
+
+        '''
+        Writes the GIF trailer and closes the file.
+        '''
+
+        if not self.fp.closed:
+            self.fp.write(b';')
+            self.fp.close()
+
+
+def stamp(fitsfile, x, y, size):
+
+    '''
+    Reads a size x size window around (x, y) of a memory-mapped FITS
+    file. The window is shifted to stay inside the frame, and the
+    returned f2n image keeps the frame's coordinates for drawing.
+
+    @param fitsfile: FITS file.
+    @type fitsfile: string
+    @param x: x coordinate of the object (FITS convention).
+    @type x: float
+    @param y: y coordinate of the object (FITS convention).
+    @type y: float
+    @param size: Width and height of the window (pixel).
+    @type size: integer
+    @return: f2n.f2nimage
+    '''
+
+    header = frames.header(fitsfile)
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+    width, height = min(size, nx), min(size, ny)
+    x0 = int(np.clip(round(x - 1) - width // 2, 0, nx - width))
+    y0 = int(np.clip(round(y - 1) - height // 2, 0, ny - height))
+    section = frames.section(fitsfile, y0, y0 + height, x0, x0 + width)
+
+    image = f2n.f2nimage(section.transpose(), verbose=False)
+    image.xa, image.ya = x0, y0
+    image.xb, image.yb = x0 + width, y0 + height
+
+    return image
+
+
+def stamp_worker(cmd,
+                 SPEED_MIN=float(config.get('asteroids', 'SPEED_MIN'))):
+
+    '''
+    Renders the stamps of one object in every frame and composes them
+    into a single mosaic.
+
+    @param cmd: FITS files, output directory, FileIDs and object rows of
+    the object, stamp size and upsampling factor.
+    @type cmd: tuple
+    @return: string
+    '''
+
+    images, outdir, file_ids, rows, size, factor = cmd
+    x, y, speed, objectid = rows.T
+
+    # Frames without a detection get the position from the linear motion.
+    indices = np.arange(len(images))
+    if len(rows) > 1:
+        xs = np.polyval(np.polyfit(file_ids, x, 1), indices)
+        ys = np.polyval(np.polyfit(file_ids, y, 1), indices)
+    else:
+        xs = np.full(len(images), x[0])
+        ys = np.full(len(images), y[0])
+    xs[file_ids] = x
+    ys[file_ids] = y
+
+    if speed[0] >= SPEED_MIN:
+        color = (0, 255, 0)
+    else:
+        color = (255, 0, 0)
+
+    stamps = []
+    for i, image in enumerate(images):
+        img = stamp(image, xs[i], ys[i], size)
+        img.setzscale('auto', 'auto', border=0)
+        img.makepilimage('log', negative=False)
+        img.upsample(factor)
+        img.drawcircle(xs[i], ys[i], r=size / 4.0,
+                       colour=color if i in file_ids else (255, 255, 0))
+        img.writetitle('{0}'.format(i))
+        stamps.append(img)
+
+    # Rows of the mosaic have to be equally wide; blank stamps fill the
+    # last one.
+    ncols = int(np.ceil(np.sqrt(len(stamps))))
+    while len(stamps) % ncols:
+        blank = f2n.f2nimage(shape=stamps[0].numpyarray.shape, fill=0.0,
+                             verbose=False)
+        blank.setzscale(0.0, 1.0)
+        blank.makepilimage('lin', negative=False)
+        blank.upsample(factor)
+        stamps.append(blank)
+
+    outfile = os.path.join(outdir,
+                           'object_{0}.png'.format(int(objectid[0])))
+    f2n.compose([stamps[i:i + ncols]
+                 for i in range(0, len(stamps), ncols)], outfile)
+
+    return outfile
+
+
+def all_stamps(images, outdir, objects,
+               STAMP_SIZE=config.getint('visuals', 'STAMP_SIZE',
+                                        fallback=64),
+               STAMP_UPSAMPLE=config.getint('visuals', 'STAMP_UPSAMPLE',
+                                            fallback=3)):
+
+    '''
+    Creates one postage stamp mosaic (object_<ObjectID>.png) per moving
+    or uncertain object. Only a small window around the object is read
+    from each frame.
+
+    @param images: Sorted FITS files; FileID is the index in this list.
+    @type images: list
+    @param outdir: Output directory for the png files.
+    @type outdir: string
+    @param objects: Moving and uncertain objects.
+    @type objects: astropy.table.Table
+    @param STAMP_SIZE: Width and height of the stamps (pixel).
+    @type STAMP_SIZE: integer
+    @param STAMP_UPSAMPLE: Upsampling factor of the stamps.
+    @type STAMP_UPSAMPLE: integer
+    '''
+
+    file_ids = np.asarray(objects['FileID'], dtype=int)
+    rows = object_rows(objects)
+    cmds = []
+
+    for objectid in np.unique(rows[:, 3]):
+        this = rows[:, 3] == objectid
+        cmds.append((images, outdir, file_ids[this], rows[this],
+                     STAMP_SIZE, STAMP_UPSAMPLE))
+
+    nCPU = min(cpu_count(), max(len(cmds), 1))
+
+    with Pool(nCPU) as pool:
+        for outfile in pool.imap(stamp_worker, cmds):
+            print('{0} created.'.format(outfile))
+
 
 def object_plot(fitsfile, catalog):
 
-    image = f2n.fromfits(fitsfile, verbose=False)
+    image = f2n.f2nimage(frames.data(fitsfile).transpose(), verbose=False)
     image.setzscale('auto', 'auto')
     image.makepilimage('log', negative=False)
 